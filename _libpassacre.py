@@ -7,16 +7,68 @@ ffi.cdef("""
 enum passacre_gen_algorithm {
     PASSACRE_KECCAK,
     PASSACRE_SKEIN,
+    PASSACRE_KECCAK_WIDE,
     ...
 };
 
 struct passacre_gen_state;
 
+struct passacre_gen_job {
+    enum passacre_gen_algorithm algorithm;
+    const unsigned char *username;
+    size_t username_length;
+    const unsigned char *password;
+    size_t password_length;
+    const unsigned char *site;
+    size_t site_length;
+    size_t iterations;
+    size_t output_length;
+};
+
+struct passacre_multibase {
+    size_t n_runs;
+    const size_t *run_lengths;
+    const size_t *run_bases;
+    size_t n_bases;
+    const size_t *radices;
+    const size_t *longest_symbols;
+    const size_t *const *symbol_offsets;
+    const unsigned char *const *symbols;
+    size_t n_bytes;
+    size_t n_bits;
+};
+
+struct passacre_gen_stats {
+    unsigned long long bytes_absorbed;
+    unsigned long long null_rounds;
+    unsigned long long absorb_blocks;
+    unsigned long long bytes_squeezed;
+    unsigned long long squeeze_blocks;
+    unsigned long long rejections;
+};
+
+const char *passacre_keccak_impl_name(size_t);
+int passacre_keccak_impl_supported(size_t);
+const char *passacre_keccak_active_impl(void);
+int passacre_keccak_select_impl(const char *);
+const char *passacre_skein_impl_name(size_t);
+const char *passacre_skein_active_impl(void);
+int passacre_skein_select_impl(const char *);
+unsigned int passacre_keccak_lanes(void);
+int passacre_keccak_set_lanes(unsigned int);
+
 size_t passacre_gen_size(void);
 int passacre_gen_init(struct passacre_gen_state *, enum passacre_gen_algorithm);
 int passacre_gen_absorb_username_password_site(struct passacre_gen_state *, const unsigned char *, size_t, const unsigned char *, size_t, const unsigned char *, size_t);
 int passacre_gen_absorb_null_rounds(struct passacre_gen_state *, size_t);
 int passacre_gen_squeeze(struct passacre_gen_state *, unsigned char *, size_t);
+int passacre_gen_squeeze_multibase(struct passacre_gen_state *, const struct passacre_multibase *, unsigned char *, size_t *);
+int passacre_gen_encode_multibase(struct passacre_gen_state *, const unsigned char *, const struct passacre_multibase *, unsigned char *, size_t *);
+int passacre_gen_get_stats(struct passacre_gen_state *, struct passacre_gen_stats *);
+int passacre_gen_export_state(struct passacre_gen_state *, unsigned char *, size_t);
+int passacre_gen_import_state(struct passacre_gen_state *, const unsigned char *, size_t);
+int passacre_gen_batch(const struct passacre_gen_job *, size_t, struct passacre_gen_state *, unsigned char *);
+int passacre_gen_generate(const struct passacre_gen_job *, const struct passacre_multibase *, unsigned char *, size_t *);
 
 """)
 
@@ -0,0 +1,52 @@
+"""Compare MultiBase.encode against encoding one digit at a time.
+
+Usage: python admin/bench-multibase.py [words-file]
+"""
+
+from __future__ import print_function
+
+import random
+import sys
+import timeit
+
+from passacre.schema import multibase_of_schema
+
+
+def per_digit_encode(bases, n):
+    ret = []
+    for base in reversed(bases):
+        n, d = divmod(n, len(base))
+        ret.append(base[d])
+    ret.reverse()
+    return ''.join(ret)
+
+
+def best_of(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def main(words):
+    schemata = [('printable', 'printable'), ('digit', 'digit'), ('base64', ['alphanumeric', '-_'])]
+    if words:
+        schemata.append(('word', 'word'))
+    rng = random.Random(0)
+    print('%-10s %6s %14s %14s %8s' % ('schema', 'digits', 'per-digit us', 'encode us', 'speedup'))
+    for name, item in schemata:
+        for n_digits in [64, 256, 1024, 4096]:
+            mb = multibase_of_schema([[n_digits, item]], words)
+            value = rng.randrange(mb.max_encodable_value + 1)
+            bases = mb.bases
+            assert mb.encode(value) == per_digit_encode(bases, value)
+            number = max(1, 20000 // n_digits)
+            old = best_of(lambda: per_digit_encode(bases, value), number)
+            new = best_of(lambda: mb.encode(value), number)
+            print('%-10s %6d %14.1f %14.1f %7.1fx' % (
+                name, n_digits, old * 1e6, new * 1e6, old / new))
+
+
+if __name__ == '__main__':
+    words = None
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as infile:
+            words = [line.strip() for line in infile if line.strip()]
+    main(words)
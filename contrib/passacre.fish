@@ -52,6 +52,7 @@ complete -f -c passacre -n '__fish_passacre_using_command passacre generate ' -s
 complete -f -c passacre -n '__fish_passacre_using_command passacre generate ' -s u -l username -d 'username for the site'
 complete -f -c passacre -n '__fish_passacre_using_command passacre generate ' -s n -l no-newline -d "don't write a newline after the password"
 complete -f -c passacre -n '__fish_passacre_using_command passacre generate ' -s c -l confirm -d 'confirm prompted password'
+complete -f -c passacre -n '__fish_passacre_using_command passacre generate '  -l stats -d 'write counts of the hashing work done to stderr'
 complete -f -c passacre -n '__fish_passacre_using_command passacre info ' -s h -l help -d 'show this help message and exit'
 complete -f -c passacre -n '__fish_passacre_using_command passacre init ' -s h -l help -d 'show this help message and exit'
 complete -f -c passacre -n '__fish_passacre_using_command passacre init '   -a '()'
@@ -100,12 +101,12 @@ complete -f -c passacre -n '__fish_passacre_using_command passacre site config "
 complete -f -c passacre -n '__fish_passacre_using_command passacre site hash ' -s h -l help -d 'show this help message and exit'
 complete -f -c passacre -n '__fish_passacre_using_command passacre site hash '   -a '(__fish_passacre_sites)'
 complete -f -c passacre -n '__fish_passacre_using_command passacre site hash '   -d 'the site to hash'
-complete -f -c passacre -n '__fish_passacre_using_command passacre site hash ' -s m -l method -a 'keccak skein'
+complete -f -c passacre -n '__fish_passacre_using_command passacre site hash ' -s m -l method -a 'keccak keccak-v2 keccak-wide shake256 skein skein-v2'
 complete -f -c passacre -n '__fish_passacre_using_command passacre site hash ' -s m -l method -d 'which hash method to use'
 complete -f -c passacre -n '__fish_passacre_using_command passacre site hash ' -s n -l no-newline -d "don't write a newline after the hash"
 complete -f -c passacre -n '__fish_passacre_using_command passacre site hash ' -s c -l confirm -d 'confirm prompted password'
 complete -f -c passacre -n '__fish_passacre_using_command passacre site hash-all ' -s h -l help -d 'show this help message and exit'
-complete -f -c passacre -n '__fish_passacre_using_command passacre site hash-all ' -s m -l method -a 'keccak skein'
+complete -f -c passacre -n '__fish_passacre_using_command passacre site hash-all ' -s m -l method -a 'keccak keccak-v2 keccak-wide shake256 skein skein-v2'
 complete -f -c passacre -n '__fish_passacre_using_command passacre site hash-all ' -s m -l method -d 'which hash method to use'
 complete -f -c passacre -n '__fish_passacre_using_command passacre site hash-all ' -s c -l confirm -d 'confirm prompted password'
 complete -f -c passacre -n '__fish_passacre_using_command passacre site remove ' -s h -l help -d 'show this help message and exit'
@@ -0,0 +1,155 @@
+/*
+ * Copyright (c) Aaron Gallagher <_@habnab.it>
+ * See COPYING for details.
+ */
+
+/*
+ * Keccak-f[1600] applied to PASSACRE_KECCAK_LANES independent states at once.
+ * Each state is a plain little-endian array of 25 lanes; the lanes of every
+ * state are interleaved into vectors so that each operation of the
+ * permutation works on all of the states together. This file is compiled
+ * once per lane count, with whatever instruction set flags that needs.
+ */
+
+#include <stdint.h>
+#include <string.h>
+#include "keccak-lanes.h"
+
+#define PASSACRE_KECCAK_LANES_NAME__(lanes) passacre_keccak_permute_lanes ## lanes
+#define PASSACRE_KECCAK_LANES_NAME_(lanes) PASSACRE_KECCAK_LANES_NAME__(lanes)
+#define PASSACRE_KECCAK_LANES_NAME PASSACRE_KECCAK_LANES_NAME_(PASSACRE_KECCAK_LANES)
+
+typedef uint64_t lanes_t __attribute__ ((vector_size (8 * PASSACRE_KECCAK_LANES)));
+
+#define ROL(v, n) (((v) << (n)) | ((v) >> (64 - (n))))
+
+static const uint64_t ROUND_CONSTANTS[24] = {
+    0x0000000000000001ULL, 0x0000000000008082ULL, 0x800000000000808aULL,
+    0x8000000080008000ULL, 0x000000000000808bULL, 0x0000000080000001ULL,
+    0x8000000080008081ULL, 0x8000000000008009ULL, 0x000000000000008aULL,
+    0x0000000000000088ULL, 0x0000000080008009ULL, 0x000000008000000aULL,
+    0x000000008000808bULL, 0x800000000000008bULL, 0x8000000000008089ULL,
+    0x8000000000008003ULL, 0x8000000000008002ULL, 0x8000000000000080ULL,
+    0x000000000000800aULL, 0x800000008000000aULL, 0x8000000080008081ULL,
+    0x8000000000008080ULL, 0x0000000080000001ULL, 0x8000000080008008ULL,
+};
+
+/*
+ * One round of the permutation, from the lanes named A## into the lanes named
+ * E##. Lanes are named by row (b, g, k, m, s) then column (a, e, i, o, u).
+ */
+#define ROUND(A, E, rc) do { \
+        Ca = A ## ba ^ A ## ga ^ A ## ka ^ A ## ma ^ A ## sa; \
+        Ce = A ## be ^ A ## ge ^ A ## ke ^ A ## me ^ A ## se; \
+        Ci = A ## bi ^ A ## gi ^ A ## ki ^ A ## mi ^ A ## si; \
+        Co = A ## bo ^ A ## go ^ A ## ko ^ A ## mo ^ A ## so; \
+        Cu = A ## bu ^ A ## gu ^ A ## ku ^ A ## mu ^ A ## su; \
+        Da = Cu ^ ROL(Ce, 1); \
+        De = Ca ^ ROL(Ci, 1); \
+        Di = Ce ^ ROL(Co, 1); \
+        Do = Ci ^ ROL(Cu, 1); \
+        Du = Co ^ ROL(Ca, 1); \
+        Ba = (A ## ba ^ Da); \
+        Be = ROL(A ## ge ^ De, 44); \
+        Bi = ROL(A ## ki ^ Di, 43); \
+        Bo = ROL(A ## mo ^ Do, 21); \
+        Bu = ROL(A ## su ^ Du, 14); \
+        E ## ba = Ba ^ (~Be & Bi); \
+        E ## be = Be ^ (~Bi & Bo); \
+        E ## bi = Bi ^ (~Bo & Bu); \
+        E ## bo = Bo ^ (~Bu & Ba); \
+        E ## bu = Bu ^ (~Ba & Be); \
+        Ba = ROL(A ## bo ^ Do, 28); \
+        Be = ROL(A ## gu ^ Du, 20); \
+        Bi = ROL(A ## ka ^ Da, 3); \
+        Bo = ROL(A ## me ^ De, 45); \
+        Bu = ROL(A ## si ^ Di, 61); \
+        E ## ga = Ba ^ (~Be & Bi); \
+        E ## ge = Be ^ (~Bi & Bo); \
+        E ## gi = Bi ^ (~Bo & Bu); \
+        E ## go = Bo ^ (~Bu & Ba); \
+        E ## gu = Bu ^ (~Ba & Be); \
+        Ba = ROL(A ## be ^ De, 1); \
+        Be = ROL(A ## gi ^ Di, 6); \
+        Bi = ROL(A ## ko ^ Do, 25); \
+        Bo = ROL(A ## mu ^ Du, 8); \
+        Bu = ROL(A ## sa ^ Da, 18); \
+        E ## ka = Ba ^ (~Be & Bi); \
+        E ## ke = Be ^ (~Bi & Bo); \
+        E ## ki = Bi ^ (~Bo & Bu); \
+        E ## ko = Bo ^ (~Bu & Ba); \
+        E ## ku = Bu ^ (~Ba & Be); \
+        Ba = ROL(A ## bu ^ Du, 27); \
+        Be = ROL(A ## ga ^ Da, 36); \
+        Bi = ROL(A ## ke ^ De, 10); \
+        Bo = ROL(A ## mi ^ Di, 15); \
+        Bu = ROL(A ## so ^ Do, 56); \
+        E ## ma = Ba ^ (~Be & Bi); \
+        E ## me = Be ^ (~Bi & Bo); \
+        E ## mi = Bi ^ (~Bo & Bu); \
+        E ## mo = Bo ^ (~Bu & Ba); \
+        E ## mu = Bu ^ (~Ba & Be); \
+        Ba = ROL(A ## bi ^ Di, 62); \
+        Be = ROL(A ## go ^ Do, 55); \
+        Bi = ROL(A ## ku ^ Du, 39); \
+        Bo = ROL(A ## ma ^ Da, 41); \
+        Bu = ROL(A ## se ^ De, 2); \
+        E ## sa = Ba ^ (~Be & Bi); \
+        E ## se = Be ^ (~Bi & Bo); \
+        E ## si = Bi ^ (~Bo & Bu); \
+        E ## so = Bo ^ (~Bu & Ba); \
+        E ## su = Bu ^ (~Ba & Be); \
+        E ## ba ^= (rc); \
+    } while (0)
+
+
+static void
+permute(lanes_t *a, unsigned long long n_permutations)
+{
+    lanes_t
+        Aba, Abe, Abi, Abo, Abu, Aga, Age, Agi, Ago, Agu, Aka, Ake, Aki, Ako, Aku,
+        Ama, Ame, Ami, Amo, Amu, Asa, Ase, Asi, Aso, Asu;
+    lanes_t
+        Eba, Ebe, Ebi, Ebo, Ebu, Ega, Ege, Egi, Ego, Egu, Eka, Eke, Eki, Eko, Eku,
+        Ema, Eme, Emi, Emo, Emu, Esa, Ese, Esi, Eso, Esu;
+    lanes_t Ba, Be, Bi, Bo, Bu, Ca, Ce, Ci, Co, Cu, Da, De, Di, Do, Du;
+    unsigned int round;
+    Aba = a[0]; Abe = a[1]; Abi = a[2]; Abo = a[3]; Abu = a[4];
+    Aga = a[5]; Age = a[6]; Agi = a[7]; Ago = a[8]; Agu = a[9];
+    Aka = a[10]; Ake = a[11]; Aki = a[12]; Ako = a[13]; Aku = a[14];
+    Ama = a[15]; Ame = a[16]; Ami = a[17]; Amo = a[18]; Amu = a[19];
+    Asa = a[20]; Ase = a[21]; Asi = a[22]; Aso = a[23]; Asu = a[24];
+    for (; n_permutations; --n_permutations) {
+        for (round = 0; round < 24; round += 2) {
+            ROUND(A, E, ROUND_CONSTANTS[round]);
+            ROUND(E, A, ROUND_CONSTANTS[round + 1]);
+        }
+    }
+    a[0] = Aba; a[1] = Abe; a[2] = Abi; a[3] = Abo; a[4] = Abu;
+    a[5] = Aga; a[6] = Age; a[7] = Agi; a[8] = Ago; a[9] = Agu;
+    a[10] = Aka; a[11] = Ake; a[12] = Aki; a[13] = Ako; a[14] = Aku;
+    a[15] = Ama; a[16] = Ame; a[17] = Ami; a[18] = Amo; a[19] = Amu;
+    a[20] = Asa; a[21] = Ase; a[22] = Asi; a[23] = Aso; a[24] = Asu;
+}
+
+
+void
+PASSACRE_KECCAK_LANES_NAME(unsigned char **states, unsigned long long n_permutations)
+{
+    lanes_t a[25];
+    uint64_t lane;
+    unsigned int i, j;
+    for (i = 0; i < 25; ++i) {
+        for (j = 0; j < PASSACRE_KECCAK_LANES; ++j) {
+            memcpy(&lane, states[j] + i * 8, 8);
+            a[i][j] = lane;
+        }
+    }
+    permute(a, n_permutations);
+    for (i = 0; i < 25; ++i) {
+        for (j = 0; j < PASSACRE_KECCAK_LANES; ++j) {
+            lane = a[i][j];
+            memcpy(states[j] + i * 8, &lane, 8);
+        }
+    }
+}
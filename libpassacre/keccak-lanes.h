@@ -0,0 +1,12 @@
+/*
+ * Copyright (c) Aaron Gallagher <_@habnab.it>
+ * See COPYING for details.
+ */
+
+#ifndef _PASSACRE_KECCAK_LANES_H_
+#define _PASSACRE_KECCAK_LANES_H_ 1
+
+void passacre_keccak_permute_lanes2(unsigned char **, unsigned long long);
+void passacre_keccak_permute_lanes4(unsigned char **, unsigned long long);
+
+#endif
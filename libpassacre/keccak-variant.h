@@ -0,0 +1,61 @@
+/*
+ * Copyright (c) Aaron Gallagher <_@habnab.it>
+ * See COPYING for details.
+ */
+
+/*
+ * This header is force-included when compiling each variant of the keccak
+ * sponge and permutation, so that several of them can be linked into
+ * libpassacre at once. PASSACRE_KECCAK_VARIANT names the variant, and every
+ * external symbol in the keccak sources is prefixed with it.
+ */
+
+#ifndef _PASSACRE_KECCAK_VARIANT_H_
+#define _PASSACRE_KECCAK_VARIANT_H_ 1
+
+#define PASSACRE_KECCAK_NAME__(variant, name) passacre_keccak_ ## variant ## _ ## name
+#define PASSACRE_KECCAK_NAME_(variant, name) PASSACRE_KECCAK_NAME__(variant, name)
+#define PASSACRE_KECCAK_NAME(name) PASSACRE_KECCAK_NAME_(PASSACRE_KECCAK_VARIANT, name)
+
+#define InitSponge PASSACRE_KECCAK_NAME(InitSponge)
+#define Absorb PASSACRE_KECCAK_NAME(Absorb)
+#define AbsorbQueue PASSACRE_KECCAK_NAME(AbsorbQueue)
+#define PadAndSwitchToSqueezingPhase PASSACRE_KECCAK_NAME(PadAndSwitchToSqueezingPhase)
+#define Squeeze PASSACRE_KECCAK_NAME(Squeeze)
+
+#define KeccakInitialize PASSACRE_KECCAK_NAME(KeccakInitialize)
+#define KeccakInitializeState PASSACRE_KECCAK_NAME(KeccakInitializeState)
+#define KeccakPermutation PASSACRE_KECCAK_NAME(KeccakPermutation)
+#define KeccakAbsorb PASSACRE_KECCAK_NAME(KeccakAbsorb)
+#define KeccakAbsorb576bits PASSACRE_KECCAK_NAME(KeccakAbsorb576bits)
+#define KeccakAbsorb832bits PASSACRE_KECCAK_NAME(KeccakAbsorb832bits)
+#define KeccakAbsorb1024bits PASSACRE_KECCAK_NAME(KeccakAbsorb1024bits)
+#define KeccakAbsorb1088bits PASSACRE_KECCAK_NAME(KeccakAbsorb1088bits)
+#define KeccakAbsorb1152bits PASSACRE_KECCAK_NAME(KeccakAbsorb1152bits)
+#define KeccakAbsorb1344bits PASSACRE_KECCAK_NAME(KeccakAbsorb1344bits)
+#define KeccakExtract PASSACRE_KECCAK_NAME(KeccakExtract)
+#define KeccakExtract1024bits PASSACRE_KECCAK_NAME(KeccakExtract1024bits)
+#define KeccakF1600RoundConstants PASSACRE_KECCAK_NAME(KeccakF1600RoundConstants)
+#define KeccakPermutationOnWords PASSACRE_KECCAK_NAME(KeccakPermutationOnWords)
+#define KeccakPermutationOnWordsAfterXoring PASSACRE_KECCAK_NAME(KeccakPermutationOnWordsAfterXoring)
+#define KeccakPermutationOnWordsAfterXoring576bits PASSACRE_KECCAK_NAME(KeccakPermutationOnWordsAfterXoring576bits)
+#define KeccakPermutationOnWordsAfterXoring832bits PASSACRE_KECCAK_NAME(KeccakPermutationOnWordsAfterXoring832bits)
+#define KeccakPermutationOnWordsAfterXoring1024bits PASSACRE_KECCAK_NAME(KeccakPermutationOnWordsAfterXoring1024bits)
+#define KeccakPermutationOnWordsAfterXoring1088bits PASSACRE_KECCAK_NAME(KeccakPermutationOnWordsAfterXoring1088bits)
+#define KeccakPermutationOnWordsAfterXoring1152bits PASSACRE_KECCAK_NAME(KeccakPermutationOnWordsAfterXoring1152bits)
+#define KeccakPermutationOnWordsAfterXoring1344bits PASSACRE_KECCAK_NAME(KeccakPermutationOnWordsAfterXoring1344bits)
+#define fromBytesToWord PASSACRE_KECCAK_NAME(fromBytesToWord)
+#define fromWordToBytes PASSACRE_KECCAK_NAME(fromWordToBytes)
+#define rho8_56 PASSACRE_KECCAK_NAME(rho8_56)
+
+/* only in the 32-bit bit-interleaved implementation */
+#define toInterleaving PASSACRE_KECCAK_NAME(toInterleaving)
+#define fromInterleaving PASSACRE_KECCAK_NAME(fromInterleaving)
+#define xor8bytesIntoInterleavedWords PASSACRE_KECCAK_NAME(xor8bytesIntoInterleavedWords)
+#define setInterleavedWordsInto8bytes PASSACRE_KECCAK_NAME(setInterleavedWordsInto8bytes)
+#define buildInterleaveTables PASSACRE_KECCAK_NAME(buildInterleaveTables)
+#define interleaveTablesBuilt PASSACRE_KECCAK_NAME(interleaveTablesBuilt)
+#define interleaveTable PASSACRE_KECCAK_NAME(interleaveTable)
+#define deinterleaveTable PASSACRE_KECCAK_NAME(deinterleaveTable)
+
+#endif
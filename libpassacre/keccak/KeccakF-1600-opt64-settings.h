@@ -1,3 +1,5 @@
+/* passacre: the build defines PASSACRE_KECCAK_SETTINGS when it picks these */
+#ifndef PASSACRE_KECCAK_SETTINGS
 #define Unrolling 24
 #define UseBebigokimisa
 //#define UseSSE
@@ -5,3 +7,4 @@
 //#define UseMMX
 //#define UseSHLD
 //#define UseXOP
+#endif
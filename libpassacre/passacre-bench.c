@@ -0,0 +1,334 @@
+/*
+ * Copyright (c) Aaron Gallagher <_@habnab.it>
+ * See COPYING for details.
+ */
+
+/*
+ * Benchmarks of the passacre_gen_* functions, for comparing compilers,
+ * compiler flags, and the keccak and skein implementations. Every supported
+ * implementation is benchmarked unless one is named on the command line:
+ *
+ *   passacre-bench [-t trials] [-k keccak-impl] [-s skein-impl]
+ *
+ * Each measurement is the best of several trials, and is reported as wall
+ * time per call and, where the cycle counter can be read, cycles per call and
+ * per byte absorbed or squeezed.
+ */
+
+#define _POSIX_C_SOURCE 199309L
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include <unistd.h>
+#include "passacre.h"
+
+
+#define PASSACRE_BENCH_DEFAULT_TRIALS 5
+
+static const size_t PASSACRE_BENCH_NULL_ROUNDS[] = {1, 10, 100, 1000};
+static const size_t PASSACRE_BENCH_SQUEEZE_BYTES[] = {32, 4096};
+
+static const unsigned char PASSACRE_BENCH_USERNAME[] = "passacre";
+static const unsigned char PASSACRE_BENCH_PASSWORD[] = "correct horse battery staple";
+static const unsigned char PASSACRE_BENCH_SITE[] = "example.com";
+
+
+#if defined(__GNUC__) && (defined(__x86_64__) || defined(__i386__))
+#define PASSACRE_BENCH_HAVE_CYCLES 1
+
+static unsigned long long
+passacre_bench_cycles(void)
+{
+    unsigned int lo, hi;
+    __asm__ __volatile__ ("rdtsc" : "=a" (lo), "=d" (hi));
+    return ((unsigned long long)hi << 32) | lo;
+}
+#else
+#define PASSACRE_BENCH_HAVE_CYCLES 0
+
+static unsigned long long
+passacre_bench_cycles(void)
+{
+    return 0;
+}
+#endif
+
+
+static double
+passacre_bench_seconds(void)
+{
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return now.tv_sec + now.tv_nsec / 1e9;
+}
+
+
+/*
+ * What's being measured, run n_calls times per trial. prepare is called
+ * before each call and isn't timed. bytes is filled in with how many bytes
+ * one call absorbs or squeezes, or left 0 if that isn't meaningful.
+ */
+struct passacre_bench_case {
+    enum passacre_gen_algorithm algorithm;
+    size_t n_calls;
+    size_t param;
+    int (*prepare)(struct passacre_bench_case *, struct passacre_gen_state *);
+    int (*run)(struct passacre_bench_case *, struct passacre_gen_state *);
+    unsigned char *buffer;
+    unsigned long long bytes;
+};
+
+struct passacre_bench_result {
+    double seconds;
+    unsigned long long cycles;
+};
+
+
+static int
+passacre_bench_prepare_init(struct passacre_bench_case *bench, struct passacre_gen_state *state)
+{
+    return passacre_gen_init(state, bench->algorithm);
+}
+
+
+static int
+passacre_bench_prepare_absorbed(struct passacre_bench_case *bench, struct passacre_gen_state *state)
+{
+    int result;
+    if ((result = passacre_gen_init(state, bench->algorithm))) {
+        return result;
+    }
+    return passacre_gen_absorb_username_password_site(
+        state, PASSACRE_BENCH_USERNAME, sizeof PASSACRE_BENCH_USERNAME - 1,
+        PASSACRE_BENCH_PASSWORD, sizeof PASSACRE_BENCH_PASSWORD - 1,
+        PASSACRE_BENCH_SITE, sizeof PASSACRE_BENCH_SITE - 1);
+}
+
+
+static int
+passacre_bench_prepare_nothing(struct passacre_bench_case *bench, struct passacre_gen_state *state)
+{
+    (void)bench;
+    (void)state;
+    return 0;
+}
+
+
+static int
+passacre_bench_run_init(struct passacre_bench_case *bench, struct passacre_gen_state *state)
+{
+    return passacre_gen_init(state, bench->algorithm);
+}
+
+
+static int
+passacre_bench_run_absorb(struct passacre_bench_case *bench, struct passacre_gen_state *state)
+{
+    bench->bytes = (sizeof PASSACRE_BENCH_USERNAME - 1) + (sizeof PASSACRE_BENCH_PASSWORD - 1)
+        + (sizeof PASSACRE_BENCH_SITE - 1) + 2;
+    return passacre_gen_absorb_username_password_site(
+        state, PASSACRE_BENCH_USERNAME, sizeof PASSACRE_BENCH_USERNAME - 1,
+        PASSACRE_BENCH_PASSWORD, sizeof PASSACRE_BENCH_PASSWORD - 1,
+        PASSACRE_BENCH_SITE, sizeof PASSACRE_BENCH_SITE - 1);
+}
+
+
+static int
+passacre_bench_run_null_rounds(struct passacre_bench_case *bench, struct passacre_gen_state *state)
+{
+    return passacre_gen_absorb_null_rounds(state, bench->param);
+}
+
+
+static int
+passacre_bench_run_squeeze(struct passacre_bench_case *bench, struct passacre_gen_state *state)
+{
+    bench->bytes = bench->param;
+    return passacre_gen_squeeze(state, bench->buffer, bench->param);
+}
+
+
+static int
+passacre_bench_run(struct passacre_bench_case *bench, struct passacre_gen_state *state,
+                   size_t n_trials, struct passacre_bench_result *best)
+{
+    size_t trial, call;
+    int result;
+    for (trial = 0; trial < n_trials; ++trial) {
+        struct passacre_bench_result elapsed = {0, 0};
+        for (call = 0; call < bench->n_calls; ++call) {
+            double start;
+            unsigned long long start_cycles;
+            if ((result = bench->prepare(bench, state))) {
+                return result;
+            }
+            start = passacre_bench_seconds();
+            start_cycles = passacre_bench_cycles();
+            if ((result = bench->run(bench, state))) {
+                return result;
+            }
+            elapsed.cycles += passacre_bench_cycles() - start_cycles;
+            elapsed.seconds += passacre_bench_seconds() - start;
+        }
+        if (trial == 0 || elapsed.seconds < best->seconds) {
+            *best = elapsed;
+        }
+    }
+    best->seconds /= bench->n_calls;
+    best->cycles /= bench->n_calls;
+    return 0;
+}
+
+
+static void
+passacre_bench_report(const char *algorithm, const char *impl, const char *what,
+                      const struct passacre_bench_case *bench,
+                      const struct passacre_bench_result *result)
+{
+    printf("%-12s %-12s %-30s %14.3f us", algorithm, impl, what, result->seconds * 1e6);
+    if (PASSACRE_BENCH_HAVE_CYCLES) {
+        printf(" %14llu cycles", result->cycles);
+        if (bench->bytes) {
+            printf(" %10.2f cycles/byte", (double)result->cycles / bench->bytes);
+        }
+    }
+    printf("\n");
+}
+
+
+static int
+passacre_bench_algorithm(enum passacre_gen_algorithm algorithm, const char *algorithm_name,
+                         const char *impl, struct passacre_gen_state *state, size_t n_trials)
+{
+    struct passacre_bench_case bench;
+    struct passacre_bench_result result;
+    unsigned char squeezed[4096];
+    char what[64];
+    size_t i;
+    int ret;
+
+    memset(&bench, 0, sizeof bench);
+    bench.algorithm = algorithm;
+    bench.buffer = squeezed;
+
+    bench.n_calls = 10000;
+    bench.prepare = passacre_bench_prepare_nothing;
+    bench.run = passacre_bench_run_init;
+    if ((ret = passacre_bench_run(&bench, state, n_trials, &result))) {
+        return ret;
+    }
+    passacre_bench_report(algorithm_name, impl, "init", &bench, &result);
+
+    bench.prepare = passacre_bench_prepare_init;
+    bench.run = passacre_bench_run_absorb;
+    if ((ret = passacre_bench_run(&bench, state, n_trials, &result))) {
+        return ret;
+    }
+    passacre_bench_report(algorithm_name, impl, "absorb_username_password_site", &bench, &result);
+
+    bench.prepare = passacre_bench_prepare_absorbed;
+    bench.run = passacre_bench_run_null_rounds;
+    for (i = 0; i < sizeof PASSACRE_BENCH_NULL_ROUNDS / sizeof PASSACRE_BENCH_NULL_ROUNDS[0]; ++i) {
+        struct passacre_gen_stats before, after;
+        bench.param = PASSACRE_BENCH_NULL_ROUNDS[i];
+        bench.n_calls = 1000 / bench.param;
+        /* the bytes in a null round depend on the algorithm, so ask */
+        if ((ret = bench.prepare(&bench, state))
+                || (ret = passacre_gen_get_stats(state, &before))
+                || (ret = bench.run(&bench, state))
+                || (ret = passacre_gen_get_stats(state, &after))) {
+            return ret;
+        }
+        bench.bytes = after.bytes_absorbed - before.bytes_absorbed;
+        if ((ret = passacre_bench_run(&bench, state, n_trials, &result))) {
+            return ret;
+        }
+        sprintf(what, "absorb_null_rounds(%lu)", (unsigned long)bench.param);
+        passacre_bench_report(algorithm_name, impl, what, &bench, &result);
+    }
+
+    bench.run = passacre_bench_run_squeeze;
+    for (i = 0; i < sizeof PASSACRE_BENCH_SQUEEZE_BYTES / sizeof PASSACRE_BENCH_SQUEEZE_BYTES[0]; ++i) {
+        bench.param = PASSACRE_BENCH_SQUEEZE_BYTES[i];
+        bench.n_calls = 1000;
+        if ((ret = passacre_bench_run(&bench, state, n_trials, &result))) {
+            return ret;
+        }
+        sprintf(what, "squeeze(%lu)", (unsigned long)bench.param);
+        passacre_bench_report(algorithm_name, impl, what, &bench, &result);
+    }
+    return 0;
+}
+
+
+static void
+passacre_bench_usage(const char *argv0)
+{
+    fprintf(stderr, "usage: %s [-t trials] [-k keccak-impl] [-s skein-impl]\n", argv0);
+}
+
+
+int
+main(int argc, char **argv)
+{
+    const char *keccak_impl = NULL, *skein_impl = NULL, *name;
+    struct passacre_gen_state *state;
+    size_t n_trials = PASSACRE_BENCH_DEFAULT_TRIALS, i;
+    int opt, ret = 0;
+
+    while ((opt = getopt(argc, argv, "t:k:s:")) != -1) {
+        switch (opt) {
+        case 't':
+            n_trials = strtoul(optarg, NULL, 10);
+            break;
+        case 'k':
+            keccak_impl = optarg;
+            break;
+        case 's':
+            skein_impl = optarg;
+            break;
+        default:
+            passacre_bench_usage(argv[0]);
+            return 2;
+        }
+    }
+    if (optind != argc || !n_trials) {
+        passacre_bench_usage(argv[0]);
+        return 2;
+    }
+    if ((keccak_impl && passacre_keccak_select_impl(keccak_impl))
+            || (skein_impl && passacre_skein_select_impl(skein_impl))) {
+        fprintf(stderr, "%s: unknown implementation\n", argv[0]);
+        return 2;
+    }
+    if (!(state = malloc(passacre_gen_size()))) {
+        perror("malloc");
+        return 1;
+    }
+
+    for (i = 0; !ret && (name = passacre_keccak_impl_name(i)); ++i) {
+        if (keccak_impl? strcmp(name, keccak_impl) != 0 : !passacre_keccak_impl_supported(i)) {
+            continue;
+        }
+        passacre_keccak_select_impl(name);
+        if (!(ret = passacre_bench_algorithm(PASSACRE_KECCAK, "keccak", name, state, n_trials))) {
+            ret = passacre_bench_algorithm(PASSACRE_KECCAK_WIDE, "keccak-wide", name, state, n_trials);
+        }
+    }
+    for (i = 0; !ret && (name = passacre_skein_impl_name(i)); ++i) {
+        if (skein_impl && strcmp(name, skein_impl) != 0) {
+            continue;
+        }
+        passacre_skein_select_impl(name);
+        ret = passacre_bench_algorithm(PASSACRE_SKEIN, "skein", name, state, n_trials);
+    }
+
+    free(state);
+    if (ret) {
+        fprintf(stderr, "%s: %s\n", argv[0], strerror(-ret));
+        return 1;
+    }
+    return 0;
+}
@@ -3,17 +3,549 @@
  * See COPYING for details.
  */
 
+/* for clock_gettime */
+#define _POSIX_C_SOURCE 199309L
+
 #include <errno.h>
+#include <stdlib.h>
 #include <string.h>
+#include <time.h>
 #include "passacre.h"
+#include "keccak-lanes.h"
 #include "keccak/KeccakSponge.h"
 #include "skein/skeinApi.h"
 #include "skein/threefishApi.h"
 
 
+void Skein_512_Process_Block(
+    Skein_512_Ctxt_t *ctx, const u08b_t *blkPtr, size_t blkCnt, size_t byteCntAdd);
+void passacre_skein_unrolled_Process_Block(
+    Skein_512_Ctxt_t *ctx, const u08b_t *blkPtr, size_t blkCnt, size_t byteCntAdd);
+void passacre_skein_loop3_Process_Block(
+    Skein_512_Ctxt_t *ctx, const u08b_t *blkPtr, size_t blkCnt, size_t byteCntAdd);
+void passacre_skein_loop1_Process_Block(
+    Skein_512_Ctxt_t *ctx, const u08b_t *blkPtr, size_t blkCnt, size_t byteCntAdd);
+
+
+/*
+ * Each variant of the keccak sponge and permutation is compiled separately with
+ * its symbols prefixed (see keccak-variant.h), and the variant to use is picked
+ * at runtime. Variants can keep the state in different representations, so
+ * a state must always be used with the variant it was initialized with.
+ */
+#define PASSACRE_KECCAK_DECLARE(variant)                                 \
+    int passacre_keccak_ ## variant ## _InitSponge(                      \
+        spongeState *, unsigned int, unsigned int);                      \
+    int passacre_keccak_ ## variant ## _Absorb(                          \
+        spongeState *, const unsigned char *, unsigned long long);       \
+    int passacre_keccak_ ## variant ## _Squeeze(                         \
+        spongeState *, unsigned char *, unsigned long long);             \
+    void passacre_keccak_ ## variant ## _KeccakAbsorb(                   \
+        unsigned char *, const unsigned char *, unsigned int);           \
+    void passacre_keccak_ ## variant ## _KeccakPermutation(unsigned char *);
+
+#define PASSACRE_KECCAK_IMPL(variant, name, supported, layout) {         \
+        name, supported, layout,                                         \
+        passacre_keccak_ ## variant ## _InitSponge,                      \
+        passacre_keccak_ ## variant ## _Absorb,                          \
+        passacre_keccak_ ## variant ## _Squeeze,                         \
+        passacre_keccak_ ## variant ## _KeccakAbsorb,                    \
+        passacre_keccak_ ## variant ## _KeccakPermutation,               \
+    }
+
+/*
+ * How a variant lays out the state: as the plain little-endian lanes, with
+ * some of the lanes complemented (the "lane complementing" transform), or with
+ * the bits of each lane interleaved into two 32-bit words.
+ */
+enum passacre_keccak_layout {
+    PASSACRE_KECCAK_PLAIN,
+    PASSACRE_KECCAK_COMPLEMENTED,
+    PASSACRE_KECCAK_INTERLEAVED,
+};
+
+struct passacre_keccak_impl {
+    const char *name;
+    int (*supported)(void);
+    enum passacre_keccak_layout layout;
+    int (*init_sponge)(spongeState *, unsigned int, unsigned int);
+    int (*absorb)(spongeState *, const unsigned char *, unsigned long long);
+    int (*squeeze)(spongeState *, unsigned char *, unsigned long long);
+    void (*absorb_lanes)(unsigned char *, const unsigned char *, unsigned int);
+    void (*permute)(unsigned char *);
+};
+
+static int
+passacre_keccak_always_supported(void)
+{
+    return 1;
+}
+
+PASSACRE_KECCAK_DECLARE(opt64)
+PASSACRE_KECCAK_DECLARE(opt32)
+#ifdef PASSACRE_KECCAK_HAVE_X86_64
+#include <cpuid.h>
+
+static int
+passacre_keccak_ssse3_supported(void)
+{
+    unsigned int eax, ebx, ecx, edx;
+    if (!__get_cpuid(1, &eax, &ebx, &ecx, &edx)) {
+        return 0;
+    }
+    return (ecx & bit_SSSE3) != 0;
+}
+
+static int
+passacre_keccak_avx2_supported(void)
+{
+    unsigned int eax, ebx, ecx, edx;
+    if (!__get_cpuid(1, &eax, &ebx, &ecx, &edx)) {
+        return 0;
+    }
+    if (!(ecx & bit_OSXSAVE) || !(ecx & bit_AVX)) {
+        return 0;
+    }
+    /* the OS also has to be saving the upper halves of the ymm registers */
+    __asm__ ("xgetbv" : "=a" (eax), "=d" (edx) : "c" (0));
+    if ((eax & 6) != 6 || __get_cpuid_max(0, NULL) < 7) {
+        return 0;
+    }
+    __cpuid_count(7, 0, eax, ebx, ecx, edx);
+    return (ebx & bit_AVX2) != 0;
+}
+
+PASSACRE_KECCAK_DECLARE(opt64_shld)
+PASSACRE_KECCAK_DECLARE(opt64_sse)
+#endif
+
+/* in order of preference, for when variants are equally fast */
+static const struct passacre_keccak_impl PASSACRE_KECCAK_IMPLS[] = {
+#ifdef PASSACRE_KECCAK_HAVE_X86_64
+    PASSACRE_KECCAK_IMPL(opt64_shld, "opt64-shld", passacre_keccak_always_supported,
+                         PASSACRE_KECCAK_COMPLEMENTED),
+    PASSACRE_KECCAK_IMPL(opt64_sse, "opt64-sse", passacre_keccak_ssse3_supported,
+                         PASSACRE_KECCAK_PLAIN),
+#endif
+    PASSACRE_KECCAK_IMPL(opt64, "opt64", passacre_keccak_always_supported,
+                         PASSACRE_KECCAK_COMPLEMENTED),
+    PASSACRE_KECCAK_IMPL(opt32, "opt32", passacre_keccak_always_supported,
+                         PASSACRE_KECCAK_INTERLEAVED),
+};
+
+#define PASSACRE_N_KECCAK_IMPLS (sizeof PASSACRE_KECCAK_IMPLS / sizeof PASSACRE_KECCAK_IMPLS[0])
+#define PASSACRE_KECCAK_BENCHMARK_PERMUTATIONS 512
+#define PASSACRE_KECCAK_BENCHMARK_TRIALS 3
+
+/*
+ * The keccak and skein variants are picked the first time one is needed, by
+ * whichever thread gets there first, and they and the number of keccak lanes
+ * can be changed while other threads are generating, so those settings are
+ * only ever loaded and stored atomically.
+ */
+#define PASSACRE_ATOMIC_LOAD(setting) __atomic_load_n(&(setting), __ATOMIC_ACQUIRE)
+#define PASSACRE_ATOMIC_STORE(setting, value)                            \
+    __atomic_store_n(&(setting), (value), __ATOMIC_RELEASE)
+
+#define PASSACRE_NO_TIME ((unsigned long long)-1)
+
+
+/*
+ * Return a time in nanoseconds for timing benchmarks with. Where it's
+ * available, this is the CPU time used by the calling thread, so that other
+ * threads and processes running at the same time don't count against
+ * whichever variant happened to be benchmarked alongside them.
+ */
+static unsigned long long
+passacre_benchmark_time(void)
+{
+#if defined(CLOCK_THREAD_CPUTIME_ID) || defined(CLOCK_MONOTONIC)
+    struct timespec now;
+#ifdef CLOCK_THREAD_CPUTIME_ID
+    if (!clock_gettime(CLOCK_THREAD_CPUTIME_ID, &now)) {
+        return now.tv_sec * 1000000000ULL + now.tv_nsec;
+    }
+#endif
+#ifdef CLOCK_MONOTONIC
+    if (!clock_gettime(CLOCK_MONOTONIC, &now)) {
+        return now.tv_sec * 1000000000ULL + now.tv_nsec;
+    }
+#endif
+#endif
+    return (unsigned long long)clock() * (1000000000ULL / CLOCKS_PER_SEC);
+}
+
+
+static const struct passacre_keccak_impl *passacre_keccak_selected = NULL;
+
+
+/*
+ * If no variant is selected yet, select impl. Returns whichever variant ends
+ * up selected, so threads which picked one at the same time all use the first
+ * to be selected.
+ */
+static const struct passacre_keccak_impl *
+passacre_keccak_select_first(const struct passacre_keccak_impl *impl)
+{
+    const struct passacre_keccak_impl *selected = NULL;
+    if (__atomic_compare_exchange_n(&passacre_keccak_selected, &selected, impl, 0,
+                                    __ATOMIC_ACQ_REL, __ATOMIC_ACQUIRE)) {
+        return impl;
+    }
+    return selected;
+}
+
+
+static const struct passacre_keccak_impl *
+passacre_keccak_find_impl(const char *name)
+{
+    size_t i;
+    for (i = 0; i < PASSACRE_N_KECCAK_IMPLS; ++i) {
+        const struct passacre_keccak_impl *impl = &PASSACRE_KECCAK_IMPLS[i];
+        if (strcmp(impl->name, name) == 0) {
+            return impl->supported()? impl : NULL;
+        }
+    }
+    return NULL;
+}
+
+
+static unsigned long long
+passacre_keccak_benchmark(const struct passacre_keccak_impl *impl)
+{
+    spongeState sponge;
+    unsigned long long best = 0;
+    size_t trial, i;
+    if (impl->init_sponge(&sponge, 64, 1536)) {
+        return PASSACRE_NO_TIME;
+    }
+    for (trial = 0; trial < PASSACRE_KECCAK_BENCHMARK_TRIALS; ++trial) {
+        unsigned long long start = passacre_benchmark_time(), elapsed;
+        for (i = 0; i < PASSACRE_KECCAK_BENCHMARK_PERMUTATIONS; ++i) {
+            impl->permute(sponge.state);
+        }
+        elapsed = passacre_benchmark_time() - start;
+        if (trial == 0 || elapsed < best) {
+            best = elapsed;
+        }
+    }
+    return best;
+}
+
+
+/*
+ * Unless PASSACRE_KECCAK_IMPL is set in the environment, the variant used is
+ * whichever supported one permutes the fastest on this machine.
+ */
+static const struct passacre_keccak_impl *
+passacre_keccak_impl(void)
+{
+    const struct passacre_keccak_impl *best;
+    unsigned long long best_time = 0;
+    const char *forced;
+    size_t i;
+    if ((best = PASSACRE_ATOMIC_LOAD(passacre_keccak_selected))) {
+        return best;
+    }
+    if ((forced = getenv("PASSACRE_KECCAK_IMPL")) && *forced
+            && (best = passacre_keccak_find_impl(forced))) {
+        return passacre_keccak_select_first(best);
+    }
+    for (i = 0; i < PASSACRE_N_KECCAK_IMPLS; ++i) {
+        const struct passacre_keccak_impl *impl = &PASSACRE_KECCAK_IMPLS[i];
+        unsigned long long elapsed;
+        if (!impl->supported()) {
+            continue;
+        }
+        elapsed = passacre_keccak_benchmark(impl);
+        if (elapsed == PASSACRE_NO_TIME) {
+            continue;
+        }
+        if (!best || elapsed < best_time) {
+            best = impl;
+            best_time = elapsed;
+        }
+    }
+    if (!best) {
+        return NULL;
+    }
+    return passacre_keccak_select_first(best);
+}
+
+
+const char *
+passacre_keccak_impl_name(size_t index)
+{
+    if (index >= PASSACRE_N_KECCAK_IMPLS) {
+        return NULL;
+    }
+    return PASSACRE_KECCAK_IMPLS[index].name;
+}
+
+
+int
+passacre_keccak_impl_supported(size_t index)
+{
+    if (index >= PASSACRE_N_KECCAK_IMPLS) {
+        return 0;
+    }
+    return PASSACRE_KECCAK_IMPLS[index].supported();
+}
+
+
+const char *
+passacre_keccak_active_impl(void)
+{
+    const struct passacre_keccak_impl *impl = passacre_keccak_impl();
+    return impl? impl->name : NULL;
+}
+
+
+int
+passacre_keccak_select_impl(const char *name)
+{
+    const struct passacre_keccak_impl *impl;
+    if (!name) {
+        PASSACRE_ATOMIC_STORE(passacre_keccak_selected, NULL);
+        return 0;
+    }
+    if (!(impl = passacre_keccak_find_impl(name))) {
+        return -EINVAL;
+    }
+    PASSACRE_ATOMIC_STORE(passacre_keccak_selected, impl);
+    return 0;
+}
+
+
+/*
+ * The multi-lane permutations advance several states in lockstep; batch
+ * generation uses them for keccak jobs with the same number of null rounds.
+ * They're in order of preference, narrowest first.
+ */
+struct passacre_keccak_lanes_impl {
+    unsigned int lanes;
+    int (*supported)(void);
+    void (*permute)(unsigned char **, unsigned long long);
+};
+
+static const struct passacre_keccak_lanes_impl PASSACRE_KECCAK_LANES_IMPLS[] = {
+#ifdef PASSACRE_KECCAK_HAVE_X86_64
+    {2, passacre_keccak_always_supported, passacre_keccak_permute_lanes2},
+    {4, passacre_keccak_avx2_supported, passacre_keccak_permute_lanes4},
+#endif
+    {0, NULL, NULL},
+};
+
+#define PASSACRE_KECCAK_MAX_LANES 4
+
+/* 0 means no limit besides what the machine supports */
+static unsigned int passacre_keccak_lanes_limit = 0;
+
+
+static const struct passacre_keccak_lanes_impl *
+passacre_keccak_find_lanes(unsigned int n_states)
+{
+    const struct passacre_keccak_lanes_impl *lanes;
+    unsigned int limit = PASSACRE_ATOMIC_LOAD(passacre_keccak_lanes_limit);
+    for (lanes = PASSACRE_KECCAK_LANES_IMPLS; lanes->lanes; ++lanes) {
+        if (limit && lanes->lanes > limit) {
+            break;
+        }
+        if (lanes->lanes >= n_states && lanes->supported()) {
+            return lanes;
+        }
+    }
+    return NULL;
+}
+
+
+unsigned int
+passacre_keccak_lanes(void)
+{
+    const struct passacre_keccak_lanes_impl *lanes;
+    unsigned int ret = 1, limit = PASSACRE_ATOMIC_LOAD(passacre_keccak_lanes_limit);
+    for (lanes = PASSACRE_KECCAK_LANES_IMPLS; lanes->lanes; ++lanes) {
+        if (limit && lanes->lanes > limit) {
+            break;
+        }
+        if (lanes->supported()) {
+            ret = lanes->lanes;
+        }
+    }
+    return ret;
+}
+
+
+int
+passacre_keccak_set_lanes(unsigned int n_lanes)
+{
+    const struct passacre_keccak_lanes_impl *lanes;
+    if (n_lanes > 1) {
+        for (lanes = PASSACRE_KECCAK_LANES_IMPLS; lanes->lanes; ++lanes) {
+            if (lanes->lanes == n_lanes && lanes->supported()) {
+                break;
+            }
+        }
+        if (!lanes->lanes) {
+            return -EINVAL;
+        }
+    }
+    PASSACRE_ATOMIC_STORE(passacre_keccak_lanes_limit, n_lanes);
+    return 0;
+}
+
+
+/*
+ * The skein-512 block function comes in a few variants as well: the one built
+ * on the threefish API, which the rest of skein uses, and the ones from
+ * skein_block.c with different amounts of unrolling (see skein-variant.h).
+ * They all compute the same thing, so unlike with keccak, states don't need to
+ * remember which one they were used with. Only null rounds, which are
+ * processed a block at a time, go through the selected variant.
+ */
+struct passacre_skein_impl {
+    const char *name;
+    void (*process_block)(Skein_512_Ctxt_t *, const u08b_t *, size_t, size_t);
+};
+
+/* in order of preference, for when variants are equally fast */
+static const struct passacre_skein_impl PASSACRE_SKEIN_IMPLS[] = {
+    {"unrolled", passacre_skein_unrolled_Process_Block},
+    {"loop3", passacre_skein_loop3_Process_Block},
+    {"loop1", passacre_skein_loop1_Process_Block},
+    {"threefish", Skein_512_Process_Block},
+};
+
+#define PASSACRE_N_SKEIN_IMPLS (sizeof PASSACRE_SKEIN_IMPLS / sizeof PASSACRE_SKEIN_IMPLS[0])
+#define PASSACRE_SKEIN_BENCHMARK_BLOCKS 4096
+#define PASSACRE_SKEIN_BENCHMARK_TRIALS 3
+
+static const struct passacre_skein_impl *passacre_skein_selected = NULL;
+
+
+/* the same as passacre_keccak_select_first */
+static const struct passacre_skein_impl *
+passacre_skein_select_first(const struct passacre_skein_impl *impl)
+{
+    const struct passacre_skein_impl *selected = NULL;
+    if (__atomic_compare_exchange_n(&passacre_skein_selected, &selected, impl, 0,
+                                    __ATOMIC_ACQ_REL, __ATOMIC_ACQUIRE)) {
+        return impl;
+    }
+    return selected;
+}
+
+#define PASSACRE_NULL_ROUND_BYTES 1024
+
+static const u08b_t PASSACRE_NULLS[PASSACRE_NULL_ROUND_BYTES];
+
+
+static const struct passacre_skein_impl *
+passacre_skein_find_impl(const char *name)
+{
+    size_t i;
+    for (i = 0; i < PASSACRE_N_SKEIN_IMPLS; ++i) {
+        if (strcmp(PASSACRE_SKEIN_IMPLS[i].name, name) == 0) {
+            return &PASSACRE_SKEIN_IMPLS[i];
+        }
+    }
+    return NULL;
+}
+
+
+static unsigned long long
+passacre_skein_benchmark(const struct passacre_skein_impl *impl)
+{
+    Skein_512_Ctxt_t ctx;
+    size_t n_blocks = sizeof PASSACRE_NULLS / SKEIN_512_BLOCK_BYTES, trial, i;
+    unsigned long long best = 0;
+    memset(&ctx, 0, sizeof ctx);
+    for (trial = 0; trial < PASSACRE_SKEIN_BENCHMARK_TRIALS; ++trial) {
+        unsigned long long start = passacre_benchmark_time(), elapsed;
+        for (i = 0; i < PASSACRE_SKEIN_BENCHMARK_BLOCKS; i += n_blocks) {
+            impl->process_block(&ctx, PASSACRE_NULLS, n_blocks, SKEIN_512_BLOCK_BYTES);
+        }
+        elapsed = passacre_benchmark_time() - start;
+        if (trial == 0 || elapsed < best) {
+            best = elapsed;
+        }
+    }
+    return best;
+}
+
+
+/*
+ * Unless PASSACRE_SKEIN_IMPL is set in the environment, the variant used is
+ * whichever processes blocks the fastest on this machine.
+ */
+static const struct passacre_skein_impl *
+passacre_skein_impl(void)
+{
+    const struct passacre_skein_impl *best;
+    unsigned long long best_time = 0;
+    const char *forced;
+    size_t i;
+    if ((best = PASSACRE_ATOMIC_LOAD(passacre_skein_selected))) {
+        return best;
+    }
+    if ((forced = getenv("PASSACRE_SKEIN_IMPL")) && *forced
+            && (best = passacre_skein_find_impl(forced))) {
+        return passacre_skein_select_first(best);
+    }
+    for (i = 0; i < PASSACRE_N_SKEIN_IMPLS; ++i) {
+        unsigned long long elapsed = passacre_skein_benchmark(&PASSACRE_SKEIN_IMPLS[i]);
+        if (!best || elapsed < best_time) {
+            best = &PASSACRE_SKEIN_IMPLS[i];
+            best_time = elapsed;
+        }
+    }
+    return passacre_skein_select_first(best);
+}
+
+
+const char *
+passacre_skein_impl_name(size_t index)
+{
+    if (index >= PASSACRE_N_SKEIN_IMPLS) {
+        return NULL;
+    }
+    return PASSACRE_SKEIN_IMPLS[index].name;
+}
+
+
+const char *
+passacre_skein_active_impl(void)
+{
+    return passacre_skein_impl()->name;
+}
+
+
+int
+passacre_skein_select_impl(const char *name)
+{
+    const struct passacre_skein_impl *impl;
+    if (!name) {
+        PASSACRE_ATOMIC_STORE(passacre_skein_selected, NULL);
+        return 0;
+    }
+    if (!(impl = passacre_skein_find_impl(name))) {
+        return -EINVAL;
+    }
+    PASSACRE_ATOMIC_STORE(passacre_skein_selected, impl);
+    return 0;
+}
+
+
+/* the standard SHA3-256 parameters */
+#define PASSACRE_KECCAK_WIDE_RATE 1088
+#define PASSACRE_KECCAK_WIDE_CAPACITY 512
+
+
 struct passacre_gen_state {
     enum passacre_gen_algorithm algorithm;
     unsigned char finished_absorbing;
+    unsigned char keccak_impl;
+    struct passacre_gen_stats stats;
     union {
         spongeState keccak;
         SkeinCtx_t skein;
@@ -40,10 +572,20 @@ passacre_gen_init(struct passacre_gen_state *state, enum passacre_gen_algorithm
     memset(state, 0, sizeof *state);
     switch (algo) {
     case PASSACRE_KECCAK:
-        if (InitSponge(&state->hasher.keccak, 64, 1536)) {
+    case PASSACRE_KECCAK_WIDE: {
+        const struct passacre_keccak_impl *impl = passacre_keccak_impl();
+        int wide = algo == PASSACRE_KECCAK_WIDE;
+        if (!impl) {
+            return -EINVAL;
+        }
+        state->keccak_impl = impl - PASSACRE_KECCAK_IMPLS;
+        if (impl->init_sponge(&state->hasher.keccak,
+                              wide? PASSACRE_KECCAK_WIDE_RATE : 64,
+                              wide? PASSACRE_KECCAK_WIDE_CAPACITY : 1536)) {
             return -EINVAL;
         }
         break;
+    }
 
     case PASSACRE_SKEIN:
         if (skeinCtxPrepare(&state->hasher.skein, Skein512) != SKEIN_SUCCESS) {
@@ -66,15 +608,50 @@ passacre_gen_init(struct passacre_gen_state *state, enum passacre_gen_algorithm
 }
 
 
+/*
+ * Count n_bytes which are about to be absorbed, along with the blocks that
+ * absorbing them will process. Keccak permutes every time its queue of input
+ * fills up, and skein processes a block once there's input past the block in
+ * its buffer.
+ */
+static void
+passacre_gen_count_absorbed(struct passacre_gen_state *state, unsigned long long n_bytes)
+{
+    state->stats.bytes_absorbed += n_bytes;
+    switch (state->algorithm) {
+    case PASSACRE_KECCAK:
+    case PASSACRE_KECCAK_WIDE: {
+        spongeState *sponge = &state->hasher.keccak;
+        state->stats.absorb_blocks += (sponge->bitsInQueue / 8 + n_bytes) / (sponge->rate / 8);
+        break;
+    }
+
+    case PASSACRE_SKEIN: {
+        unsigned long long buffered = state->hasher.skein.m.s512.h.bCnt + n_bytes;
+        if (buffered > SKEIN_512_BLOCK_BYTES) {
+            state->stats.absorb_blocks += (buffered - 1) / SKEIN_512_BLOCK_BYTES;
+        }
+        break;
+    }
+
+    default:
+        break;
+    }
+}
+
+
 static int
 passacre_gen_absorb(struct passacre_gen_state *state, const unsigned char *input, size_t n_bytes)
 {
     if (state->finished_absorbing) {
         return -EINVAL;
     }
+    passacre_gen_count_absorbed(state, n_bytes);
     switch (state->algorithm) {
     case PASSACRE_KECCAK:
-        if (Absorb(&state->hasher.keccak, input, n_bytes * 8)) {
+    case PASSACRE_KECCAK_WIDE:
+        if (PASSACRE_KECCAK_IMPLS[state->keccak_impl].absorb(
+                &state->hasher.keccak, input, n_bytes * 8)) {
             return -EINVAL;
         }
         break;
@@ -125,34 +702,251 @@ passacre_gen_absorb_username_password_site(
 }
 
 
-int
-passacre_gen_absorb_null_rounds(struct passacre_gen_state *state, size_t n_rounds)
+
+/*
+ * Absorbing null bytes into a keccak sponge doesn't change the state besides
+ * permuting it, so rather than pushing null bytes through Absorb, flush
+ * whatever is queued and then apply the permutation once per block of nulls.
+ * This queues up the trailing partial block of nulls and sets n_blocks to the
+ * number of permutations which still have to be applied to the state.
+ */
+static int
+passacre_keccak_queue_nulls(const struct passacre_keccak_impl *impl, spongeState *sponge,
+                            unsigned long long n_bytes, unsigned long long *n_blocks)
 {
-    int result;
-    unsigned char nulls[1024] = {0};
-    size_t i;
-    for (i = 0; i < n_rounds; ++i) {
-        if ((result = passacre_gen_absorb(state, nulls, sizeof nulls))) {
-            return result;
+    unsigned int rate_bytes = sponge->rate / 8,
+        queued_bytes = sponge->bitsInQueue / 8;
+    *n_blocks = 0;
+    if (sponge->bitsInQueue % 8 || sponge->squeezing) {
+        return 1;
+    }
+    if (queued_bytes) {
+        unsigned int to_fill = rate_bytes - queued_bytes;
+        if (n_bytes < to_fill) {
+            memset(sponge->dataQueue + queued_bytes, 0, n_bytes);
+            sponge->bitsInQueue += n_bytes * 8;
+            return 0;
         }
+        memset(sponge->dataQueue + queued_bytes, 0, to_fill);
+        impl->absorb_lanes(sponge->state, sponge->dataQueue, sponge->rate / 64);
+        sponge->bitsInQueue = 0;
+        n_bytes -= to_fill;
     }
+    *n_blocks = n_bytes / rate_bytes;
+    n_bytes %= rate_bytes;
+    memset(sponge->dataQueue, 0, n_bytes);
+    sponge->bitsInQueue = n_bytes * 8;
     return 0;
 }
 
 
-int
-passacre_gen_squeeze(struct passacre_gen_state *state, unsigned char *output, size_t n_bytes)
+static int
+passacre_keccak_absorb_nulls(const struct passacre_keccak_impl *impl, spongeState *sponge,
+                             unsigned long long n_bytes)
 {
-    int just_started = 0;
-    if (!state->finished_absorbing) {
-        state->finished_absorbing = just_started = 1;
+    unsigned long long n_blocks;
+    if (passacre_keccak_queue_nulls(impl, sponge, n_bytes, &n_blocks)) {
+        return 1;
     }
-    switch (state->algorithm) {
-    case PASSACRE_KECCAK:
-        if (Squeeze(&state->hasher.keccak, output, n_bytes * 8)) {
-            return -EINVAL;
+    for (; n_blocks; --n_blocks) {
+        impl->permute(sponge->state);
+    }
+    return 0;
+}
+
+
+static const unsigned char PASSACRE_KECCAK_COMPLEMENTED_LANES[] = {1, 2, 8, 12, 17, 20};
+
+static void
+passacre_keccak_complement_lanes(unsigned char *state)
+{
+    size_t i, j;
+    for (i = 0; i < sizeof PASSACRE_KECCAK_COMPLEMENTED_LANES; ++i) {
+        unsigned char *lane = state + PASSACRE_KECCAK_COMPLEMENTED_LANES[i] * 8;
+        for (j = 0; j < 8; ++j) {
+            lane[j] = ~lane[j];
         }
-        break;
+    }
+}
+
+
+/*
+ * Absorb the same number of null rounds into several keccak states, permuting
+ * them in lockstep as far as they go together. All of the states have to be
+ * using the same variant, with a layout the multi-lane permutation can use.
+ */
+static int
+passacre_keccak_absorb_nulls_lanes(const struct passacre_keccak_lanes_impl *lanes,
+                                   struct passacre_gen_state **states, size_t n_states,
+                                   unsigned long long n_bytes)
+{
+    const struct passacre_keccak_impl *impl = &PASSACRE_KECCAK_IMPLS[states[0]->keccak_impl];
+    unsigned char *lane_states[PASSACRE_KECCAK_MAX_LANES];
+    unsigned long long n_blocks[PASSACRE_KECCAK_MAX_LANES], common = 0;
+    size_t i;
+    for (i = 0; i < n_states; ++i) {
+        if (passacre_keccak_queue_nulls(impl, &states[i]->hasher.keccak, n_bytes, &n_blocks[i])) {
+            return 1;
+        }
+        if (i == 0 || n_blocks[i] < common) {
+            common = n_blocks[i];
+        }
+        lane_states[i] = states[i]->hasher.keccak.state;
+    }
+    /* unused lanes just permute a copy of the last state */
+    for (; i < lanes->lanes; ++i) {
+        lane_states[i] = lane_states[n_states - 1];
+    }
+    if (common) {
+        /* the multi-lane permutation only works on the plain layout */
+        if (impl->layout == PASSACRE_KECCAK_COMPLEMENTED) {
+            for (i = 0; i < n_states; ++i) {
+                passacre_keccak_complement_lanes(lane_states[i]);
+            }
+        }
+        lanes->permute(lane_states, common);
+        if (impl->layout == PASSACRE_KECCAK_COMPLEMENTED) {
+            for (i = 0; i < n_states; ++i) {
+                passacre_keccak_complement_lanes(lane_states[i]);
+            }
+        }
+    }
+    for (i = 0; i < n_states; ++i) {
+        for (n_blocks[i] -= common; n_blocks[i]; --n_blocks[i]) {
+            impl->permute(lane_states[i]);
+        }
+    }
+    return 0;
+}
+
+
+/*
+ * The same goes for skein, except that the last block is always kept in the
+ * buffer so that it can be processed with the final flag set. Whole blocks of
+ * nulls are fed directly to the block function from a static buffer.
+ */
+static int
+passacre_skein_absorb_nulls(const struct passacre_skein_impl *impl, Skein_512_Ctxt_t *ctx,
+                            unsigned long long n_bytes)
+{
+    unsigned long long n_blocks;
+    if (ctx->h.bCnt > SKEIN_512_BLOCK_BYTES) {
+        return 1;
+    }
+    if (n_bytes + ctx->h.bCnt <= SKEIN_512_BLOCK_BYTES) {
+        memset(ctx->b + ctx->h.bCnt, 0, n_bytes);
+        ctx->h.bCnt += n_bytes;
+        return 0;
+    }
+    if (ctx->h.bCnt) {
+        size_t to_fill = SKEIN_512_BLOCK_BYTES - ctx->h.bCnt;
+        memset(ctx->b + ctx->h.bCnt, 0, to_fill);
+        impl->process_block(ctx, ctx->b, 1, SKEIN_512_BLOCK_BYTES);
+        ctx->h.bCnt = 0;
+        n_bytes -= to_fill;
+    }
+    /* always leave between 1 and 64 bytes for the buffer */
+    n_blocks = (n_bytes - 1) / SKEIN_512_BLOCK_BYTES;
+    n_bytes -= n_blocks * SKEIN_512_BLOCK_BYTES;
+    while (n_blocks) {
+        size_t to_process = sizeof PASSACRE_NULLS / SKEIN_512_BLOCK_BYTES;
+        if (to_process > n_blocks) {
+            to_process = n_blocks;
+        }
+        impl->process_block(ctx, PASSACRE_NULLS, to_process, SKEIN_512_BLOCK_BYTES);
+        n_blocks -= to_process;
+    }
+    memset(ctx->b, 0, n_bytes);
+    ctx->h.bCnt = n_bytes;
+    return 0;
+}
+
+
+/*
+ * A null round is 1024 null bytes, except with wide keccak, where the work
+ * per round is calibrated by permutations instead: a round is however many
+ * bytes take as many permutations as 1024 bytes take at the narrow rate.
+ */
+#define PASSACRE_KECCAK_ROUND_PERMUTATIONS (PASSACRE_NULL_ROUND_BYTES / 8)
+
+static unsigned long long
+passacre_null_round_bytes(enum passacre_gen_algorithm algorithm, size_t n_rounds)
+{
+    if (algorithm == PASSACRE_KECCAK_WIDE) {
+        return (unsigned long long)n_rounds * PASSACRE_KECCAK_ROUND_PERMUTATIONS
+            * (PASSACRE_KECCAK_WIDE_RATE / 8);
+    }
+    return (unsigned long long)n_rounds * PASSACRE_NULL_ROUND_BYTES;
+}
+
+
+static void
+passacre_gen_count_null_rounds(struct passacre_gen_state *state, size_t n_rounds)
+{
+    state->stats.null_rounds += n_rounds;
+    passacre_gen_count_absorbed(state, passacre_null_round_bytes(state->algorithm, n_rounds));
+}
+
+
+int
+passacre_gen_absorb_null_rounds(struct passacre_gen_state *state, size_t n_rounds)
+{
+    if (state->finished_absorbing) {
+        return -EINVAL;
+    }
+    passacre_gen_count_null_rounds(state, n_rounds);
+    switch (state->algorithm) {
+    case PASSACRE_KECCAK:
+    case PASSACRE_KECCAK_WIDE:
+        if (passacre_keccak_absorb_nulls(
+                &PASSACRE_KECCAK_IMPLS[state->keccak_impl], &state->hasher.keccak,
+                passacre_null_round_bytes(state->algorithm, n_rounds))) {
+            return -EINVAL;
+        }
+        break;
+
+    case PASSACRE_SKEIN:
+        if (passacre_skein_absorb_nulls(
+                passacre_skein_impl(), &state->hasher.skein.m.s512,
+                passacre_null_round_bytes(state->algorithm, n_rounds))) {
+            return -EINVAL;
+        }
+        break;
+
+    default:
+        return -EINVAL;
+    }
+    return 0;
+}
+
+
+int
+passacre_gen_squeeze(struct passacre_gen_state *state, unsigned char *output, size_t n_bytes)
+{
+    int just_started = 0;
+    if (!state->finished_absorbing) {
+        state->finished_absorbing = just_started = 1;
+    }
+    state->stats.bytes_squeezed += n_bytes;
+    switch (state->algorithm) {
+    case PASSACRE_KECCAK:
+    case PASSACRE_KECCAK_WIDE: {
+        spongeState *sponge = &state->hasher.keccak;
+        unsigned long long rate_bytes = sponge->rate / 8,
+            available = sponge->bitsAvailableForSqueezing / 8;
+        /* padding the last block of input permutes once more */
+        if (!sponge->squeezing) {
+            ++state->stats.squeeze_blocks;
+            available = rate_bytes;
+        }
+        if (n_bytes > available) {
+            state->stats.squeeze_blocks += (n_bytes - available + rate_bytes - 1) / rate_bytes;
+        }
+        if (PASSACRE_KECCAK_IMPLS[state->keccak_impl].squeeze(sponge, output, n_bytes * 8)) {
+            return -EINVAL;
+        }
+        break;
+    }
 
     case PASSACRE_SKEIN: {
         uint8_t input[64] = {0}, state_output[64];
@@ -165,6 +959,8 @@ passacre_gen_squeeze(struct passacre_gen_state *state, unsigned char *output, si
             if (skeinFinal(&state->hasher.skein, hash) != SKEIN_SUCCESS) {
                 return -EINVAL;
             }
+            /* the final block of input, then the output block */
+            state->stats.squeeze_blocks += 2;
             threefishSetKey(&prng->threefish, Threefish512, (uint64_t *)hash, (uint64_t *)tweak);
             prng->bytes_remaining = 0;
         }
@@ -177,6 +973,7 @@ passacre_gen_squeeze(struct passacre_gen_state *state, unsigned char *output, si
                 threefishEncryptBlockBytes(&prng->threefish, input, prng->buffer);
                 threefishSetKey(&prng->threefish, Threefish512, (uint64_t *)state_output, (uint64_t *)tweak);
                 prng->bytes_remaining = 64;
+                state->stats.squeeze_blocks += 2;
             }
             if (to_copy > prng->bytes_remaining) {
                 to_copy = prng->bytes_remaining;
@@ -201,3 +998,473 @@ passacre_gen_squeeze(struct passacre_gen_state *state, unsigned char *output, si
 
     return 0;
 }
+
+
+/*
+ * Divide the big-endian number in value by divisor in place, returning the
+ * remainder.
+ */
+static size_t
+passacre_divmod_bytes(unsigned char *value, size_t n_bytes, size_t divisor)
+{
+    unsigned long long remainder = 0;
+    size_t i;
+    for (i = 0; i < n_bytes; ++i) {
+        remainder = (remainder << 8) | value[i];
+        value[i] = remainder / divisor;
+        remainder %= divisor;
+    }
+    return remainder;
+}
+
+
+/*
+ * Encode the big-endian number in value with a multibase, leaving value as the
+ * part of the number too large to be encoded. The encoded symbols are written
+ * backwards from the end of output, which must have room for the longest
+ * encoding, and the offset of the first one is returned.
+ */
+static size_t
+passacre_multibase_encode(const struct passacre_multibase *mb, unsigned char *value,
+                          unsigned char *output, size_t output_length)
+{
+    size_t run, start = 0, position = output_length;
+    for (run = mb->n_runs; run--; ) {
+        size_t base = mb->run_bases[run], digit;
+        const size_t *offsets = mb->symbol_offsets[base];
+        for (digit = 0; digit < mb->run_lengths[run]; ++digit) {
+            size_t symbol, symbol_length;
+            while (start < mb->n_bytes && !value[start]) {
+                ++start;
+            }
+            symbol = passacre_divmod_bytes(value + start, mb->n_bytes - start, mb->radices[base]);
+            symbol_length = offsets[symbol + 1] - offsets[symbol];
+            position -= symbol_length;
+            memcpy(output + position, mb->symbols[base] + offsets[symbol], symbol_length);
+        }
+    }
+    return position;
+}
+
+
+/*
+ * If every radix in mb is a power of two, return how many bits a value
+ * encoded with it takes. Otherwise, or if that's no bits at all, return 0.
+ */
+static size_t
+passacre_multibase_bits(const struct passacre_multibase *mb)
+{
+    size_t run, total = 0;
+    for (run = 0; run < mb->n_runs; ++run) {
+        size_t radix = mb->radices[mb->run_bases[run]], bits = 0;
+        if (radix & (radix - 1)) {
+            return 0;
+        }
+        while (((size_t)1 << bits) < radix) {
+            ++bits;
+        }
+        total += bits * mb->run_lengths[run];
+    }
+    return total;
+}
+
+
+/*
+ * Return the n_bits bits of the big-endian number in value starting at bit
+ * position, counting from the least significant bit.
+ */
+static size_t
+passacre_bits_at(const unsigned char *value, size_t n_bytes, size_t position, size_t n_bits)
+{
+    size_t result = 0, got = 0;
+    while (got < n_bits) {
+        size_t bit = position + got, shift = bit % 8, take = 8 - shift;
+        if (take > n_bits - got) {
+            take = n_bits - got;
+        }
+        if (bit / 8 < n_bytes) {
+            result |= (size_t)((value[n_bytes - 1 - bit / 8] >> shift) & ((1u << take) - 1)) << got;
+        }
+        got += take;
+    }
+    return result;
+}
+
+
+/*
+ * Return whether the big-endian number in value is less than 2 ** n_bits.
+ */
+static int
+passacre_fits_bits(const unsigned char *value, size_t n_bytes, size_t n_bits)
+{
+    size_t i, n_high;
+    if (n_bits >= n_bytes * 8) {
+        return 1;
+    }
+    n_high = n_bytes - n_bits / 8;
+    for (i = 0; i + 1 < n_high; ++i) {
+        if (value[i]) {
+            return 0;
+        }
+    }
+    return !(value[n_high - 1] >> (n_bits % 8));
+}
+
+
+/*
+ * Encode the big-endian number in value with a multibase whose radices are
+ * all powers of two, taking each digit's bits directly instead of dividing.
+ * Unlike passacre_multibase_encode, value is left as it was.
+ */
+static size_t
+passacre_multibase_encode_bits(const struct passacre_multibase *mb, const unsigned char *value,
+                               unsigned char *output, size_t output_length)
+{
+    size_t run, bit = 0, position = output_length;
+    for (run = mb->n_runs; run--; ) {
+        size_t base = mb->run_bases[run], radix = mb->radices[base], bits = 0, digit;
+        const size_t *offsets = mb->symbol_offsets[base];
+        while (((size_t)1 << bits) < radix) {
+            ++bits;
+        }
+        for (digit = 0; digit < mb->run_lengths[run]; ++digit) {
+            size_t symbol, symbol_length;
+            symbol = passacre_bits_at(value, mb->n_bytes, bit, bits);
+            bit += bits;
+            symbol_length = offsets[symbol + 1] - offsets[symbol];
+            position -= symbol_length;
+            memcpy(output + position, mb->symbols[base] + offsets[symbol], symbol_length);
+        }
+    }
+    return position;
+}
+
+
+/*
+ * Clear all but the low n_bits bits of the big-endian number in value.
+ */
+static void
+passacre_mask_bits(unsigned char *value, size_t n_bytes, size_t n_bits)
+{
+    size_t n_cleared = n_bytes * 8 - n_bits, i;
+    for (i = 0; i < n_cleared / 8; ++i) {
+        value[i] = 0;
+    }
+    if (n_cleared % 8) {
+        value[i] &= 0xff >> (n_cleared % 8);
+    }
+}
+
+
+static int
+passacre_multibase_check(const struct passacre_multibase *mb, size_t output_length)
+{
+    size_t run, longest = 0;
+    if (mb->n_bits > mb->n_bytes * 8) {
+        return -EINVAL;
+    }
+    for (run = 0; run < mb->n_runs; ++run) {
+        size_t run_longest, base = mb->run_bases[run];
+        if (base >= mb->n_bases || !mb->radices[base]) {
+            return -EINVAL;
+        }
+        run_longest = mb->longest_symbols[base];
+        /* longest never exceeds output_length, so this can't overflow */
+        if (run_longest && mb->run_lengths[run] > (output_length - longest) / run_longest) {
+            return -EINVAL;
+        }
+        longest += run_longest * mb->run_lengths[run];
+    }
+    return 0;
+}
+
+
+/*
+ * Squeeze values of mb->n_bytes bytes, masked to mb->n_bits bits, until one
+ * can be encoded with the multibase, the same way as rejection sampling in
+ * python would, and write its encoding to output. If squeezed isn't NULL, it's
+ * mb->n_bytes bytes already squeezed, used as the first value. output_length
+ * is the size of output, and is set to the length of the encoding.
+ */
+static int
+passacre_gen_multibase(struct passacre_gen_state *state, const unsigned char *squeezed,
+                       const struct passacre_multibase *mb, unsigned char *output,
+                       size_t *output_length)
+{
+    unsigned char *value;
+    size_t i, position = 0, bits;
+    int result = 0;
+    if ((result = passacre_multibase_check(mb, *output_length))) {
+        return result;
+    }
+    if (!(value = malloc(mb->n_bytes? mb->n_bytes : 1))) {
+        return -ENOMEM;
+    }
+    bits = passacre_multibase_bits(mb);
+    for (;;) {
+        if (squeezed) {
+            memcpy(value, squeezed, mb->n_bytes);
+            squeezed = NULL;
+        } else if ((result = passacre_gen_squeeze(state, value, mb->n_bytes))) {
+            break;
+        }
+        passacre_mask_bits(value, mb->n_bytes, mb->n_bits);
+        if (bits) {
+            /* with as many bits as the value has, nothing can be rejected */
+            if (bits >= mb->n_bits || passacre_fits_bits(value, mb->n_bytes, bits)) {
+                position = passacre_multibase_encode_bits(mb, value, output, *output_length);
+                break;
+            }
+        } else {
+            position = passacre_multibase_encode(mb, value, output, *output_length);
+            /* anything left over means the value was too large to encode */
+            for (i = 0; i < mb->n_bytes && !value[i]; ++i);
+            if (i == mb->n_bytes) {
+                break;
+            }
+        }
+        ++state->stats.rejections;
+    }
+    free(value);
+    if (result) {
+        return result;
+    }
+    *output_length -= position;
+    memmove(output, output + position, *output_length);
+    return 0;
+}
+
+
+int
+passacre_gen_squeeze_multibase(struct passacre_gen_state *state, const struct passacre_multibase *mb,
+                               unsigned char *output, size_t *output_length)
+{
+    return passacre_gen_multibase(state, NULL, mb, output, output_length);
+}
+
+
+/*
+ * Encode mb->n_bytes bytes already squeezed from state, as
+ * passacre_gen_squeeze_multibase would have if it had squeezed them,
+ * squeezing more from state if they're rejected.
+ */
+int
+passacre_gen_encode_multibase(struct passacre_gen_state *state, const unsigned char *squeezed,
+                              const struct passacre_multibase *mb, unsigned char *output,
+                              size_t *output_length)
+{
+    return passacre_gen_multibase(state, squeezed, mb, output, output_length);
+}
+
+
+int
+passacre_gen_get_stats(struct passacre_gen_state *state, struct passacre_gen_stats *stats)
+{
+    memcpy(stats, &state->stats, sizeof *stats);
+    return 0;
+}
+
+
+/*
+ * The exported state is only meaningful to the same build of libpassacre, as
+ * it's the in-memory representation of the state. It can be imported into a
+ * state that was initialized with the same algorithm.
+ */
+int
+passacre_gen_export_state(struct passacre_gen_state *state, unsigned char *output, size_t n_bytes)
+{
+    if (n_bytes != sizeof *state) {
+        return -EINVAL;
+    }
+    memcpy(output, state, sizeof *state);
+    return 0;
+}
+
+
+/*
+ * Check that the hasher of an imported state is one that passacre_gen_init and
+ * the functions after it could have produced, since everything else trusts
+ * the sizes and counts in it.
+ */
+static int
+passacre_gen_check_hasher(const struct passacre_gen_state *state)
+{
+    switch (state->algorithm) {
+    case PASSACRE_KECCAK:
+    case PASSACRE_KECCAK_WIDE: {
+        const spongeState *sponge = &state->hasher.keccak;
+        int wide = state->algorithm == PASSACRE_KECCAK_WIDE;
+        if (sponge->rate != (wide? PASSACRE_KECCAK_WIDE_RATE : 64)
+                || sponge->capacity != (wide? PASSACRE_KECCAK_WIDE_CAPACITY : 1536)
+                || sponge->fixedOutputLength
+                || sponge->squeezing != state->finished_absorbing) {
+            return -EINVAL;
+        }
+        /* input is queued until a whole block is, and output is squeezed a
+         * byte at a time out of at most a block */
+        if (sponge->squeezing) {
+            if (sponge->bitsInQueue || sponge->bitsAvailableForSqueezing % 8
+                    || sponge->bitsAvailableForSqueezing > sponge->rate) {
+                return -EINVAL;
+            }
+        } else if (sponge->bitsInQueue % 8 || sponge->bitsInQueue >= sponge->rate
+                   || sponge->bitsAvailableForSqueezing) {
+            return -EINVAL;
+        }
+        return 0;
+    }
+
+    case PASSACRE_SKEIN:
+        if (state->finished_absorbing) {
+            const struct _skein_prng_state *prng = &state->hasher.skein_prng;
+            if (prng->threefish.stateSize != Threefish512 || prng->bytes_remaining > 64) {
+                return -EINVAL;
+            }
+        } else {
+            const SkeinCtx_t *skein = &state->hasher.skein;
+            if (skein->skeinSize != Skein512 || skein->m.h.hashBitLen != 512
+                    || skein->m.h.bCnt > SKEIN_512_BLOCK_BYTES) {
+                return -EINVAL;
+            }
+        }
+        return 0;
+
+    default:
+        return -EINVAL;
+    }
+}
+
+
+int
+passacre_gen_import_state(struct passacre_gen_state *state, const unsigned char *input, size_t n_bytes)
+{
+    struct passacre_gen_state imported;
+    if (n_bytes != sizeof imported) {
+        return -EINVAL;
+    }
+    memcpy(&imported, input, sizeof imported);
+    if (imported.algorithm != state->algorithm || imported.finished_absorbing > 1
+            || imported.keccak_impl >= PASSACRE_N_KECCAK_IMPLS
+            || !PASSACRE_KECCAK_IMPLS[imported.keccak_impl].supported()
+            || passacre_gen_check_hasher(&imported)) {
+        return -EINVAL;
+    }
+    memcpy(state, &imported, sizeof imported);
+    return 0;
+}
+
+
+/*
+ * Consecutive keccak jobs with the same method and number of null rounds can
+ * have their null rounds absorbed in lockstep. Returns how many jobs starting
+ * from the first can be grouped that way, and sets lanes to the permutation to
+ * use if there's more than one.
+ */
+static size_t
+passacre_gen_batch_group(const struct passacre_gen_job *jobs, size_t n_jobs,
+                         const struct passacre_keccak_lanes_impl **lanes)
+{
+    const struct passacre_keccak_impl *impl;
+    size_t n_grouped = 1, max_lanes = passacre_keccak_lanes();
+    *lanes = NULL;
+    if ((jobs[0].algorithm != PASSACRE_KECCAK && jobs[0].algorithm != PASSACRE_KECCAK_WIDE)
+            || max_lanes < 2) {
+        return 1;
+    }
+    impl = passacre_keccak_impl();
+    if (!impl || impl->layout == PASSACRE_KECCAK_INTERLEAVED) {
+        return 1;
+    }
+    while (n_grouped < n_jobs && n_grouped < max_lanes
+           && jobs[n_grouped].algorithm == jobs[0].algorithm
+           && jobs[n_grouped].iterations == jobs[0].iterations) {
+        ++n_grouped;
+    }
+    if (n_grouped > 1) {
+        *lanes = passacre_keccak_find_lanes(n_grouped);
+    }
+    return n_grouped;
+}
+
+
+/*
+ * Run each job through init, absorption, null rounds, and one squeeze of
+ * output_length bytes, writing the output of each job one after another into
+ * output. If states is not NULL, it must have room for n_jobs states, and the
+ * state for each job is left there so that it can be squeezed further.
+ */
+int
+passacre_gen_batch(const struct passacre_gen_job *jobs, size_t n_jobs,
+                   struct passacre_gen_state *states, unsigned char *output)
+{
+    struct passacre_gen_state scratch[PASSACRE_KECCAK_MAX_LANES];
+    struct passacre_gen_state *group[PASSACRE_KECCAK_MAX_LANES];
+    const struct passacre_keccak_lanes_impl *lanes;
+    size_t i, j, n_grouped;
+    int result;
+    for (i = 0; i < n_jobs; i += n_grouped) {
+        n_grouped = passacre_gen_batch_group(jobs + i, n_jobs - i, &lanes);
+        for (j = 0; j < n_grouped; ++j) {
+            const struct passacre_gen_job *job = &jobs[i + j];
+            group[j] = states? &states[i + j] : &scratch[j];
+            if ((result = passacre_gen_init(group[j], job->algorithm))) {
+                return result;
+            }
+            if ((result = passacre_gen_absorb_username_password_site(
+                     group[j], job->username, job->username_length,
+                     job->password, job->password_length,
+                     job->site, job->site_length))) {
+                return result;
+            }
+        }
+        if (lanes) {
+            for (j = 0; j < n_grouped; ++j) {
+                passacre_gen_count_null_rounds(group[j], jobs[i].iterations);
+            }
+            if (passacre_keccak_absorb_nulls_lanes(
+                    lanes, group, n_grouped,
+                    passacre_null_round_bytes(jobs[i].algorithm, jobs[i].iterations))) {
+                return -EINVAL;
+            }
+        } else {
+            for (j = 0; j < n_grouped; ++j) {
+                if ((result = passacre_gen_absorb_null_rounds(group[j], jobs[i + j].iterations))) {
+                    return result;
+                }
+            }
+        }
+        for (j = 0; j < n_grouped; ++j) {
+            if ((result = passacre_gen_squeeze(group[j], output, jobs[i + j].output_length))) {
+                return result;
+            }
+            output += jobs[i + j].output_length;
+        }
+    }
+    return 0;
+}
+
+
+/*
+ * Generate a password in one call: the job is absorbed and then squeezed with
+ * passacre_gen_squeeze_multibase, so its output_length is ignored.
+ */
+int
+passacre_gen_generate(const struct passacre_gen_job *job, const struct passacre_multibase *mb,
+                      unsigned char *output, size_t *output_length)
+{
+    struct passacre_gen_state state;
+    int result;
+    if ((result = passacre_gen_init(&state, job->algorithm))) {
+        return result;
+    }
+    if ((result = passacre_gen_absorb_username_password_site(
+             &state, job->username, job->username_length,
+             job->password, job->password_length,
+             job->site, job->site_length))) {
+        return result;
+    }
+    if ((result = passacre_gen_absorb_null_rounds(&state, job->iterations))) {
+        return result;
+    }
+    return passacre_gen_squeeze_multibase(&state, mb, output, output_length);
+}
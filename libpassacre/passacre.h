@@ -24,10 +24,71 @@
 enum passacre_gen_algorithm {
     PASSACRE_KECCAK,
     PASSACRE_SKEIN,
+    PASSACRE_KECCAK_WIDE,
 };
 
 struct passacre_gen_state;
 
+struct passacre_gen_job {
+    enum passacre_gen_algorithm algorithm;
+    const unsigned char *username;
+    size_t username_length;
+    const unsigned char *password;
+    size_t password_length;
+    const unsigned char *site;
+    size_t site_length;
+    size_t iterations;
+    size_t output_length;
+};
+
+/*
+ * A mixed-radix base to encode generated values with, as runs of digits from
+ * the most significant to the least. Run i is run_lengths[i] digits, each with
+ * the base run_bases[i]. Base j has radices[j] possible values, and symbol k
+ * of it is the bytes from symbol_offsets[j][k] to symbol_offsets[j][k + 1] in
+ * symbols[j], none of which are longer than longest_symbols[j]. Each base has
+ * its own tables, so they can be shared by every multibase using that base.
+ * n_bytes is how many bytes to squeeze for each candidate value, of which only
+ * the low n_bits bits are used.
+ */
+struct passacre_multibase {
+    size_t n_runs;
+    const size_t *run_lengths;
+    const size_t *run_bases;
+    size_t n_bases;
+    const size_t *radices;
+    const size_t *longest_symbols;
+    const size_t *const *symbol_offsets;
+    const unsigned char *const *symbols;
+    size_t n_bytes;
+    size_t n_bits;
+};
+
+/*
+ * Counts of the work a generator state has done since it was initialized.
+ * Blocks are keccak permutations, or skein and threefish block computations.
+ * Absorbed bytes include null rounds, and rejections are candidate values
+ * which were too large to encode and had to be squeezed again.
+ */
+struct passacre_gen_stats {
+    unsigned long long bytes_absorbed;
+    unsigned long long null_rounds;
+    unsigned long long absorb_blocks;
+    unsigned long long bytes_squeezed;
+    unsigned long long squeeze_blocks;
+    unsigned long long rejections;
+};
+
+PASSACRE_EXPORT const char *passacre_keccak_impl_name(size_t);
+PASSACRE_EXPORT int passacre_keccak_impl_supported(size_t);
+PASSACRE_EXPORT const char *passacre_keccak_active_impl(void);
+PASSACRE_EXPORT int passacre_keccak_select_impl(const char *);
+PASSACRE_EXPORT const char *passacre_skein_impl_name(size_t);
+PASSACRE_EXPORT const char *passacre_skein_active_impl(void);
+PASSACRE_EXPORT int passacre_skein_select_impl(const char *);
+PASSACRE_EXPORT unsigned int passacre_keccak_lanes(void);
+PASSACRE_EXPORT int passacre_keccak_set_lanes(unsigned int);
+
 PASSACRE_EXPORT size_t passacre_gen_size(void);
 PASSACRE_EXPORT int passacre_gen_init(struct passacre_gen_state *, enum passacre_gen_algorithm);
 PASSACRE_EXPORT int passacre_gen_absorb_username_password_site(
@@ -35,5 +96,17 @@ PASSACRE_EXPORT int passacre_gen_absorb_username_password_site(
     const unsigned char *, size_t, const unsigned char *, size_t);
 PASSACRE_EXPORT int passacre_gen_absorb_null_rounds(struct passacre_gen_state *, size_t);
 PASSACRE_EXPORT int passacre_gen_squeeze(struct passacre_gen_state *, unsigned char *, size_t);
+PASSACRE_EXPORT int passacre_gen_squeeze_multibase(
+    struct passacre_gen_state *, const struct passacre_multibase *, unsigned char *, size_t *);
+PASSACRE_EXPORT int passacre_gen_encode_multibase(
+    struct passacre_gen_state *, const unsigned char *, const struct passacre_multibase *,
+    unsigned char *, size_t *);
+PASSACRE_EXPORT int passacre_gen_get_stats(struct passacre_gen_state *, struct passacre_gen_stats *);
+PASSACRE_EXPORT int passacre_gen_export_state(struct passacre_gen_state *, unsigned char *, size_t);
+PASSACRE_EXPORT int passacre_gen_import_state(struct passacre_gen_state *, const unsigned char *, size_t);
+PASSACRE_EXPORT int passacre_gen_batch(
+    const struct passacre_gen_job *, size_t, struct passacre_gen_state *, unsigned char *);
+PASSACRE_EXPORT int passacre_gen_generate(
+    const struct passacre_gen_job *, const struct passacre_multibase *, unsigned char *, size_t *);
 
 #endif
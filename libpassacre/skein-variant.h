@@ -0,0 +1,23 @@
+/*
+ * Copyright (c) Aaron Gallagher <_@habnab.it>
+ * See COPYING for details.
+ */
+
+/*
+ * This header is force-included when compiling each variant of the skein-512
+ * block function, so that several of them can be linked into libpassacre at
+ * once. PASSACRE_SKEIN_VARIANT names the variant, and the block function is
+ * prefixed with it. The rest of skein is only built once and uses the plain
+ * threefish-based block function.
+ */
+
+#ifndef _PASSACRE_SKEIN_VARIANT_H_
+#define _PASSACRE_SKEIN_VARIANT_H_ 1
+
+#define PASSACRE_SKEIN_NAME__(variant, name) passacre_skein_ ## variant ## _ ## name
+#define PASSACRE_SKEIN_NAME_(variant, name) PASSACRE_SKEIN_NAME__(variant, name)
+#define PASSACRE_SKEIN_NAME(name) PASSACRE_SKEIN_NAME_(PASSACRE_SKEIN_VARIANT, name)
+
+#define Skein_512_Process_Block PASSACRE_SKEIN_NAME(Process_Block)
+
+#endif
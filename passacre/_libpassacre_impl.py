@@ -1,9 +1,12 @@
-import math
-import sys
+import contextlib
+import threading
+import weakref
 
 from cffi.verifier import Verifier
 
 from _libpassacre import ffi, preamble
+from passacre.multibase import _BaseCache, multibase_required_bytes
+from passacre import _shake
 
 
 ffi.verifier = Verifier(
@@ -19,19 +22,271 @@ C = ffi.verifier.load_library()
 _ALGORITHMS = {
     'keccak': C.PASSACRE_KECCAK,
     'skein': C.PASSACRE_SKEIN,
+    'keccak-v2': C.PASSACRE_KECCAK,
+    'skein-v2': C.PASSACRE_SKEIN,
+    'keccak-wide': C.PASSACRE_KECCAK_WIDE,
 }
 
+# methods which mask squeezed values to the bit length of the largest value a
+# multibase can encode before rejecting them, instead of using whole bytes
+_EXACT_BITS_METHODS = frozenset(['keccak-v2', 'skein-v2', 'keccak-wide'])
 
-if sys.version_info < (3,):  # pragma: nocover
-    def int_of_bytes(b):
-        ret = 0
-        for c in b:
-            ret = (ret << 8) | ord(c)
-        return ret
+# methods implemented in python, which don't need libpassacre at all
+_PYTHON_METHODS = _shake.METHODS
+
+_STATE_SIZE = C.passacre_gen_size()
+
+# the fields of struct passacre_gen_stats, in order
+STATS = [
+    'bytes_absorbed', 'null_rounds', 'absorb_blocks',
+    'bytes_squeezed', 'squeeze_blocks', 'rejections',
+]
+
+
+def keccak_implementations():
+    """List the keccak implementations built into libpassacre.
+
+    Returns a list of ``(name, supported)`` tuples, where ``supported`` is
+    whether the implementation can run on this machine.
+    """
+
+    ret = []
+    index = 0
+    while True:
+        name = C.passacre_keccak_impl_name(index)
+        if name == ffi.NULL:
+            return ret
+        ret.append((
+            ffi.string(name).decode('ascii'),
+            bool(C.passacre_keccak_impl_supported(index))))
+        index += 1
+
+
+def keccak_implementation():
+    """Return the name of the keccak implementation new generators will use.
+
+    Unless one was selected, the first call picks the fastest supported
+    implementation, or the one named by the ``PASSACRE_KECCAK_IMPL``
+    environment variable.
+    """
+
+    name = C.passacre_keccak_active_impl()
+    if name == ffi.NULL:
+        return None
+    return ffi.string(name).decode('ascii')
+
+
+def select_keccak_implementation(name=None):
+    """Force new generators to use a particular keccak implementation.
+
+    If ``name`` is ``None``, go back to picking one automatically. Raises
+    ``ValueError`` if there's no supported implementation by that name.
+    """
+
+    if name is None:
+        C.passacre_keccak_select_impl(ffi.NULL)
+    elif C.passacre_keccak_select_impl(name.encode('ascii')):
+        raise ValueError('unknown or unsupported keccak implementation', name)
+
+
+def skein_implementations():
+    "List the names of the skein-512 block functions built into libpassacre."
+    ret = []
+    index = 0
+    while True:
+        name = C.passacre_skein_impl_name(index)
+        if name == ffi.NULL:
+            return ret
+        ret.append(ffi.string(name).decode('ascii'))
+        index += 1
+
+
+def skein_implementation():
+    """Return the name of the skein-512 block function used for null rounds.
+
+    Unless one was selected, the first call picks the fastest one, or the one
+    named by the ``PASSACRE_SKEIN_IMPL`` environment variable.
+    """
+
+    return ffi.string(C.passacre_skein_active_impl()).decode('ascii')
+
+
+def select_skein_implementation(name=None):
+    """Force null rounds to use a particular skein-512 block function.
+
+    If ``name`` is ``None``, go back to picking one automatically. Raises
+    ``ValueError`` if there's no implementation by that name.
+    """
+
+    if name is None:
+        C.passacre_skein_select_impl(ffi.NULL)
+    elif C.passacre_skein_select_impl(name.encode('ascii')):
+        raise ValueError('unknown skein implementation', name)
+
+
+def keccak_lanes():
+    """Return how many keccak states batch generation can permute at once.
+
+    Consecutive keccak jobs in a batch with the same number of rounds have
+    their null rounds absorbed together, up to this many at a time.
+    """
+
+    return C.passacre_keccak_lanes()
+
+
+def set_keccak_lanes(lanes=None):
+    """Limit how many keccak states batch generation permutes at once.
+
+    ``1`` turns off permuting several states together, and ``None`` goes back
+    to using as many as this machine supports. Raises ``ValueError`` if this
+    machine doesn't support that many.
+    """
+
+    if C.passacre_keccak_set_lanes(lanes or 0):
+        raise ValueError('unsupported number of keccak lanes', lanes)
+
+
+def methods():
+    "Return the names of the hash methods passwords can be generated with."
+    return sorted(list(_ALGORITHMS) + list(_PYTHON_METHODS))
+
+
+class _NativeBase(object):
+    "The symbols of one base, as libpassacre encodes with them."
+
+    def __init__(self, base):
+        encoded = [
+            symbol if isinstance(symbol, bytes) else symbol.encode('utf-8')
+            for symbol in base]
+        offsets = [0]
+        for symbol in encoded:
+            offsets.append(offsets[-1] + len(symbol))
+        self.radix = len(encoded)
+        self.longest_symbol = max(len(symbol) for symbol in encoded)
+        self.offsets = ffi.new('size_t[]', offsets)
+        self.symbols = ffi.new('unsigned char[]', b''.join(encoded))
+
+
+# shared by every multibase using the same base object, so a large words list
+# is only encoded once
+_native_bases = _BaseCache(64)
+
+
+class _CompiledMultiBase(object):
+    def __init__(self, mb):
+        mb = mb.compile()
+        base_indices = {}
+        run_lengths = []
+        run_bases = []
+        self._bases = []
+        self.output_length = 0
+        for base, count in mb.flat_runs():
+            index = base_indices.get(id(base))
+            if index is None:
+                index = base_indices[id(base)] = len(self._bases)
+                self._bases.append(_native_bases.get(base, _NativeBase))
+            if run_bases and run_bases[-1] == index:
+                run_lengths[-1] += count
+            else:
+                run_lengths.append(count)
+                run_bases.append(index)
+            self.output_length += self._bases[index].longest_symbol * count
+        self._run_lengths = ffi.new('size_t[]', run_lengths)
+        self._run_bases = ffi.new('size_t[]', run_bases)
+        self._radices = ffi.new('size_t[]', [base.radix for base in self._bases])
+        self._longest_symbols = ffi.new(
+            'size_t[]', [base.longest_symbol for base in self._bases])
+        self._offsets = ffi.new('size_t *[]', [base.offsets for base in self._bases])
+        self._symbols = ffi.new(
+            'unsigned char *[]', [base.symbols for base in self._bases])
+        n_bytes = mb.required_bytes
+        self.multibase, self.exact_bits_multibase = [
+            ffi.new('struct passacre_multibase *', {
+                'n_runs': len(run_lengths),
+                'run_lengths': self._run_lengths,
+                'run_bases': self._run_bases,
+                'n_bases': len(self._bases),
+                'radices': self._radices,
+                'longest_symbols': self._longest_symbols,
+                'symbol_offsets': self._offsets,
+                'symbols': self._symbols,
+                'n_bytes': n_bytes,
+                'n_bits': n_bits,
+            })
+            for n_bits in [n_bytes * 8, mb.required_bits]]
+
+    def call(self, exact_bits, func, *args):
+        output = ffi.new('unsigned char[]', self.output_length)
+        output_length = ffi.new('size_t *', self.output_length)
+        multibase = self.exact_bits_multibase if exact_bits else self.multibase
+        result = func(*(args + (multibase, output, output_length)))
+        if result:
+            raise GeneratorError(-result)
+        return ffi.buffer(output, output_length[0])[:].decode('utf-8')
+
+
+_compiled_multibases = weakref.WeakKeyDictionary()
+
+
+def compile_multibase(mb):
+    """Convert a multibase to the form libpassacre encodes with.
+
+    The result is cached alongside ``mb.compile()``, for as long as that's
+    alive.
+    """
+
+    mb = mb.compile()
+    compiled = _compiled_multibases.get(mb)
+    if compiled is None:
+        compiled = _compiled_multibases[mb] = _CompiledMultiBase(mb)
+    return compiled
+
+
+def _pack_jobs(jobs):
+    strings = []
+    offsets = []
+    offset = 0
+    for algorithm, username, password, site, _, _ in jobs:
+        if algorithm not in _ALGORITHMS:
+            raise ValueError('unknown algorithm', algorithm)
+        job_offsets = []
+        for string in [username or b'', password, site]:
+            strings.append(string)
+            job_offsets.append(offset)
+            offset += len(string)
+        offsets.append(job_offsets)
+    blob = ffi.new('unsigned char[]', b''.join(strings))
+
+    c_jobs = ffi.new('struct passacre_gen_job[]', len(jobs))
+    for e, (algorithm, username, password, site, rounds, n_bytes) in enumerate(jobs):
+        username_offset, password_offset, site_offset = offsets[e]
+        c_job = c_jobs[e]
+        c_job.algorithm = _ALGORITHMS[algorithm]
+        if username is None:
+            c_job.username = ffi.NULL
+        else:
+            c_job.username = blob + username_offset
+            c_job.username_length = len(username)
+        c_job.password = blob + password_offset
+        c_job.password_length = len(password)
+        c_job.site = blob + site_offset
+        c_job.site_length = len(site)
+        c_job.iterations = rounds
+        c_job.output_length = n_bytes
+    return blob, c_jobs
+
+
+def generate_for_multibase(algorithm, username, password, site, rounds, mb):
+    """Generate a password encoded with a multibase in one call.
+
+    This absorbs, squeezes, and encodes entirely in libpassacre, and returns
+    the same string as ``squeeze_for_multibase`` would on a generator which
+    had absorbed the username, password, site, and null rounds.
+    """
 
-else:
-    def int_of_bytes(b):
-        return int.from_bytes(b, 'big')
+    blob, c_jobs = _pack_jobs([(algorithm, username, password, site, rounds, 0)])
+    return compile_multibase(mb).call(
+        algorithm in _EXACT_BITS_METHODS, C.passacre_gen_generate, c_jobs)
 
 
 class GeneratorError(Exception):
@@ -42,17 +297,96 @@ class Generator(object):
     def __init__(self, algorithm):
         if algorithm not in _ALGORITHMS:
             raise ValueError('unknown algorithm', algorithm)
-        size = C.passacre_gen_size()
         self._algorithm = algorithm
-        self._buf = ffi.new('unsigned char []', size)
+        self._exact_bits = algorithm in _EXACT_BITS_METHODS
+        self._buf = ffi.new('unsigned char []', _STATE_SIZE)
         self._context = ffi.cast('struct passacre_gen_state *', self._buf)
         self._check(C.passacre_gen_init, _ALGORITHMS[algorithm])
 
+    @classmethod
+    def _from_context(cls, algorithm, buf, context):
+        self = cls.__new__(cls)
+        self._algorithm = algorithm
+        self._exact_bits = algorithm in _EXACT_BITS_METHODS
+        self._buf = buf
+        self._context = context
+        return self
+
+    @classmethod
+    def batch(cls, jobs):
+        """Create and squeeze many generators with one call into libpassacre.
+
+        Each job must be a tuple of ``(algorithm, username, password, site,
+        rounds, n_bytes)``. Returns a list of ``(generator, output)`` tuples,
+        where ``output`` is the result of squeezing ``n_bytes`` bytes after
+        absorbing the username, password, site, and null rounds, and
+        ``generator`` can be squeezed further.
+        """
+
+        jobs = list(jobs)
+        if not jobs:
+            return []
+        blob, c_jobs = _pack_jobs(jobs)
+        output_length = sum(n_bytes for _, _, _, _, _, n_bytes in jobs)
+
+        size = _STATE_SIZE
+        buf = ffi.new('unsigned char[]', size * len(jobs))
+        states = ffi.cast('struct passacre_gen_state *', buf)
+        output = ffi.new('unsigned char[]', output_length)
+        result = C.passacre_gen_batch(c_jobs, len(jobs), states, output)
+        if result:
+            raise GeneratorError(-result)
+        output = ffi.buffer(output)[:]
+
+        ret = []
+        offset = 0
+        for e, (algorithm, _, _, _, _, n_bytes) in enumerate(jobs):
+            context = ffi.cast('struct passacre_gen_state *', buf + size * e)
+            ret.append((
+                cls._from_context(algorithm, buf, context),
+                output[offset:offset + n_bytes]))
+            offset += n_bytes
+        return ret
+
     def _check(self, func, *args):
         result = func(self._context, *args)
         if result:
             raise GeneratorError(-result)
 
+    def reset(self, algorithm=None):
+        """Reinitialize this generator, discarding everything it absorbed.
+
+        If ``algorithm`` is given, the generator switches to that algorithm.
+        The state is reused in place instead of being reallocated, and is
+        zeroed before being initialized again.
+        """
+
+        if algorithm is None:
+            algorithm = self._algorithm
+        elif algorithm not in _ALGORITHMS:
+            raise ValueError('unknown algorithm', algorithm)
+        self._check(C.passacre_gen_init, _ALGORITHMS[algorithm])
+        self._algorithm = algorithm
+        self._exact_bits = algorithm in _EXACT_BITS_METHODS
+
+    def _state_buffer(self):
+        return ffi.buffer(ffi.cast('unsigned char *', self._context), _STATE_SIZE)
+
+    def copy_from(self, other):
+        """Replace this generator's state with a copy of ``other``'s, switching
+        to ``other``'s algorithm.
+        """
+
+        self._state_buffer()[:] = other._state_buffer()
+        self._algorithm = other._algorithm
+        self._exact_bits = other._exact_bits
+
+    def copy(self):
+        "Return a new generator with a copy of this generator's state."
+        ret = type(self)(self._algorithm)
+        ret.copy_from(self)
+        return ret
+
     def absorb_username_password_site(self, username, password, site):
         if username is None:
             username = ffi.NULL
@@ -63,19 +397,134 @@ class Generator(object):
             C.passacre_gen_absorb_username_password_site,
             username, username_length, password, len(password), site, len(site))
 
-    def absorb_null_rounds(self, rounds):
-        self._check(C.passacre_gen_absorb_null_rounds, rounds)
+    def absorb_null_rounds(self, rounds, chunked=None):
+        """Absorb ``rounds`` null rounds.
+
+        This is one call into libpassacre, unless ``chunked`` is a
+        ``passacre.util.ChunkedAbsorption``, in which case the rounds are
+        absorbed one chunk at a time with it.
+        """
+
+        if chunked is None:
+            self._check(C.passacre_gen_absorb_null_rounds, rounds)
+        else:
+            chunked.absorb(self.absorb_null_rounds, rounds)
+
+    @property
+    def stats(self):
+        """A dict of counts of the work this generator has done since it was
+        initialized or reset.
+
+        ``bytes_absorbed`` includes the bytes of null rounds, which are also
+        counted in ``null_rounds``. ``absorb_blocks`` and ``squeeze_blocks``
+        are keccak permutations, or skein and threefish block computations.
+        ``rejections`` counts values squeezed for a multibase which were too
+        large to encode. The counts are part of the state, so they're also
+        saved by ``snapshot`` and replaced by ``restore``.
+        """
+
+        stats = ffi.new('struct passacre_gen_stats *')
+        self._check(C.passacre_gen_get_stats, stats)
+        return dict((name, getattr(stats, name)) for name in STATS)
+
+    def snapshot(self):
+        """Return a copy of this generator's state as a byte string.
+
+        The snapshot can be passed to ``restore`` on a generator using the same
+        algorithm, e.g. to absorb more null rounds after having squeezed. It's
+        only valid for the build of libpassacre which produced it.
+        """
+
+        output = ffi.new('unsigned char[]', _STATE_SIZE)
+        self._check(C.passacre_gen_export_state, output, _STATE_SIZE)
+        return ffi.buffer(output)[:]
+
+    def restore(self, snapshot):
+        "Replace this generator's state with one returned from ``snapshot``."
+        self._check(C.passacre_gen_import_state, snapshot, len(snapshot))
 
     def squeeze(self, n_bytes):
         output = ffi.new('unsigned char[]', n_bytes)
         self._check(C.passacre_gen_squeeze, output, n_bytes)
         return ffi.buffer(output)[:]
 
+    def squeeze_into(self, buffer):
+        """Squeeze directly into a writable buffer, such as a ``bytearray`` or
+        ``memoryview``, filling all of it. Returns the number of bytes
+        squeezed.
+        """
+
+        if memoryview(buffer).readonly:
+            raise TypeError('squeeze_into requires a writable buffer')
+        output = ffi.from_buffer(buffer)
+        n_bytes = len(output)
+        self._check(C.passacre_gen_squeeze, ffi.cast('unsigned char *', output), n_bytes)
+        return n_bytes
+
     def squeeze_for_multibase(self, mb):
-        required_bytes = int(math.ceil(
-            math.log(mb.max_encodable_value + 1, 256)))
-        while True:
-            value = int_of_bytes(self.squeeze(required_bytes))
-            if value <= mb.max_encodable_value:
-                break
-        return mb.encode(value)
+        return compile_multibase(mb).call(
+            self._exact_bits, C.passacre_gen_squeeze_multibase, self._context)
+
+    def encode_for_multibase(self, mb, squeezed):
+        """Encode already-squeezed bytes with a multibase.
+
+        ``squeezed`` must be the result of squeezing
+        ``multibase_required_bytes(mb)`` bytes from this generator. If that
+        value is too large to encode, this continues on as
+        ``squeeze_for_multibase`` would have.
+        """
+
+        required_bytes = multibase_required_bytes(mb)
+        if len(squeezed) != required_bytes:
+            raise ValueError('expected %d squeezed bytes, not %d' % (
+                required_bytes, len(squeezed)))
+        return compile_multibase(mb).call(
+            self._exact_bits, C.passacre_gen_encode_multibase, self._context,
+            squeezed)
+
+
+class GeneratorPool(object):
+    """Reusable generator states, kept separately for each thread.
+
+    Generators are reset when they're released, so nothing absorbed into one
+    outlives its use. At most ``size`` released generators are kept per
+    thread.
+    """
+
+    def __init__(self, size=8):
+        self.size = size
+        self._local = threading.local()
+
+    def _free(self):
+        free = getattr(self._local, 'free', None)
+        if free is None:
+            free = self._local.free = []
+        return free
+
+    def acquire(self, algorithm):
+        "Return a freshly initialized generator for ``algorithm``."
+        free = self._free()
+        if not free:
+            return Generator(algorithm)
+        generator = free.pop()
+        generator.reset(algorithm)
+        return generator
+
+    def release(self, generator):
+        "Reset ``generator`` and keep it for reuse by this thread."
+        generator.reset()
+        free = self._free()
+        if len(free) < self.size:
+            free.append(generator)
+
+    @contextlib.contextmanager
+    def generator(self, algorithm):
+        "A context manager for acquiring and then releasing a generator."
+        generator = self.acquire(algorithm)
+        try:
+            yield generator
+        finally:
+            self.release(generator)
+
+
+generator_pool = GeneratorPool()
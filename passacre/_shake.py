@@ -0,0 +1,141 @@
+# Copyright (c) Aaron Gallagher <_@habnab.it>
+# See COPYING for details.
+
+import hashlib
+
+from passacre.compat import int_of_bytes
+
+
+# SHAKE256's rate, in bytes
+_RATE = 136
+# a null round is as many permutations as the original keccak method does for
+# 1024 null bytes at its 8-byte rate, as with keccak-wide
+_NULL_ROUND = b'\0' * (1024 // 8 * _RATE)
+# null rounds are fed to hashlib this many at a time
+_NULL_ROUNDS_PER_UPDATE = 4
+_NULL_ROUNDS = _NULL_ROUND * _NULL_ROUNDS_PER_UPDATE
+
+
+class ShakeGenerator(object):
+    """A generator using hashlib's SHAKE256, which doesn't need libpassacre.
+
+    It has the same interface as libpassacre's ``Generator``, and absorbs the
+    username, password, site, and null rounds the same way. Values squeezed
+    for a multibase are masked to the exact number of bits needed, as with
+    the ``-v2`` methods.
+    """
+
+    def __init__(self, algorithm='shake256'):
+        if algorithm not in METHODS:
+            raise ValueError('unknown algorithm', algorithm)
+        if not hasattr(hashlib, 'shake_256'):
+            raise ValueError(
+                "this python's hashlib doesn't provide shake_256", algorithm)
+        self._algorithm = algorithm
+        self.reset()
+
+    def reset(self, algorithm=None):
+        "Reinitialize this generator, discarding everything it absorbed."
+        if algorithm is not None:
+            if algorithm not in METHODS:
+                raise ValueError('unknown algorithm', algorithm)
+            self._algorithm = algorithm
+        self._hash = hashlib.shake_256()
+        self._squeezed = None
+        self._null_rounds = self._rejections = 0
+        self._absorbed = 0
+
+    def _absorb(self, data):
+        if self._squeezed is not None:
+            raise ValueError("can't absorb after squeezing")
+        self._hash.update(data)
+        self._absorbed += len(data)
+
+    def absorb_username_password_site(self, username, password, site):
+        if username is not None:
+            self._absorb(username + b':')
+        self._absorb(password + b':' + site)
+
+    def absorb_null_rounds(self, rounds, chunked=None):
+        if chunked is not None:
+            chunked.absorb(self.absorb_null_rounds, rounds)
+            return
+        full, rest = divmod(rounds, _NULL_ROUNDS_PER_UPDATE)
+        for _ in range(full):
+            self._absorb(_NULL_ROUNDS)
+        self._absorb(_NULL_ROUND * rest)
+        self._null_rounds += rounds
+
+    @property
+    def stats(self):
+        """The same counts as libpassacre generators' ``stats``.
+
+        hashlib doesn't report how many permutations it did, so the blocks are
+        how many a SHAKE256 sponge absorbing and squeezing the same bytes would
+        need.
+        """
+
+        squeezed = self._squeezed or 0
+        return {
+            'bytes_absorbed': self._absorbed,
+            'null_rounds': self._null_rounds,
+            'absorb_blocks': self._absorbed // _RATE,
+            'bytes_squeezed': squeezed,
+            'squeeze_blocks': (squeezed + _RATE - 1) // _RATE,
+            'rejections': self._rejections,
+        }
+
+    def snapshot(self):
+        """Return a copy of this generator's state.
+
+        Unlike with libpassacre's generators, the snapshot is an opaque object
+        rather than a byte string.
+        """
+
+        return (self._hash.copy(), self._squeezed, self._absorbed,
+                self._null_rounds, self._rejections)
+
+    def restore(self, snapshot):
+        "Replace this generator's state with one returned from ``snapshot``."
+        (hash, self._squeezed, self._absorbed,
+         self._null_rounds, self._rejections) = snapshot
+        self._hash = hash.copy()
+
+    def squeeze(self, n_bytes):
+        # hashlib can only produce output from the start, so keep track of how
+        # much has been squeezed and skip past it
+        squeezed = self._squeezed or 0
+        self._squeezed = squeezed + n_bytes
+        return self._hash.digest(self._squeezed)[squeezed:]
+
+    def squeeze_into(self, buffer):
+        """Squeeze directly into a writable buffer, filling all of it. Returns
+        the number of bytes squeezed.
+        """
+
+        view = memoryview(buffer)
+        if view.readonly:
+            raise TypeError('squeeze_into requires a writable buffer')
+        view = view.cast('B')
+        view[:] = self.squeeze(len(view))
+        return len(view)
+
+    def squeeze_for_multibase(self, mb):
+        mb = mb.compile()
+        required_bytes = mb.required_bytes
+        mask = (1 << mb.required_bits) - 1
+        max_value = mb.max_encodable_value
+        if mb.bits == mb.required_bits:
+            # every value of that many bits can be encoded, so none are rejected
+            return mb.encode(int_of_bytes(self.squeeze(required_bytes)) & mask)
+        while True:
+            value = int_of_bytes(self.squeeze(required_bytes)) & mask
+            if value <= max_value:
+                break
+            self._rejections += 1
+        return mb.encode(value)
+
+
+METHODS = {
+    'shake256': ShakeGenerator,
+}
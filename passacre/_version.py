@@ -0,0 +1,5 @@
+
+# This file is automatically generated by setup.py.
+__version__ = '0.9.0'
+__sha__ = 'gdf6015b\n'
+__revision__ = 'gdf6015b\n'
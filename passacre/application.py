@@ -3,21 +3,27 @@
 
 from __future__ import unicode_literals, print_function
 
+from passacre._libpassacre_impl import (
+    STATS, keccak_implementation, keccak_implementations, skein_implementation,
+    skein_implementations)
 from passacre.compat import input, argparse, python_2_encode
 from passacre.config import load as load_config, SqliteConfig
 from passacre.generator import hash_site
+from passacre import generator
 from passacre.jsonmini import unparse as jdumps
 from passacre.schema import multibase_of_schema
-from passacre.util import reify, dotify, nested_get, jloads, errormark
+from passacre.util import ChunkedAbsorption, reify, dotify, nested_get, jloads, errormark
 from passacre import __version__, completion, features, yaml2sqlite
 
 import atexit
 import collections
+import contextlib
 from getpass import getpass
 import math
 import operator
 import os
 import sys
+import threading
 import time
 import traceback
 
@@ -140,6 +146,44 @@ class Passacre(object):
             confirm = True
         return self._prompt_password(confirm)
 
+    @contextlib.contextmanager
+    def prefetching_yubikey(self, site, override=None):
+        """While the block runs, fetch the YubiKey response a site's password
+        will need in a background thread, so that the YubiKey is used while
+        waiting for the password to be entered instead of after.
+
+        The response is kept in the current YubiKey session, or one started
+        for the duration of the block. If fetching it fails, it's fetched again
+        (and the error reported) when the password is generated. Nothing is
+        fetched if which slot the site uses can't be known without the
+        password, i.e. if its configuration might be under its hashed name.
+        """
+
+        slot = (override or {}).get('yubikey-slot')
+        if slot is None:
+            config = self.config.guess_site(site)
+            slot = config and config.get('yubikey-slot')
+        if not slot or not features.yubikey.usable:
+            yield
+            return
+        session = generator.yubikey_session
+        owned = session is None
+        if owned:
+            session = generator.enable_yubikey_session(ttl=None)
+        def fetch():
+            try:
+                session.response(slot)
+            except Exception:
+                pass
+        thread = threading.Thread(target=fetch)
+        thread.daemon = True
+        thread.start()
+        try:
+            yield
+        finally:
+            if owned:
+                generator.disable_yubikey_session()
+
 
     def init_args(self, subparser):
         subparser.add_argument('path', nargs='?', default='~/.passacre.sqlite',
@@ -179,6 +223,8 @@ class Passacre(object):
                                help="don't write a newline after the password")
         subparser.add_argument('-c', '--confirm', action='store_true',
                                help='confirm prompted password')
+        subparser.add_argument('--stats', action='store_true',
+                               help='write counts of the hashing work done to stderr')
         if self.xerox is not None:
             subparser.add_argument('-C', '--copy', action='store_true',
                                    help='put the generated password on the clipboard')
@@ -193,9 +239,20 @@ class Passacre(object):
         "Generate a password."
         if args.site is None:
             args.site = self.prompt('Site: ')
-        password = self.prompt_password(args.confirm)
-        password = self.config.generate_for_site(
-            args.username, password, args.site, args.override_config)
+        with self.prefetching_yubikey(args.site, args.override_config):
+            password = self.prompt_password(args.confirm)
+            # absorbing in chunks lets ^C interrupt high iteration counts
+            chunked = ChunkedAbsorption()
+            if args.stats:
+                password, stats = self.config.generate_for_site(
+                    args.username, password, args.site, args.override_config,
+                    with_stats=True, chunked=chunked)
+                for name in STATS:
+                    sys.stderr.write('%s: %d\n' % (name.replace('_', ' '), stats[name]))
+            else:
+                password = self.config.generate_for_site(
+                    args.username, password, args.site, args.override_config,
+                    chunked=chunked)
         self._process_generated_password(password, args)
 
     def _process_generated_password(self, password, args):
@@ -504,6 +561,14 @@ class Passacre(object):
     def info_action(self, args):
         print('passacre version ' + __version__)
         print()
+        print('keccak implementation: %s' % (keccak_implementation(),))
+        for name, supported in keccak_implementations():
+            print('  "%s": %s' % (name, 'usable' if supported else 'NOT USABLE'))
+        print()
+        print('skein implementation: %s' % (skein_implementation(),))
+        for name in skein_implementations():
+            print('  "%s"' % (name,))
+        print()
         for feature in features.features:
             outcome = 'usable' if feature.usable else 'NOT USABLE'
             print('feature "%s": %s' % (feature.name, outcome))
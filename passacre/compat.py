@@ -4,6 +4,7 @@
 import binascii
 import functools
 import sys
+import time
 
 
 if sys.version_info < (3,):  # pragma: nocover
@@ -17,6 +18,11 @@ if sys.version_info < (3,):  # pragma: nocover
         return s
     iterbytes = functools.partial(map, ord)
     hexlify = binascii.hexlify
+    def int_of_bytes(b):
+        ret = 0
+        for c in b:
+            ret = (ret << 8) | ord(c)
+        return ret
 else:  # pragma: nocover
     input = input
     unichr = chr
@@ -29,11 +35,22 @@ else:  # pragma: nocover
     iterbytes = iter
     def hexlify(s):
         return binascii.hexlify(s).decode()
+    def int_of_bytes(b):
+        return int.from_bytes(b, 'big')
 
 
 import passacre._argparse as argparse
 
 
+try:
+    from collections import OrderedDict
+except ImportError:  # pragma: nocover
+    from passacre._ordereddict import OrderedDict
+
+
+monotonic = getattr(time, 'monotonic', time.time)
+
+
 try:
     from crochet import setup as crochet_setup, wait_for_reactor
 except ImportError:  # pragma: nocover
@@ -45,5 +62,5 @@ except ImportError:  # pragma: nocover
 
 __all__ = [
     'input', 'argparse', 'unichr', 'unicode', 'long', 'crochet_setup', 'wait_for_reactor',
-    'iterbytes', 'hexlify',
+    'iterbytes', 'hexlify', 'int_of_bytes', 'monotonic', 'OrderedDict',
 ]
@@ -3,6 +3,7 @@
 
 from __future__ import print_function
 
+from passacre._libpassacre_impl import methods
 from passacre import _argparse as argparse
 
 
@@ -63,7 +64,7 @@ class HashMethodsCompleter(object):
         return '_passacre_hash_methods'
 
     def fish_action(self):
-        return 'keccak skein'
+        return ' '.join(methods())
 
 
 def zsh_arguments_for(arguments):
@@ -171,13 +172,13 @@ _passacre_schemata () {
 
 _passacre_hash_methods () {
     local -a _passacre_hash_method_list
-    _passacre_hash_method_list=(keccak skein)
+    _passacre_hash_method_list=(%s)
     _wanted _passacre_hash_method_list expl 'passacre hash methods' compadd -a _passacre_hash_method_list
 }
 
 
 _passacre "$@"
-""" % (' '.join(zsh_arguments_for(arguments)),))
+""" % (' '.join(zsh_arguments_for(arguments)), ' '.join(methods())))
 
 
 def _fish_completion_for(parser, name='passacre'):
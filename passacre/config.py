@@ -13,9 +13,14 @@ import os
 import sys
 
 
+# always the same list, so verifying a schema shares multibase_of_schema's
+# cached multibase instead of adding another one for a new words list
+_VERIFICATION_WORDS = ['a']
+
+
 @errormark('verifying schema: {0!r}')
 def verify_multibase_schema(schema):
-    multibase_of_schema(schema, ['a'])
+    multibase_of_schema(schema, _VERIFICATION_WORDS)
 
 
 global_config_options = set("""
@@ -91,7 +96,30 @@ class ConfigBase(object):
             config = self.defaults
         return config
 
-    def generate_for_site(self, username, password, site, override=()):
+    def guess_site(self, site):
+        """Return the configuration for a site if it can be known without the
+        password, or None if it might depend on the site's hashed name, which
+        can't be worked out without the password.
+        """
+
+        if self.site_hashing['enabled'] == 'always' and site != 'default':
+            return None
+        config = self._get_site(site)
+        if config is None:
+            if self.site_hashing['enabled']:
+                return None
+            config = self.defaults
+        return config
+
+    def generate_for_site(self, username, password, site, override=(), with_stats=False,
+                          chunked=None):
+        """Generate the password for a site.
+
+        If ``with_stats`` is true, a tuple of the password and the stats of
+        the generator is returned instead; see ``generate_with_stats``.
+        ``chunked`` is passed on to the generator.
+        """
+
         config = self.get_site(site, password)
         if override:
             config.update(override)
@@ -99,7 +127,10 @@ class ConfigBase(object):
                 if v is None:
                     del config[k]
             self.fill_out_config(config)
-        return generator.generate(username, password, site, config)
+        if with_stats:
+            return generator.generate_with_stats(
+                username, password, site, config, chunked=chunked)
+        return generator.generate(username, password, site, config, chunked=chunked)
 
 
 class YAMLConfig(ConfigBase):
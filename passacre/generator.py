@@ -1,18 +1,24 @@
 # Copyright (c) Aaron Gallagher <_@habnab.it>
 # See COPYING for details.
 
+import contextlib
+import hashlib
+import hmac
+import multiprocessing
+import os
 import string
+import struct
+import threading
 
-from passacre._libpassacre_impl import Generator
-from passacre.compat import python_3_encode, hexlify
+from passacre.compat import OrderedDict, monotonic, python_3_encode, hexlify
 from passacre.multibase import MultiBase
-from passacre import features, signing_uuid
+from passacre import _shake, features, signing_uuid
 
 
 _site_multibase = MultiBase([string.ascii_letters + string.digits + '-_'] * 48)
 
 
-def generate(username, password, site, options):
+def generate(username, password, site, options, chunked=None):
     """Generate a password with the passacre method.
 
     1. A string is generated from ``username:`` (if a username is specified),
@@ -24,37 +30,418 @@ def generate(username, password, site, options):
        ``multibase`` can encode.
     4. That integer is encoded with
        ``multibase`` and the encoded value is returned.
+
+    If ``chunked`` is a ``passacre.util.ChunkedAbsorption``, the null rounds
+    are absorbed with it, which generates the same password.
+    """
+
+    args = _generator_args(username, password, site, options)
+    if chunked is not None or state_cache is not None or args[0] in _shake.METHODS:
+        g = _absorbed_generator(*args, chunked=chunked)
+        return g.squeeze_for_multibase(options['multibase'])
+    from passacre._libpassacre_impl import generate_for_multibase
+    return generate_for_multibase(*args + (options['multibase'],))
+
+
+def generate_with_stats(username, password, site, options, chunked=None):
+    """Like ``generate``, but return a tuple of the password and the ``stats``
+    of the generator which generated it.
+    """
+
+    g = build_generator(username, password, site, options, chunked=chunked)
+    return g.squeeze_for_multibase(options['multibase']), g.stats
+
+
+def generate_increments(username, password, site, options, count):
+    """Generate the passwords for a site's next ``count`` increments.
+
+    The first password is the same as what ``generate`` would return, and each
+    password after that is generated with one more iteration, as if the site's
+    ``increment`` was bumped. The null rounds are only absorbed once; the
+    generator is snapshotted before squeezing each password and restored
+    before absorbing the next iteration.
     """
 
     multibase = options['multibase']
-    generator = build_generator(username, password, site, options)
-    return generator.squeeze_for_multibase(multibase)
+    ret = []
+    with _pooled_generator(username, password, site, options) as generator:
+        for _ in range(count):
+            snapshot = generator.snapshot()
+            ret.append(generator.squeeze_for_multibase(multibase))
+            generator.restore(snapshot)
+            generator.absorb_null_rounds(1)
+    return ret
+
+
+class YubiKeyResponses(object):
+    """YubiKey challenge-responses for each slot, kept for ``ttl`` seconds
+    after they're fetched (or for as long as this object is used, if ``ttl``
+    is None).
+
+    The challenge is always the same, so this only needs to use the YubiKey
+    once per slot. The handle from opening the YubiKey is also kept and
+    reused, until it fails or ``clear`` is called.
+    """
+
+    def __init__(self, ttl=None, clock=monotonic, YubiKey=None):
+        self.ttl = ttl
+        self._clock = clock
+        self._YubiKey = YubiKey
+        self._yk = None
+        self._responses = {}
+        self._lock = threading.Lock()
+
+    def _open(self):
+        if self._yk is None:
+            YubiKey = self._YubiKey
+            if YubiKey is None:
+                from ykpers import YubiKey
+            self._yk = YubiKey.open_first_key()
+        return self._yk
+
+    def response(self, slot):
+        "Return the response to passacre's challenge from ``slot``."
+        with self._lock:
+            entry = self._responses.get(slot)
+            if entry is not None and (entry[0] is None or entry[0] > self._clock()):
+                return entry[1]
+            yk = self._open()
+            try:
+                response = yk.hmac_challenge_response(signing_uuid.bytes, slot=slot)
+            except Exception:
+                # the YubiKey might have been removed; open it again next time
+                self._yk = None
+                raise
+            expires = None if self.ttl is None else self._clock() + self.ttl
+            self._responses[slot] = expires, response
+            return response
+
+    def clear(self):
+        "Forget every response, and close the YubiKey handle."
+        with self._lock:
+            self._responses.clear()
+            self._yk = None
+
+
+yubikey_session = None
+
+
+def enable_yubikey_session(ttl=300):
+    """Start keeping YubiKey responses and the YubiKey handle for this
+    process, replacing any existing session, and return the new
+    ``YubiKeyResponses``.
+
+    Until ``disable_yubikey_session`` is called, each slot's response is
+    reused for ``ttl`` seconds by everything which extends passwords with a
+    YubiKey response.
+    """
+
+    global yubikey_session
+    disable_yubikey_session()
+    yubikey_session = YubiKeyResponses(ttl)
+    return yubikey_session
+
+
+def disable_yubikey_session():
+    "Stop keeping YubiKey responses, and forget the ones being kept."
+    global yubikey_session
+    session, yubikey_session = yubikey_session, None
+    if session is not None:
+        session.clear()
 
 
 @features.yubikey.check
-def extend_password_with_yubikey(password, options, YubiKey=None):
-    if YubiKey is None:
-        from ykpers import YubiKey
-    yk = YubiKey.open_first_key()
-    response = yk.hmac_challenge_response(
-        signing_uuid.bytes, slot=options['yubikey-slot'])
+def extend_password_with_yubikey(password, options, YubiKey=None, responses=None):
+    """Prepend the hex of the YubiKey's response to passacre's challenge to
+    ``password``.
+
+    The response comes from ``responses`` (a ``YubiKeyResponses``) if given,
+    then from the process's YubiKey session if one is enabled, and otherwise
+    from opening the YubiKey just for this password.
+    """
+
+    if responses is None:
+        responses = yubikey_session
+    if responses is None:
+        responses = YubiKeyResponses(YubiKey=YubiKey)
+    response = responses.response(options['yubikey-slot'])
     return hexlify(response) + ':' + password
 
 
-def build_generator(username, password, site, options):
+def generate_batch(jobs, chunked=None):
+    """Generate passwords for many sites at once.
+
+    Each job must be a tuple of ``(username, password, site, options)``, as
+    would be passed to ``generate``. Returns a list of the generated passwords,
+    which are the same as what ``generate`` would return for each job, but with
+    the hashing for every job done in a single call into libpassacre, and the
+    YubiKey (if any jobs use one) used only once per slot.
+
+    If ``chunked`` is a ``passacre.util.ChunkedAbsorption``, each job is
+    instead absorbed in chunks with it, one job after another, and its
+    progress counts the null rounds of every job together.
+    """
+
+    prepared = _prepare_jobs(jobs)
+    if chunked is None:
+        return _generate_prepared(prepared)
+    total = sum(args[-1] for args, _ in prepared)
+    ret = []
+    offset = 0
+    for args, multibase in prepared:
+        g = _absorbed_generator(
+            *args, chunked=chunked, progress_offset=offset, progress_total=total)
+        offset += args[-1]
+        ret.append(g.squeeze_for_multibase(multibase))
+    return ret
+
+
+def generate_many(jobs, workers=None):
+    """Generate passwords for many sites across a pool of threads.
+
+    ``jobs`` is the same as for ``generate_batch``, and the same list of
+    passwords is returned. The jobs are split into chunks which are each
+    generated with ``generate_batch`` on one of ``workers`` threads (by
+    default, one per CPU). libpassacre doesn't hold the GIL while hashing, so
+    the hashing itself runs in parallel.
+
+    Each chunk gets its own generators, so no generator state is shared
+    between threads. YubiKey challenge-responses are done up front, in the
+    calling thread, and as with ``generate_batch``, only once per slot.
+    """
+
+    from multiprocessing.pool import ThreadPool
+    prepared = _prepare_jobs(jobs)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    chunk_size = max(1, len(prepared) // (workers * 4))
+    chunks = [prepared[i:i + chunk_size]
+              for i in range(0, len(prepared), chunk_size)]
+    pool = ThreadPool(workers)
+    try:
+        results = pool.map(_generate_prepared, chunks)
+    finally:
+        pool.close()
+        pool.join()
+    return [password for chunk in results for password in chunk]
+
+
+def _prepare_jobs(jobs):
+    # every job needing the same YubiKey slot gets the same response, so the
+    # YubiKey is only used once per slot for the whole batch
+    responses = yubikey_session
+    if responses is None:
+        responses = YubiKeyResponses()
+    try:
+        return [
+            (_generator_args(username, password, site, options, responses),
+             options['multibase'])
+            for username, password, site, options in jobs]
+    finally:
+        if responses is not yubikey_session:
+            responses.clear()
+
+
+def _generate_prepared(prepared):
+    ret = [None] * len(prepared)
+    native = []
+    for e, (args, multibase) in enumerate(prepared):
+        # a batch can't be cached, since it squeezes as soon as it's absorbed
+        if state_cache is not None or args[0] in _shake.METHODS:
+            ret[e] = _absorbed_generator(*args).squeeze_for_multibase(multibase)
+        else:
+            native.append((e, args, multibase))
+    if not native:
+        return ret
+    from passacre._libpassacre_impl import Generator
+    batch = Generator.batch(
+        args + (multibase.compile().required_bytes,)
+        for _, args, multibase in native)
+    for (generator, squeezed), (e, _, multibase) in zip(batch, native):
+        ret[e] = generator.encode_for_multibase(multibase, squeezed)
+    return ret
+
+
+def _generator_args(username, password, site, options, yubikey_responses=None):
     if options.get('yubikey-slot'):
-        password = extend_password_with_yubikey(password, options)
-    method = options['method']
-    iterations = options['iterations']
+        password = extend_password_with_yubikey(
+            password, options, responses=yubikey_responses)
     if username is not None:
         username = python_3_encode(username)
-    g = Generator(method)
-    g.absorb_username_password_site(
-        username, python_3_encode(password), site.encode('idna'))
-    g.absorb_null_rounds(iterations)
+    return (options['method'], username, python_3_encode(password),
+            site.encode('idna'), options['iterations'])
+
+
+def _new_generator(method):
+    if method in _shake.METHODS:
+        return _shake.METHODS[method](method)
+    from passacre._libpassacre_impl import Generator
+    return Generator(method)
+
+
+def _absorbed_generator(method, username, password, site, iterations, g=None, chunked=None,
+                        progress_offset=0, progress_total=None):
+    # progress_offset and progress_total are passed on to chunked.absorb, for
+    # when these null rounds are one part of a larger absorption
+    args = method, username, password, site, iterations
+    cache = None if method in _shake.METHODS else state_cache
+    if cache is not None:
+        cached = cache.restore(args, g)
+        if cached is not None:
+            return cached
+    if g is None:
+        g = _new_generator(method)
+    g.absorb_username_password_site(username, password, site)
+    if chunked is None:
+        g.absorb_null_rounds(iterations)
+    else:
+        chunked.absorb(g.absorb_null_rounds, iterations, progress_offset, progress_total)
+    if cache is not None:
+        cache.put(args, g)
     return g
 
 
+def build_generator(username, password, site, options, chunked=None):
+    return _absorbed_generator(
+        *_generator_args(username, password, site, options), chunked=chunked)
+
+
+@contextlib.contextmanager
+def _pooled_generator(username, password, site, options):
+    """Like ``build_generator``, but with a generator from the thread's pool,
+    which is released when the block exits. Generators for methods implemented
+    in python aren't pooled.
+    """
+
+    args = _generator_args(username, password, site, options)
+    if args[0] in _shake.METHODS:
+        yield _absorbed_generator(*args)
+        return
+    from passacre._libpassacre_impl import generator_pool
+    with generator_pool.generator(args[0]) as g:
+        yield _absorbed_generator(*args, g=g)
+
+
 def hash_site(password, site, options):
-    generator = build_generator(None, password, site, options)
-    return generator.squeeze_for_multibase(_site_multibase)
+    with _pooled_generator(None, password, site, options) as generator:
+        return generator.squeeze_for_multibase(_site_multibase)
+
+
+class StateCache(object):
+    """A cache of generator states after absorbing a username, password, site,
+    and null rounds, so that generating again for the same site skips the null
+    rounds.
+
+    Entries are keyed by an HMAC of the method, iterations, username,
+    password, and site, under a key generated for each cache, so the secrets
+    themselves are never kept as keys. At most ``size`` states are kept, with
+    the least recently used evicted first, and each one is evicted ``ttl``
+    seconds after it was cached no matter how recently it was used. Evicted
+    states are zeroed.
+
+    Only libpassacre's generators are cached, as the state of a generator
+    implemented in python can't be zeroed.
+    """
+
+    def __init__(self, size=16, ttl=300, clock=monotonic):
+        self.size = size
+        self.ttl = ttl
+        self._clock = clock
+        self._hmac_key = os.urandom(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            self._expire()
+            return len(self._entries)
+
+    def _key(self, method, username, password, site, iterations):
+        mac = hmac.new(self._hmac_key, digestmod=hashlib.sha256)
+        # a username of None is distinguished from an empty username
+        username = b'' if username is None else b'u' + username
+        for field in [method.encode('ascii'), username, password, site,
+                      str(iterations).encode('ascii')]:
+            mac.update(struct.pack('>Q', len(field)))
+            mac.update(field)
+        return mac.digest()
+
+    def _evict(self, key):
+        _, generator = self._entries.pop(key)
+        generator.reset()
+
+    def _expire(self):
+        now = self._clock()
+        for key, (expires, _) in list(self._entries.items()):
+            if expires <= now:
+                self._evict(key)
+
+    def restore(self, args, generator=None):
+        """Return a generator with the cached state for ``args``, or None if
+        there isn't one.
+
+        ``args`` is a tuple of ``(method, username, password, site,
+        iterations)``. If ``generator`` is given, the state is copied into it;
+        otherwise, a new generator is returned.
+        """
+
+        key = self._key(*args)
+        with self._lock:
+            self._expire()
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            self._entries[key] = entry
+            cached = entry[1]
+            if generator is None:
+                return cached.copy()
+            generator.copy_from(cached)
+            return generator
+
+    def put(self, args, generator):
+        """Cache a copy of the state of ``generator``, which must have absorbed
+        ``args`` as passed to ``restore`` and not have been squeezed.
+        """
+
+        key = self._key(*args)
+        cached = generator.copy()
+        with self._lock:
+            self._expire()
+            if key in self._entries:
+                self._evict(key)
+            self._entries[key] = self._clock() + self.ttl, cached
+            while len(self._entries) > self.size:
+                self._evict(next(iter(self._entries)))
+
+    def clear(self):
+        "Evict every cached state."
+        with self._lock:
+            for key in list(self._entries):
+                self._evict(key)
+
+
+state_cache = None
+
+
+def enable_state_cache(size=16, ttl=300):
+    """Start caching generator states for this process, replacing any existing
+    cache, and return the new ``StateCache``.
+
+    Until ``disable_state_cache`` is called, ``generate``, ``build_generator``,
+    ``hash_site``, and the other functions in this module restore generators
+    from the cache instead of absorbing null rounds again. A restored
+    generator's ``stats`` are those of the generator that was cached.
+    """
+
+    global state_cache
+    disable_state_cache()
+    state_cache = StateCache(size, ttl)
+    return state_cache
+
+
+def disable_state_cache():
+    "Stop caching generator states, evicting everything that was cached."
+    global state_cache
+    cache, state_cache = state_cache, None
+    if cache is not None:
+        cache.clear()
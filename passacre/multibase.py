@@ -3,6 +3,19 @@
 
 from __future__ import unicode_literals
 
+import math
+import threading
+
+from passacre.compat import OrderedDict
+from passacre import features
+
+
+# runs of more digits than this are converted by repeatedly splitting them in
+# half, rather than dividing out one digit at a time, which takes time
+# quadratic in the length of the run
+_SPLIT_DIGITS = 64
+
+
 class MultiBase(object):
     """Represents a base where not every digit has the same possible values.
 
@@ -12,13 +25,50 @@ class MultiBase(object):
     possible value for the corresponding digit, in order from the lowest to
     highest value for that digit.
 
+    A multibase can also be made from runs of digits with ``of_runs``, without
+    listing every digit. Either way, the ``runs`` attribute is a sequence of
+    ``(unit, count)`` pairs, where ``unit`` is either a base, used for
+    ``count`` consecutive digits, or another ``MultiBase``, whose digits are
+    repeated ``count`` times.
+
     The ``max_encodable_value`` attribute is the largest integer that can be
     encoded with this base.
     """
 
+    _compiled = None
+
     def __init__(self, bases):
         self.bases = bases
 
+    @classmethod
+    def of_runs(cls, runs):
+        "Make a multibase from a sequence of ``(unit, count)`` pairs."
+        self = cls.__new__(cls)
+        self.runs = runs
+        return self
+
+    @property
+    def bases(self):
+        "The base of each digit, expanded from ``runs``."
+        return list(_expand_runs(self.runs))
+
+    @bases.setter
+    def bases(self, bases):
+        self.runs = _runs_of_bases(bases)
+
+    def compile(self):
+        """Return the ``CompiledMultiBase`` for this base.
+
+        The result is cached for as long as the ``runs`` (or ``bases``)
+        attribute isn't replaced. The bases themselves must not be modified
+        after compiling.
+        """
+
+        compiled = self._compiled
+        if compiled is None or compiled.runs is not self.runs:
+            compiled = self._compiled = CompiledMultiBase(self.runs)
+        return compiled
+
     def encode(self, n):
         """Encode an integer to a string, using this base.
 
@@ -27,16 +77,20 @@ class MultiBase(object):
         integer.
         """
 
-        if n > self.max_encodable_value:
-            raise ValueError(
-                '%d is greater than the largest encodable integer (%d)' % (
-                    n, self.max_encodable_value))
-        ret = []
-        for base in reversed(self.bases):
-            n, d = divmod(n, len(base))
-            ret.append(base[d])
-        ret.reverse()
-        return ''.join(ret)
+        return self.compile().encode(n)
+
+    def encode_many(self, values):
+        """Encode every integer in a numpy array, using this base.
+
+        ``values`` is either a one-dimensional array of integers no larger
+        than 2 ** 64 - 1, or a two-dimensional array where each row is one
+        integer's 32-bit limbs, most significant first. Returns a list of the
+        encoded strings, or raises ``ValueError`` if any integer is greater
+        than the largest encodable integer. This requires the ``numpy``
+        feature.
+        """
+
+        return self.compile().encode_many(values)
 
     def decode(self, x):
         """Decode a string to an integer, using this base.
@@ -47,18 +101,351 @@ class MultiBase(object):
         in ``x`` aren't valid digits for their position.
         """
 
-        if len(x) != len(self.bases):
+        return self.compile().decode(x)
+
+    @property
+    def max_encodable_value(self):
+        return self.compile().max_encodable_value
+
+
+def _runs_of_bases(bases):
+    runs = []
+    for base in bases:
+        if runs and runs[-1][0] is base:
+            runs[-1] = base, runs[-1][1] + 1
+        else:
+            runs.append((base, 1))
+    return runs
+
+
+def _expand_runs(runs):
+    for unit, count in runs:
+        if isinstance(unit, (MultiBase, CompiledMultiBase)):
+            for _ in range(count):
+                for base in _expand_runs(unit.runs):
+                    yield base
+        else:
+            for _ in range(count):
+                yield unit
+
+
+class _Encodings(object):
+    "Index a multibase's encodings like a base's symbols."
+
+    __slots__ = ('_mb',)
+
+    def __init__(self, mb):
+        self._mb = mb
+
+    def __getitem__(self, n):
+        return self._mb.encode(n)
+
+
+def _next_digit(remaining, radix):
+    # divide every value by radix in place and return the remainders
+    import numpy as np
+    radix = np.uint64(radix)
+    d = remaining % radix
+    remaining //= radix
+    return d
+
+
+def _next_limbs_digit(remaining, radix):
+    # the same, for rows of 32-bit limbs, by long division one limb at a
+    # time. The remainder is always less than radix, so shifting it into the
+    # next limb fits in 64 bits.
+    import numpy as np
+    if radix > 0xffffffff:
+        raise ValueError('radices must fit in 32 bits to divide 32-bit limbs')
+    radix = np.uint64(radix)
+    d = np.zeros(len(remaining), dtype=np.uint64)
+    for limb in range(remaining.shape[1]):
+        d = (d << np.uint64(32)) | remaining[:, limb]
+        remaining[:, limb] = d // radix
+        d %= radix
+    return d
+
+
+class _BaseCache(object):
+    """Values worked out from the most recently used bases.
+
+    Bases are strings or lists of words, neither of which can be weakly
+    referenced, so entries are keyed by the base's id and hold onto the base,
+    so that the id can't be reused while the entry is kept.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, base, compute):
+        "Return ``compute(base)``, computing it only if it isn't kept."
+        key = id(base)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] is base:
+                self._entries[key] = entry
+                return entry[1]
+        value = compute(base)
+        with self._lock:
+            self._entries[key] = base, value
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _symbol_values_of(base):
+    values = {}
+    # reversed, so that the first of any repeated symbols wins, as with
+    # base.index
+    for e in range(len(base) - 1, -1, -1):
+        values[base[e]] = e
+    return values
+
+
+# dicts from each base's symbols to their values, shared by every multibase
+# using the same base object, so a large words list is only gone through on
+# the first decode with it
+_symbol_values = _BaseCache(64)
+
+
+class CompiledMultiBase(object):
+    """A ``MultiBase`` with everything about its bases worked out in advance.
+
+    Besides ``runs`` and ``max_encodable_value``, it has the number of digits
+    as ``n_digits``, the ``required_bytes`` and ``required_bits`` to hold any
+    encodable value, and, if every radix is a power of two, the ``bits`` an
+    encoded value takes (every value of that many bits can be encoded, and
+    each digit is just some of those bits); otherwise ``bits`` is None.
+    Nothing here is expanded per digit, so a compiled multibase is about as
+    large as the runs it was made from, and compiling one doesn't go through
+    the symbols of its bases.
+    """
+
+    __slots__ = (
+        'runs', 'n_digits', 'max_encodable_value', 'required_bytes',
+        'required_bits', 'bits', '_units', '_powers', '__weakref__')
+
+    def __init__(self, runs):
+        self.runs = runs
+        units = []
+        n_digits = 0
+        max_value = 1
+        bits = 0
+        for unit, count in runs:
+            if not count:
+                continue
+            if isinstance(unit, (MultiBase, CompiledMultiBase)):
+                unit = unit.compile()
+                radix = unit.max_encodable_value + 1
+                n_digits += unit.n_digits * count
+                nested = True
+            else:
+                radix = len(unit)
+                n_digits += count
+                nested = False
+            units.append((unit, count, radix, nested))
+            max_value *= radix ** count
+            if bits is not None and radix and not radix & (radix - 1):
+                bits += (radix.bit_length() - 1) * count
+            else:
+                bits = None
+        self._units = tuple(units)
+        self.n_digits = n_digits
+        self.max_encodable_value = max_value - 1
+        self.required_bytes = multibase_required_bytes(self)
+        self.required_bits = multibase_required_bits(self)
+        self.bits = bits
+        self._powers = {}
+
+    def compile(self):
+        return self
+
+    def _power(self, radix, exponent):
+        # the same few powers are used every time a run is encoded
+        power = self._powers.get((radix, exponent))
+        if power is None:
+            power = self._powers[radix, exponent] = radix ** exponent
+        return power
+
+    def _digits(self, n, radix, count, symbols, out):
+        """Append the symbols for the ``count`` lowest digits of ``n`` in base
+        ``radix`` to ``out``, least significant first, and return what's left
+        of ``n``. ``symbols`` is indexed with each digit's value.
+        """
+
+        if radix == 1:
+            # every digit of a one-symbol base is 0, and takes nothing from n
+            out.extend([symbols[0]] * count)
+            return n
+        if not radix & (radix - 1):
+            return self._shifted_digits(n, radix.bit_length() - 1, count, symbols, out)
+        if count > _SPLIT_DIGITS:
+            n, low = divmod(n, self._power(radix, count))
+            self._split_digits(low, radix, count, symbols, out)
+            return n
+        for _ in range(count):
+            n, d = divmod(n, radix)
+            out.append(symbols[d])
+        return n
+
+    def _split_digits(self, n, radix, count, symbols, out):
+        # n is less than radix ** count here, so both halves are about as
+        # large as each other, and the divisions are of similarly-sized
+        # numbers instead of a large number by a small one
+        if count <= _SPLIT_DIGITS:
+            for _ in range(count):
+                n, d = divmod(n, radix)
+                out.append(symbols[d])
+            return
+        half = count // 2
+        high, low = divmod(n, self._power(radix, half))
+        self._split_digits(low, radix, half, symbols, out)
+        self._split_digits(high, radix, count - half, symbols, out)
+
+    def _shifted_digits(self, n, bits, count, symbols, out):
+        # the same as _digits, for radices which are powers of two, where
+        # each digit is just the next bits of n
+        if count > _SPLIT_DIGITS:
+            low = n & ((1 << bits * count) - 1)
+            self._split_shifted_digits(low, bits, count, symbols, out)
+            return n >> bits * count
+        mask = (1 << bits) - 1
+        for _ in range(count):
+            out.append(symbols[n & mask])
+            n >>= bits
+        return n
+
+    def _split_shifted_digits(self, n, bits, count, symbols, out):
+        if count <= _SPLIT_DIGITS:
+            self._shifted_digits(n, bits, count, symbols, out)
+            return
+        half = count // 2
+        self._split_shifted_digits(n & ((1 << bits * half) - 1), bits, half, symbols, out)
+        self._split_shifted_digits(n >> bits * half, bits, count - half, symbols, out)
+
+    def encode_many(self, values):
+        "Encode an array of integers, as ``MultiBase.encode_many`` does."
+        features.numpy.check()
+        import numpy as np
+
+        values = np.asarray(values)
+        if values.dtype.kind not in 'iu':
+            raise TypeError('only arrays of integers can be encoded')
+        if values.ndim not in (1, 2):
+            raise ValueError('values must be a one- or two-dimensional array')
+        if values.size and values.min() < 0:
+            raise ValueError("negative integers can't be encoded")
+        if values.ndim == 1:
+            remaining = values.astype(np.uint64)
+            next_digit = _next_digit
+        else:
+            if values.size and values.max() > 0xffffffff:
+                raise ValueError('limbs must be 32-bit')
+            remaining = values.astype(np.uint64)
+            next_digit = _next_limbs_digit
+
+        runs = list(self.flat_runs())
+        single_characters = all(
+            len(symbol) == 1 and symbol != '\0' for base, _ in runs for symbol in base)
+        if single_characters:
+            # the encodings can be built as arrays of code points, which numpy
+            # can view as strings without any python-level loop at all
+            output = np.zeros((len(remaining), self.n_digits), dtype=np.uint32)
+        else:
+            output = np.empty((len(remaining), self.n_digits), dtype=object)
+        column = self.n_digits
+        for base, count in reversed(runs):
+            if single_characters:
+                symbols = np.array([ord(symbol) for symbol in base], dtype=np.uint32)
+            else:
+                symbols = np.empty(len(base), dtype=object)
+                symbols[:] = list(base)
+            for _ in range(count):
+                column -= 1
+                output[:, column] = np.take(symbols, next_digit(remaining, len(base)))
+        if remaining.any():
+            raise ValueError(
+                'some integers are greater than the largest encodable integer (%d)' % (
+                    self.max_encodable_value,))
+        if single_characters:
+            if not self.n_digits:
+                return [''] * len(output)
+            return output.view('U%d' % (self.n_digits,)).ravel().tolist()
+        return [''.join(row) for row in output.tolist()]
+
+    def flat_runs(self):
+        """Yield ``(base, count)`` pairs covering every digit, with any
+        repeated multibases in the runs repeated out.
+        """
+
+        for unit, count, _, nested in self._units:
+            if not nested:
+                yield unit, count
+                continue
+            for _ in range(count):
+                for run in unit.flat_runs():
+                    yield run
+
+    def encode(self, n):
+        "Encode an integer to a string, as ``MultiBase.encode`` does."
+        if n > self.max_encodable_value:
+            raise ValueError(
+                '%d is greater than the largest encodable integer (%d)' % (
+                    n, self.max_encodable_value))
+        ret = []
+        for unit, count, radix, nested in reversed(self._units):
+            symbols = _Encodings(unit) if nested else unit
+            n = self._digits(n, radix, count, symbols, ret)
+        ret.reverse()
+        return ''.join(ret)
+
+    def decode(self, x):
+        "Decode a string to an integer, as ``MultiBase.decode`` does."
+        if len(x) != self.n_digits:
             raise ValueError(
                 "the length of %r (%d) doesn't match the number of bases (%d)" % (
-                    x, len(x), len(self.bases)))
+                    x, len(x), self.n_digits))
         ret = 0
-        for base, d in zip(self.bases, x):
-            ret = (ret * len(base)) + base.index(d)
+        position = 0
+        for unit, count, radix, nested in self._units:
+            if not nested:
+                values = _symbol_values.get(unit, _symbol_values_of)
+            for _ in range(count):
+                if nested:
+                    value = unit.decode(x[position:position + unit.n_digits])
+                    position += unit.n_digits
+                else:
+                    d = x[position]
+                    position += 1
+                    try:
+                        value = values[d]
+                    except (KeyError, TypeError):
+                        raise ValueError('%r is not a valid digit' % (d,))
+                ret = (ret * radix) + value
         return ret
 
-    @property
-    def max_encodable_value(self):
-        ret = 1
-        for base in self.bases:
-            ret *= len(base)
-        return ret - 1
+
+def multibase_required_bytes(mb):
+    "Return how many bytes it takes to hold any value ``mb`` can encode."
+    return int(math.ceil(math.log(mb.max_encodable_value + 1, 256)))
+
+
+def multibase_required_bits(mb):
+    """Return how many bits it takes to hold any value ``mb`` can encode.
+
+    This is never more than ``multibase_required_bytes`` bytes' worth of bits.
+    """
+
+    max_value = mb.max_encodable_value
+    if not max_value:
+        return 0
+    return min(len(bin(max_value)) - 2, multibase_required_bytes(mb) * 8)
@@ -1,8 +1,11 @@
 # Copyright (c) Aaron Gallagher <_@habnab.it>
 # See COPYING for details.
 
+import json
 import string
+import threading
 
+from passacre.compat import OrderedDict
 from passacre.multibase import MultiBase
 
 
@@ -77,14 +80,27 @@ def parse_character_set(x):
     x = parse_type(x, string_types, 'a string')
     return character_classes.get(x, x)
 
+def append_run(runs, unit, count):
+    "Add a run to ``runs``, merging it into the last run if they share a unit."
+    if not count:
+        return
+    if runs and runs[-1][0] is unit:
+        runs[-1] = unit, runs[-1][1] + count
+    else:
+        runs.append((unit, count))
+
+def extend_runs(runs, more_runs):
+    for unit, count in more_runs:
+        append_run(runs, unit, count)
+
 @trace_parse('character sets')
 def parse_character_sets(x):
     if x == 'word':
-        return [_word]
+        return [(_word, 1)]
     elif isinstance(x, list):
-        return [''.join(parse_character_set(y, _index=e) for e, y in enumerate(x))]
+        return [(''.join(parse_character_set(y, _index=e) for e, y in enumerate(x)), 1)]
     else:
-        return [parse_character_set(x)]
+        return [(parse_character_set(x), 1)]
 
 @trace_parse('a count and items array')
 def parse_counted_item(x):
@@ -96,14 +112,26 @@ def parse_counted_item(x):
         delimiter = parse_type(x[0], string_types, 'a string', _index=0)
         count = parse_type(x[1], int, 'a number', _index=1)
         start = 2
-    each_item = [z
-                 for e, y in enumerate(x[start:], start=start)
-                 for z in parse_item(y, _index=e)]
+    each_item = []
+    for e, y in enumerate(x[start:], start=start):
+        extend_runs(each_item, parse_item(y, _index=e))
+    # the items are repeated as runs rather than listed out, so that the
+    # schema's size doesn't depend on the count
     items = []
-    for e in range(count):
-        if e != 0 and delimiter:
-            items.append([delimiter])
-        items.extend(each_item)
+    if count <= 0:
+        return items
+    if delimiter:
+        extend_runs(items, each_item)
+        repeated = [([delimiter], 1)]
+        extend_runs(repeated, each_item)
+        count -= 1
+    else:
+        repeated = each_item
+    if len(repeated) == 1:
+        unit, unit_count = repeated[0]
+        append_run(items, unit, unit_count * count)
+    else:
+        append_run(items, MultiBase.of_runs(repeated), count)
     return items
 
 @trace_parse('an item')
@@ -117,14 +145,69 @@ def parse_item(x):
 
 @trace_parse('the items')
 def parse_items(x):
-    items = [parse_item(y, _index=e) for e, y in enumerate(parse_type(x, list, 'an array'))]
-    return [y for subitems in items for y in subitems]
+    runs = []
+    for e, y in enumerate(parse_type(x, list, 'an array')):
+        extend_runs(runs, parse_item(y, _index=e))
+    return runs
+
+
+def _substitute_words(runs, words):
+    ret = []
+    for unit, count in runs:
+        if unit is _word:
+            if words is None:
+                raise ValueError("can't use a schema with 'word' without a words file")
+            unit = words
+        elif isinstance(unit, MultiBase):
+            unit = MultiBase.of_runs(_substitute_words(unit.runs, words))
+        append_run(ret, unit, count)
+    return ret
+
+
+def _multibase_of_schema(schema, words):
+    return MultiBase.of_runs(_substitute_words(parse_items(schema), words))
+
+
+# how many distinct schemata multibase_of_schema keeps the multibases of
+MULTIBASE_CACHE_SIZE = 256
+_multibase_cache = OrderedDict()
+_multibase_cache_lock = threading.Lock()
 
 
 def multibase_of_schema(schema, words):
-    "Convert a password schema from decoded YAML to a ``MultiBase``."
-    items = parse_items(schema)
-    if words is None and _word in items:
-        raise ValueError("can't use a schema with 'word' without a words file")
-    items = [words if item is _word else item for item in items]
-    return MultiBase(items)
+    """Convert a password schema from decoded YAML to a ``MultiBase``.
+
+    Counted items become runs of the multibase instead of being repeated out,
+    so the multibase is about as large as the schema, however many digits the
+    schema describes.
+
+    The multibases of the most recently used schemata are kept, keyed by the
+    schema's canonical JSON and which words list is used, so every site with
+    the same schema shares one multibase (and its compiled form). The result
+    mustn't be modified.
+    """
+
+    try:
+        key = json.dumps(schema, sort_keys=True, separators=(',', ':')), id(words)
+    except (TypeError, ValueError):
+        # not something a schema can be; let parsing say why
+        return _multibase_of_schema(schema, words)
+    with _multibase_cache_lock:
+        entry = _multibase_cache.pop(key, None)
+        # each entry holds onto its words list, so the id in its key can't be
+        # reused by another list while it's kept; this just makes sure
+        if entry is not None and entry[0] is words:
+            _multibase_cache[key] = entry
+            return entry[1]
+    mb = _multibase_of_schema(schema, words)
+    with _multibase_cache_lock:
+        _multibase_cache[key] = words, mb
+        while len(_multibase_cache) > MULTIBASE_CACHE_SIZE:
+            _multibase_cache.popitem(last=False)
+    return mb
+
+
+def clear_multibase_cache():
+    "Forget every multibase kept by ``multibase_of_schema``."
+    with _multibase_cache_lock:
+        _multibase_cache.clear()
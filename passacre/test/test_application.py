@@ -4,9 +4,11 @@
 import pytest
 import py.path
 import sys
+import threading
 import traceback
 
-from passacre import application, features
+from passacre import _libpassacre_impl, application, features, generator
+from passacre.test.test_generator import FakeYubiKey, skip_without_yubikey
 from passacre.test.util import excinfo_arg_0
 
 
@@ -124,6 +126,16 @@ class FakeAtexit(object):
             f(*a, **kw)
 
 
+class PrefetchedYubiKey(FakeYubiKey):
+    def __init__(self):
+        self.fetched = threading.Event()
+
+    def hmac_challenge_response(self, challenge, slot):
+        response = FakeYubiKey.hmac_challenge_response(self, challenge, slot)
+        self.fetched.set()
+        return response
+
+
 class ApplicationTestCaseMixin(object):
     config_dir = None
     hashed_site = None
@@ -164,6 +176,31 @@ class ApplicationTestCaseMixin(object):
         assert self.confirmed_password
         assert out == self.hashed_password + '\n'
 
+    @skip_without_yubikey
+    def test_generate_prefetches_yubikey(self, monkeypatch):
+        yk = PrefetchedYubiKey()
+        YubiKeyResponses = generator.YubiKeyResponses
+        monkeypatch.setattr(
+            generator, 'YubiKeyResponses', lambda ttl=None: YubiKeyResponses(ttl, YubiKey=yk))
+        fetched_during_prompt = []
+        def prompt_password(confirm):
+            fetched_during_prompt.append(yk.fetched.wait(5))
+            return self.password
+        self.app._prompt_password = prompt_password
+        self.app.main(['generate', '-o', 'yubikey-slot: 1', 'example.com'])
+        assert fetched_during_prompt == [True]
+        assert (yk.opened, yk.challenged, yk.slot) == (1, 1, 1)
+        assert generator.yubikey_session is None
+
+    def test_generate_stats(self):
+        self.app.main(['generate', '--stats', 'example.com'])
+        out, err = self.capsys.readouterr()
+        assert out == self.hashed_password + '\n'
+        stats = dict(line.rsplit(': ', 1) for line in err.splitlines())
+        assert sorted(stats) == sorted(name.replace('_', ' ') for name in _libpassacre_impl.STATS)
+        assert int(stats['null rounds']) > 0
+        assert int(stats['bytes squeezed']) > 0
+
     def test_generate_copying(self):
         self.app.xerox = FakeXerox()
         err = read_err(self.capsys, self.app, 'generate', 'example.com', '-C')
@@ -656,6 +693,46 @@ def test_always_confirm_site_config(always_confirm_app):
     assert app._confirmed_password
 
 
+def prefetch_yubikey_for(app, monkeypatch, site, timeout=5):
+    """Generate the password for a site with a fake YubiKey, returning the
+    YubiKey and whether it had been challenged within ``timeout`` seconds of
+    the password being prompted for.
+    """
+
+    yk = PrefetchedYubiKey()
+    YubiKeyResponses = generator.YubiKeyResponses
+    monkeypatch.setattr(
+        generator, 'YubiKeyResponses',
+        lambda ttl=None, YubiKey=None: YubiKeyResponses(ttl, YubiKey=yk))
+    fetched_during_prompt = []
+    def prompt_password(confirm):
+        fetched_during_prompt.append(yk.fetched.wait(timeout))
+        return 'passacre'
+    app._prompt_password = prompt_password
+    app.main(['generate', site])
+    return yk, fetched_during_prompt
+
+@skip_without_yubikey
+def test_generate_prefetches_site_yubikey_slot(mutable_app, monkeypatch, capsys):
+    app = mutable_app
+    app.main(['config', '-s', 'example.com', 'yubikey-slot', '2'])
+    yk, fetched_during_prompt = prefetch_yubikey_for(app, monkeypatch, 'example.com')
+    assert fetched_during_prompt == [True]
+    assert (yk.challenged, yk.slot) == (1, 2)
+
+@skip_without_yubikey
+def test_generate_skips_prefetching_hashed_site_yubikey_slot(
+        always_hash_app, monkeypatch, capsys):
+    app = always_hash_app
+    app.main(['config', '-s', 'hashed.example.com', 'yubikey-slot', '2'])
+    yk, fetched_during_prompt = prefetch_yubikey_for(
+        app, monkeypatch, 'hashed.example.com', timeout=0)
+    # which slot to use can't be known until the site's name is hashed with
+    # the password, so the challenge happens afterwards, with the right slot
+    assert fetched_during_prompt == [False]
+    assert (yk.challenged, yk.slot) == (1, 2)
+
+
 @pytest.fixture
 def nonextant_words_app(app, tmpdir):
     return copy_app('nonextant-words.sqlite', app, tmpdir)
@@ -727,3 +804,17 @@ def test_verbose_errormark(capsys, app):
     assert not out
     assert err == 'an error occurred testing this code foo eggs\n' + tb_string
     assert excinfo_arg_0(excinfo) == 8
+
+
+def test_info_keccak_implementation(capsys):
+    app = create_application()
+    out = read_out(capsys, app, 'info')
+    assert '\nkeccak implementation: %s\n' % (
+        _libpassacre_impl.keccak_implementation(),) in out
+
+
+def test_info_skein_implementation(capsys):
+    app = create_application()
+    out = read_out(capsys, app, 'info')
+    assert '\nskein implementation: %s\n' % (
+        _libpassacre_impl.skein_implementation(),) in out
@@ -127,7 +127,7 @@ _passacre_schemata () {
 
 _passacre_hash_methods () {
     local -a _passacre_hash_method_list
-    _passacre_hash_method_list=(keccak skein)
+    _passacre_hash_method_list=(keccak keccak-v2 keccak-wide shake256 skein skein-v2)
     _wanted _passacre_hash_method_list expl 'passacre hash methods' compadd -a _passacre_hash_method_list
 }
 
@@ -186,7 +186,7 @@ complete -f -c passacre -n '__fish_passacre_using_command passacre eggs eggs2 '
 complete -f -c passacre -n '__fish_passacre_using_command passacre eggs eggs2 '  -l schema -d 'schema'
 complete -f -c passacre -n '__fish_passacre_using_command passacre eggs eggs2 '  -l site -a '(__fish_passacre_sites)'
 complete -f -c passacre -n '__fish_passacre_using_command passacre eggs eggs2 '  -l site -d 'site'
-complete -f -c passacre -n '__fish_passacre_using_command passacre eggs eggs2 '  -l hash-method -a 'keccak skein'
+complete -f -c passacre -n '__fish_passacre_using_command passacre eggs eggs2 '  -l hash-method -a 'keccak keccak-v2 keccak-wide shake256 skein skein-v2'
 complete -f -c passacre -n '__fish_passacre_using_command passacre eggs eggs2 '  -l hash-method -d 'hash-method'
 complete -f -c passacre -n '__fish_passacre_using_command passacre eggs ' -s h -l help -d 'show this help message and exit'
 complete -f -c passacre -n '__fish_passacre_using_command passacre eggs' -a 'eggs1' -d 'eggs1'
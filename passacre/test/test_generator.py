@@ -1,9 +1,22 @@
 # Copyright (c) Aaron Gallagher <_@habnab.it>
 # See COPYING for details.
 
+import hashlib
+import os
+import string
+import struct
+import subprocess
+import sys
+import threading
+
 import pytest
 
-from passacre import features, generator, signing_uuid
+from passacre._libpassacre_impl import Generator, GeneratorError
+from passacre.compat import int_of_bytes, monotonic, unichr
+from passacre.multibase import (
+    MultiBase, multibase_required_bits, multibase_required_bytes)
+from passacre.util import ChunkedAbsorption, NullRoundsInterrupted
+from passacre import _libpassacre_impl, _shake, features, generator, signing_uuid
 
 
 _shush_pyflakes = [features]
@@ -16,12 +29,19 @@ def test_invalid_generator_method():
 
 
 class FakeYubiKey(object):
+    opened = challenged = 0
+    fail = False
+
     def open_first_key(self):
+        self.opened += 1
         return self
 
     def hmac_challenge_response(self, challenge, slot):
         self.challenge = challenge
         self.slot = slot
+        self.challenged += 1
+        if self.fail:
+            raise IOError('no yubikey')
         return b'spam ' * 4
 
 skip_without_yubikey = pytest.mark.skipif(
@@ -34,3 +54,873 @@ def test_extend_password_with_yubikey():
     assert password == '7370616d207370616d207370616d207370616d20:spam'
     assert yk.challenge == signing_uuid.bytes
     assert yk.slot == 1
+
+
+def test_yubikey_responses_reused():
+    yk = FakeYubiKey()
+    responses = generator.YubiKeyResponses(YubiKey=yk)
+    assert responses.response(1) == b'spam spam spam spam '
+    assert responses.response(1) == b'spam spam spam spam '
+    responses.response(2)
+    assert yk.slot == 2
+    assert (yk.opened, yk.challenged) == (1, 2)
+    responses.clear()
+    responses.response(1)
+    assert (yk.opened, yk.challenged) == (2, 3)
+
+
+def test_yubikey_responses_ttl():
+    yk = FakeYubiKey()
+    clock = FakeClock()
+    responses = generator.YubiKeyResponses(ttl=10, clock=clock, YubiKey=yk)
+    responses.response(1)
+    clock.now = 9
+    responses.response(1)
+    assert yk.challenged == 1
+    clock.now = 10
+    responses.response(1)
+    assert (yk.opened, yk.challenged) == (1, 2)
+
+
+def test_yubikey_responses_reopen_after_failure():
+    yk = FakeYubiKey()
+    yk.fail = True
+    responses = generator.YubiKeyResponses(YubiKey=yk)
+    with pytest.raises(IOError):
+        responses.response(1)
+    yk.fail = False
+    assert responses.response(1) == b'spam spam spam spam '
+    assert (yk.opened, yk.challenged) == (2, 2)
+
+
+@skip_without_yubikey
+def test_yubikey_session(request):
+    request.addfinalizer(generator.disable_yubikey_session)
+    yk = FakeYubiKey()
+    session = generator.enable_yubikey_session()
+    session._YubiKey = yk
+    options = {'method': 'keccak', 'iterations': 1, 'yubikey-slot': 2,
+               'multibase': MultiBase(['abc'] * 5)}
+    generator.generate(None, 'passacre', 'example.com', options)
+    generator.generate_batch([(None, 'passacre', site, options) for site in ['a', 'b', 'c']])
+    assert (yk.opened, yk.challenged) == (1, 1)
+    generator.disable_yubikey_session()
+    assert generator.yubikey_session is None
+
+
+@skip_without_yubikey
+def test_generate_batch_uses_yubikey_once(monkeypatch):
+    yk = FakeYubiKey()
+    monkeypatch.setattr(
+        generator, 'YubiKeyResponses',
+        lambda YubiKeyResponses=generator.YubiKeyResponses: YubiKeyResponses(YubiKey=yk))
+    options = {'method': 'keccak', 'iterations': 1, 'yubikey-slot': 2,
+               'multibase': MultiBase(['abc'] * 5)}
+    jobs = [(None, 'passacre', site, options) for site in ['a', 'b', 'c']]
+    assert len(set(generator.generate_many(jobs, workers=2))) == 3
+    assert (yk.opened, yk.challenged) == (1, 1)
+
+
+@pytest.mark.parametrize('method', ['keccak', 'skein'])
+@pytest.mark.parametrize('rounds', [0, 1, 2, 7])
+@pytest.mark.parametrize('site', [b'example.com', b'example.org.'])
+def test_null_rounds_match_absorbed_nulls(method, rounds, site):
+    expected = Generator(method)
+    expected.absorb_username_password_site(
+        None, b'passacre', site + b'\x00' * 1024 * rounds)
+    g = Generator(method)
+    g.absorb_username_password_site(None, b'passacre', site)
+    g.absorb_null_rounds(rounds)
+    assert g.squeeze(97) == expected.squeeze(97)
+
+
+@pytest.mark.parametrize('rounds', [0, 1, 2])
+def test_wide_keccak_null_rounds(rounds):
+    # a round is as many permutations as 1024 bytes at the narrow 8-byte rate
+    expected = Generator('keccak-wide')
+    expected.absorb_username_password_site(
+        None, b'passacre', b'example.com' + b'\x00' * (1024 // 8 * 136 * rounds))
+    g = Generator('keccak-wide')
+    g.absorb_username_password_site(None, b'passacre', b'example.com')
+    g.absorb_null_rounds(rounds)
+    assert g.squeeze(300) == expected.squeeze(300)
+
+
+def test_wide_keccak_differs():
+    assert Generator('keccak-wide').squeeze(32) != Generator('keccak').squeeze(32)
+
+
+def test_hash_site_wide_keccak():
+    options = {'method': 'keccak-wide', 'iterations': 2}
+    g = generator.build_generator(None, 'passacre', 'example.com', options)
+    assert generator.hash_site('passacre', 'example.com', options) == python_squeeze_for_multibase(
+        g, generator._site_multibase, exact_bits=True)
+
+
+def python_squeeze_for_multibase(g, mb, exact_bits=False):
+    required_bytes = multibase_required_bytes(mb)
+    mask = (1 << required_bytes * 8) - 1
+    if exact_bits:
+        mask = (1 << multibase_required_bits(mb)) - 1
+    while True:
+        value = int_of_bytes(g.squeeze(required_bytes)) & mask
+        if value <= mb.max_encodable_value:
+            return mb.encode(value)
+
+
+native_multibases = [
+    MultiBase([string.printable] * 32),
+    # mostly rejected
+    MultiBase([string.digits * 26, 'ab']),
+    MultiBase([['spam', 'eggs', 'sp' + unichr(0xe4) + 'm'], ' ', [unichr(0x2603), 'x']] * 5
+              + [string.digits]),
+    MultiBase([]),
+    MultiBase.of_runs([(string.printable, 40), (MultiBase([[', '], ['spam', 'eggs']]), 3)]),
+    # every radix is a power of two
+    MultiBase.of_runs([(string.hexdigits[:16], 70), ('-', 1), (['spam', 'eggs'], 3)]),
+    MultiBase(['ab'] * 9 + ['-']),
+]
+
+
+@pytest.mark.parametrize('method', ['keccak', 'skein'])
+@pytest.mark.parametrize('mb', native_multibases)
+def test_squeeze_for_multibase_matches_python(method, mb):
+    expected = Generator(method)
+    expected.absorb_username_password_site(None, b'passacre', b'example.com')
+    g = Generator(method)
+    g.absorb_username_password_site(None, b'passacre', b'example.com')
+    for _ in range(3):
+        assert g.squeeze_for_multibase(mb) == python_squeeze_for_multibase(expected, mb)
+
+
+@pytest.mark.parametrize('method', ['keccak', 'skein'])
+@pytest.mark.parametrize('mb', native_multibases)
+def test_generate_for_multibase(method, mb):
+    g = Generator(method)
+    g.absorb_username_password_site(b'passacre', b'passacre', b'example.com')
+    g.absorb_null_rounds(2)
+    assert _libpassacre_impl.generate_for_multibase(
+        method, b'passacre', b'passacre', b'example.com', 2, mb) == python_squeeze_for_multibase(g, mb)
+
+
+@pytest.mark.parametrize(('max_value', 'bits'), [
+    (0, 0), (1, 1), (255, 8), (256, 9), (511, 9), (512, 10), (2 ** 64 - 1, 64)])
+def test_multibase_required_bits(max_value, bits):
+    class FakeMultiBase(object):
+        max_encodable_value = max_value
+    assert multibase_required_bits(FakeMultiBase()) == bits
+
+
+@pytest.mark.parametrize('method', ['keccak', 'skein'])
+@pytest.mark.parametrize('mb', native_multibases + [MultiBase(['ab'] * 9)])
+def test_exact_bits_methods(method, mb):
+    expected = Generator(method)
+    g = Generator(method + '-v2')
+    for _ in range(3):
+        assert g.squeeze_for_multibase(mb) == python_squeeze_for_multibase(
+            expected, mb, exact_bits=True)
+    expected = Generator(method)
+    expected.absorb_username_password_site(None, b'passacre', b'example.com')
+    assert _libpassacre_impl.generate_for_multibase(
+        method + '-v2', None, b'passacre', b'example.com', 0, mb) == python_squeeze_for_multibase(
+            expected, mb, exact_bits=True)
+
+
+def test_exact_bits_methods_never_reject_powers_of_two():
+    # 512 possible values takes 2 bytes, so whole-byte squeezing rejects 7/8 of
+    # draws, but 9 bits always fits
+    mb = MultiBase(['ab'] * 9)
+    g = Generator('keccak-v2')
+    expected = Generator('keccak')
+    for _ in range(16):
+        g.squeeze_for_multibase(mb)
+    g.squeeze(2)
+    assert g.squeeze(32) == expected.squeeze(16 * 2 + 2 + 32)[-32:]
+
+
+def test_compiled_multibase_follows_bases():
+    mb = MultiBase(['ab'] * 8)
+    g = Generator('keccak')
+    g.squeeze_for_multibase(mb)
+    mb.bases = ['cd'] * 8
+    assert set(g.squeeze_for_multibase(mb)) <= set('cd')
+
+
+def test_native_bases_are_shared():
+    words = ['%03d' % (e,) for e in range(1000)]
+    first = MultiBase.of_runs([(words, 2), (' ', 1), (words, 2)])
+    second = MultiBase.of_runs([(words, 3)])
+    first_native = _libpassacre_impl.compile_multibase(first)
+    second_native = _libpassacre_impl.compile_multibase(second)
+    assert len(first_native._bases) == 2
+    assert first_native._bases[0] is second_native._bases[0]
+    g = Generator('keccak')
+    assert len(g.squeeze_for_multibase(first).split(' ')) == 2
+    assert len(g.squeeze_for_multibase(second)) == 9
+
+
+skip_without_shake = pytest.mark.skipif(
+    "not hasattr(hashlib, 'shake_256')", reason='hashlib has no shake_256')
+shake_methods = ['shake256'] if hasattr(hashlib, 'shake_256') else []
+
+
+batch_jobs = [
+    (username, 'passacre', site, {
+        'method': method, 'iterations': iterations, 'multibase': multibase})
+    for method in ['keccak', 'skein', 'keccak-v2', 'keccak-wide'] + shake_methods
+    for username in [None, 'passacre']
+    for site, iterations, multibase in [
+        ('example.com', 10, MultiBase([string.digits] * 8)),
+        ('example.org', 0, MultiBase([string.printable] * 32)),
+        # mostly rejected, to exercise squeezing past the batched output
+        ('example.net', 3, MultiBase([string.digits * 26, 'ab'])),
+    ]
+]
+
+def test_generate_batch():
+    expected = [generator.generate(*job) for job in batch_jobs]
+    assert generator.generate_batch(batch_jobs) == expected
+
+
+def test_generate_batch_empty():
+    assert generator.generate_batch([]) == []
+
+
+def test_generate_batch_invalid_method():
+    options = {'method': 'invalid', 'iterations': 12, 'multibase': MultiBase(['ab'])}
+    with pytest.raises(ValueError):
+        generator.generate_batch([(None, 'passacre', 'example.com', options)])
+
+
+@pytest.mark.parametrize('workers', [None, 1, 3])
+def test_generate_many(workers):
+    expected = [generator.generate(*job) for job in batch_jobs]
+    assert generator.generate_many(batch_jobs, workers=workers) == expected
+
+
+def test_generate_many_empty():
+    assert generator.generate_many([], workers=2) == []
+
+
+@pytest.mark.parametrize('method', ['keccak', 'skein'])
+def test_snapshot_restore(method):
+    g = Generator(method)
+    g.absorb_username_password_site(None, b'passacre', b'example.com')
+    g.absorb_null_rounds(3)
+    snapshot = g.snapshot()
+    expected = g.squeeze(32)
+    g.restore(snapshot)
+    assert g.squeeze(32) == expected
+    restored = Generator(method)
+    restored.restore(snapshot)
+    assert restored.squeeze(32) == expected
+
+
+def test_restore_wrong_algorithm():
+    snapshot = Generator('keccak').snapshot()
+    with pytest.raises(GeneratorError):
+        Generator('skein').restore(snapshot)
+
+
+def test_restore_wrong_length():
+    g = Generator('keccak')
+    with pytest.raises(GeneratorError):
+        g.restore(g.snapshot()[:-1])
+
+
+def corrupt_snapshot(snapshot, fmt, expected, offset, value):
+    """Overwrite one field of a snapshot, found by the fields it starts with.
+
+    ``expected`` are the values of the fields described by ``fmt``, which
+    must appear exactly once in the snapshot, and the native unsigned int
+    ``offset`` bytes after where they start is replaced by ``value``.
+    """
+
+    start = snapshot.find(struct.pack(fmt, *expected))
+    assert start >= 0 and snapshot.find(struct.pack(fmt, *expected), start + 1) < 0
+    start += offset
+    return snapshot[:start] + struct.pack('=I', value) + snapshot[start + 4:]
+
+
+@pytest.mark.parametrize('squeezed, offset, value', [
+    # rate, then capacity, then the same for keccak-wide
+    (0, 0, 1088),
+    (0, 4, 512),
+    # bitsInQueue past the queue, and not a whole number of bytes
+    (0, 8, 32000),
+    (0, 8, 4),
+    # fixedOutputLength
+    (0, 12, 64),
+    # squeezing before finishing absorbing, and not a boolean
+    (0, 16, 1),
+    (8, 16, 2),
+    # bitsAvailableForSqueezing before squeezing, past the block, and not a
+    # whole number of bytes
+    (0, 20, 8),
+    (8, 20, 32000),
+    (8, 20, 12),
+])
+def test_restore_corrupted_keccak(squeezed, offset, value):
+    g = Generator('keccak')
+    g.absorb_username_password_site(None, b'passacre', b'example.com')
+    if squeezed:
+        g.squeeze(squeezed)
+    snapshot = g.snapshot()
+    corrupted = corrupt_snapshot(snapshot, '=II', (64, 1536), offset, value)
+    with pytest.raises(GeneratorError):
+        g.restore(corrupted)
+    assert g.snapshot() == snapshot
+
+
+@pytest.mark.parametrize('offset, value', [
+    # hashBitLen, then bCnt past the block
+    (0, 1024),
+    (1, 32000),
+])
+def test_restore_corrupted_skein(offset, value):
+    g = Generator('skein')
+    snapshot = g.snapshot()
+    size_t = {4: 'I', 8: 'Q'}[_libpassacre_impl.ffi.sizeof('size_t')]
+    # a freshly initialized skein has a whole block of nulls buffered
+    corrupted = corrupt_snapshot(
+        snapshot, '=' + size_t * 2, (512, 64),
+        offset * struct.calcsize('=' + size_t), value)
+    with pytest.raises(GeneratorError):
+        g.restore(corrupted)
+    assert g.snapshot() == snapshot
+
+
+@pytest.mark.parametrize('method', ['keccak', 'skein'] + shake_methods)
+def test_generate_increments(method):
+    multibase = MultiBase([string.digits * 26, 'ab'])
+    expected = [
+        generator.generate('passacre', 'passacre', 'example.com', {
+            'method': method, 'iterations': iterations, 'multibase': multibase})
+        for iterations in range(5, 10)]
+    assert generator.generate_increments('passacre', 'passacre', 'example.com', {
+        'method': method, 'iterations': 5, 'multibase': multibase}, 5) == expected
+
+
+@pytest.fixture
+def restore_keccak_implementation(request):
+    request.addfinalizer(_libpassacre_impl.select_keccak_implementation)
+
+
+@pytest.mark.parametrize('implementation', [
+    name for name, supported in _libpassacre_impl.keccak_implementations() if supported])
+def test_keccak_implementations_agree(restore_keccak_implementation, implementation):
+    options = {'method': 'keccak', 'iterations': 3, 'multibase': MultiBase([string.printable] * 32)}
+    expected = generator.generate('passacre', 'passacre', 'example.com', options)
+    _libpassacre_impl.select_keccak_implementation(implementation)
+    assert _libpassacre_impl.keccak_implementation() == implementation
+    assert generator.generate('passacre', 'passacre', 'example.com', options) == expected
+
+
+def test_select_invalid_keccak_implementation(restore_keccak_implementation):
+    with pytest.raises(ValueError):
+        _libpassacre_impl.select_keccak_implementation('invalid')
+
+
+@pytest.fixture
+def restore_skein_implementation(request):
+    request.addfinalizer(_libpassacre_impl.select_skein_implementation)
+
+
+@pytest.mark.parametrize('implementation', _libpassacre_impl.skein_implementations())
+def test_skein_implementations_agree(restore_skein_implementation, implementation):
+    options = {'method': 'skein', 'iterations': 3, 'multibase': MultiBase([string.printable] * 32)}
+    expected = generator.generate('passacre', 'passacre', 'example.com', options)
+    _libpassacre_impl.select_skein_implementation(implementation)
+    assert _libpassacre_impl.skein_implementation() == implementation
+    assert generator.generate('passacre', 'passacre', 'example.com', options) == expected
+
+
+def test_select_invalid_skein_implementation(restore_skein_implementation):
+    with pytest.raises(ValueError):
+        _libpassacre_impl.select_skein_implementation('invalid')
+
+
+@pytest.mark.parametrize('kind', ['keccak', 'skein'])
+def test_implementation_picked_once_across_threads(
+        restore_keccak_implementation, restore_skein_implementation, kind):
+    select = getattr(_libpassacre_impl, 'select_%s_implementation' % (kind,))
+    active = getattr(_libpassacre_impl, '%s_implementation' % (kind,))
+    picked = []
+    for _ in range(3):
+        # go back to picking one automatically, then have several threads
+        # all try to be the first to pick
+        select()
+        threads = [
+            threading.Thread(target=lambda: picked.append(active()))
+            for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(set(picked[-8:])) == 1
+        assert active() == picked[-1]
+
+
+@pytest.fixture
+def restore_keccak_lanes(request):
+    request.addfinalizer(_libpassacre_impl.set_keccak_lanes)
+
+
+lockstep_jobs = [
+    ('keccak', None, b'passacre', b'example.com', 2, 32),
+    ('keccak', b'passacre', b'passacre', b'example.com', 2, 32),
+    # long enough to leave a different amount queued before the null rounds
+    ('keccak', b'passacre' * 9, b'passacre', b'example.com', 2, 16),
+    ('keccak', b'passacre', b'passacre', b'example.org', 2, 48),
+    ('keccak', b'passacre', b'passacre', b'example.org', 3, 32),
+    ('skein', b'passacre', b'passacre', b'example.com', 3, 32),
+    ('keccak', b'passacre', b'passacre', b'example.com', 3, 32),
+    ('keccak-wide', b'passacre', b'passacre', b'example.com', 3, 32),
+    ('keccak-wide', b'passacre' * 20, b'passacre', b'example.com', 3, 200),
+    ('keccak-wide', b'passacre', b'passacre', b'example.org', 3, 32),
+]
+
+
+@pytest.mark.parametrize('lanes', [
+    lanes for lanes in [1, 2, 4] if lanes <= _libpassacre_impl.keccak_lanes()])
+@pytest.mark.parametrize('implementation', [
+    name for name, supported in _libpassacre_impl.keccak_implementations() if supported])
+def test_batch_keccak_lanes(restore_keccak_implementation, restore_keccak_lanes,
+                            implementation, lanes):
+    _libpassacre_impl.select_keccak_implementation(implementation)
+    _libpassacre_impl.set_keccak_lanes(lanes)
+    expected = []
+    for algorithm, username, password, site, rounds, n_bytes in lockstep_jobs:
+        gen = Generator(algorithm)
+        gen.absorb_username_password_site(username, password, site)
+        gen.absorb_null_rounds(rounds)
+        expected.append(gen.squeeze(n_bytes))
+    assert [output for _, output in Generator.batch(lockstep_jobs)] == expected
+
+
+def test_set_invalid_keccak_lanes(restore_keccak_lanes):
+    with pytest.raises(ValueError):
+        _libpassacre_impl.set_keccak_lanes(3)
+
+
+@pytest.mark.parametrize('method', ['keccak', 'skein'])
+def test_squeeze_into(method):
+    expected = Generator(method)
+    g = Generator(method)
+    buf = bytearray(80)
+    assert g.squeeze_into(memoryview(buf)[16:48]) == 32
+    assert bytes(buf[16:48]) == expected.squeeze(32)
+    assert g.squeeze_into(buf) == 80
+    assert bytes(buf) == expected.squeeze(80)
+
+
+def test_squeeze_into_read_only():
+    with pytest.raises(TypeError):
+        Generator('keccak').squeeze_into(b'\0' * 8)
+
+
+@pytest.mark.parametrize('method', ['keccak', 'skein'])
+def test_reset(method):
+    g = Generator(method)
+    g.absorb_username_password_site(None, b'passacre', b'example.com')
+    g.squeeze(8)
+    g.reset()
+    assert g.squeeze(32) == Generator(method).squeeze(32)
+
+
+def test_reset_algorithm():
+    g = Generator('keccak')
+    g.reset('skein')
+    assert g.squeeze(32) == Generator('skein').squeeze(32)
+    with pytest.raises(ValueError):
+        g.reset('invalid')
+
+
+def test_generator_pool_reuses_generators():
+    pool = _libpassacre_impl.GeneratorPool(size=1)
+    with pool.generator('keccak') as g:
+        g.absorb_username_password_site(None, b'passacre', b'example.com')
+    with pool.generator('skein') as g2:
+        assert g2 is g
+        assert g2.squeeze(32) == Generator('skein').squeeze(32)
+    with pool.generator('keccak') as g3:
+        with pool.generator('keccak') as g4:
+            assert g4 is not g3
+    assert pool.acquire('keccak') in (g3, g4)
+
+
+def test_generator_pool_is_per_thread():
+    pool = _libpassacre_impl.GeneratorPool()
+    with pool.generator('keccak') as g:
+        pass
+    others = []
+    thread = threading.Thread(target=lambda: others.append(pool.acquire('keccak')))
+    thread.start()
+    thread.join()
+    assert others[0] is not g
+    assert pool.acquire('keccak') is g
+
+
+@skip_without_shake
+@pytest.mark.parametrize('username', [None, 'passacre'])
+@pytest.mark.parametrize('rounds', [0, 2, 130])
+def test_shake_matches_hashlib(username, rounds):
+    g = generator.build_generator(
+        username, 'passacre', 'example.com', {'method': 'shake256', 'iterations': rounds})
+    prefix = b'' if username is None else b'passacre:'
+    expected = hashlib.shake_256(
+        prefix + b'passacre:example.com' + b'\0' * (1024 // 8 * 136 * rounds)).digest(96)
+    assert g.squeeze(32) + g.squeeze(64) == expected
+
+
+@skip_without_shake
+def test_shake_squeeze_into():
+    g = _shake.ShakeGenerator()
+    expected = _shake.ShakeGenerator().squeeze(40)
+    buf = bytearray(32)
+    assert g.squeeze_into(memoryview(buf)[8:]) == 24
+    assert g.squeeze_into(buf) == 32
+    assert bytes(buf[:16]) == expected[24:]
+
+
+@skip_without_shake
+def test_shake_no_absorbing_after_squeezing():
+    g = _shake.ShakeGenerator()
+    g.squeeze(1)
+    with pytest.raises(ValueError):
+        g.absorb_null_rounds(1)
+    g.reset()
+    g.absorb_null_rounds(1)
+
+
+@skip_without_shake
+def test_shake_squeeze_for_multibase():
+    mb = MultiBase(['ab'] * 9)
+    g = generator.build_generator(None, 'passacre', 'example.com', {'method': 'shake256', 'iterations': 1})
+    expected = generator.build_generator(
+        None, 'passacre', 'example.com', {'method': 'shake256', 'iterations': 1})
+    assert g.squeeze_for_multibase(mb) == python_squeeze_for_multibase(expected, mb, exact_bits=True)
+
+
+@skip_without_shake
+def test_shake_does_not_load_libpassacre():
+    script = """
+import sys
+from passacre import generator
+from passacre.multibase import MultiBase
+options = {'method': 'shake256', 'iterations': 1, 'multibase': MultiBase(['ab'] * 8)}
+generator.generate('passacre', 'passacre', 'example.com', options)
+generator.hash_site('passacre', 'example.com', options)
+generator.generate_batch([('passacre', 'passacre', 'example.com', options)])
+sys.stdout.write(repr(sorted(m for m in sys.modules if 'libpassacre' in m or m.startswith('cffi'))))
+"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(generator.__file__)))
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=root)
+    assert output.decode() == '[]'
+
+
+@pytest.mark.parametrize(('method', 'absorb_blocks', 'squeeze_blocks'), [
+    # 22 + 10240 bytes at a rate of 8; padding, then 88 more bytes at 8 each
+    ('keccak', 1282, 12),
+    # the same at a rate of 136, where 96 bytes fit in the first block
+    ('keccak-wide', 1280, 1),
+    # 64 null bytes are buffered from init, and the last block stays buffered;
+    # finalizing is 2 blocks, plus 2 per 64 bytes of output
+    ('skein', 161, 6),
+])
+def test_stats(method, absorb_blocks, squeeze_blocks):
+    g = Generator(method)
+    assert set(g.stats.values()) == set([0])
+    g.absorb_username_password_site(b'u', b'passacre', b'example.com')
+    g.absorb_null_rounds(10)
+    g.squeeze(32)
+    g.squeeze(64)
+    null_round_bytes = 10 * 128 * 136 if method == 'keccak-wide' else 10 * 1024
+    assert g.stats == {
+        'bytes_absorbed': 22 + null_round_bytes,
+        'null_rounds': 10,
+        'absorb_blocks': absorb_blocks,
+        'bytes_squeezed': 96,
+        'squeeze_blocks': squeeze_blocks,
+        'rejections': 0,
+    }
+    g.reset()
+    assert set(g.stats.values()) == set([0])
+
+
+@pytest.mark.parametrize('method', ['keccak', 'skein', 'keccak-v2'] + shake_methods)
+def test_stats_rejections(method):
+    # only 129 of the 256 possible values of one byte can be encoded
+    mb = MultiBase([''.join(unichr(0x100 + i) for i in range(129))])
+    rejections = 0
+    for site in ['example.com', 'example.org', 'example.net', 'example.edu']:
+        g = generator.build_generator(None, 'passacre', site, {'method': method, 'iterations': 1})
+        g.squeeze_for_multibase(mb)
+        stats = g.stats
+        assert stats['bytes_squeezed'] == stats['rejections'] + 1
+        rejections += stats['rejections']
+    if method not in ('keccak-v2', 'shake256'):
+        assert rejections
+
+
+def test_stats_batch():
+    jobs = [('keccak', None, b'passacre', b'example.com', 10, 8)] * 4 + [
+        ('skein', None, b'passacre', b'example.com', 10, 8)]
+    for g, _ in Generator.batch(jobs):
+        stats = g.stats
+        reference = Generator(g._algorithm)
+        reference.absorb_username_password_site(None, b'passacre', b'example.com')
+        reference.absorb_null_rounds(10)
+        reference.squeeze(8)
+        assert stats == reference.stats
+
+    # only 129 of the 256 possible values of one byte can be encoded, so most
+    # first draws are rejected
+    mb = MultiBase([''.join(unichr(0x100 + i) for i in range(129))])
+    sites = [b'example.com', b'example.org', b'example.net', b'example.edu']
+    jobs = [('keccak', None, b'passacre', site, 10, 1) for site in sites]
+    rejections = 0
+    for (g, squeezed), site in zip(Generator.batch(jobs), sites):
+        encoded = g.encode_for_multibase(mb, squeezed)
+        reference = Generator('keccak')
+        reference.absorb_username_password_site(None, b'passacre', site)
+        reference.absorb_null_rounds(10)
+        assert encoded == reference.squeeze_for_multibase(mb)
+        assert g.stats == reference.stats
+        rejections += g.stats['rejections']
+    assert rejections
+
+
+@skip_without_shake
+def test_shake_stats():
+    g = _shake.ShakeGenerator()
+    g.absorb_username_password_site(None, b'passacre', b'example.com')
+    g.absorb_null_rounds(2)
+    snapshot = g.snapshot()
+    g.squeeze(200)
+    # 20 bytes, then two rounds of 128 blocks each
+    assert g.stats == {
+        'bytes_absorbed': 20 + 2 * 128 * 136,
+        'null_rounds': 2,
+        'absorb_blocks': 256,
+        'bytes_squeezed': 200,
+        'squeeze_blocks': 2,
+        'rejections': 0,
+    }
+    g.restore(snapshot)
+    assert g.stats['bytes_squeezed'] == 0
+
+
+def test_generate_with_stats():
+    options = {'method': 'keccak', 'iterations': 10, 'multibase': MultiBase(['abc'] * 5)}
+    password, stats = generator.generate_with_stats(None, 'passacre', 'example.com', options)
+    assert password == generator.generate(None, 'passacre', 'example.com', options)
+    assert stats['null_rounds'] == 10
+
+
+def _new_generator(method):
+    if method in _shake.METHODS:
+        return _shake.ShakeGenerator(method)
+    return Generator(method)
+
+
+@pytest.mark.parametrize('method', ['keccak', 'skein', 'keccak-wide'] + shake_methods)
+def test_chunked_absorption(method):
+    progress = []
+    chunked = ChunkedAbsorption(chunk_rounds=3, progress=lambda *a: progress.append(a))
+    g1 = _new_generator(method)
+    g1.absorb_username_password_site(None, b'passacre', b'example.com')
+    g1.absorb_null_rounds(8, chunked=chunked)
+    g2 = _new_generator(method)
+    g2.absorb_username_password_site(None, b'passacre', b'example.com')
+    g2.absorb_null_rounds(8)
+    assert g1.squeeze(64) == g2.squeeze(64)
+    assert progress == [(3, 8), (6, 8), (8, 8)]
+
+
+@pytest.mark.parametrize('method', ['keccak', 'skein'] + shake_methods)
+def test_chunked_absorption_cancelled(method):
+    cancel = threading.Event()
+    chunked = ChunkedAbsorption(chunk_rounds=2, progress=lambda *a: cancel.set(), cancel=cancel)
+    g1 = _new_generator(method)
+    with pytest.raises(NullRoundsInterrupted) as excinfo:
+        g1.absorb_null_rounds(5, chunked=chunked)
+    assert excinfo.value.reason == 'cancelled'
+    assert excinfo.value.absorbed == 2
+    g1.absorb_null_rounds(3)
+    g2 = _new_generator(method)
+    g2.absorb_null_rounds(5)
+    assert g1.squeeze(32) == g2.squeeze(32)
+
+
+def test_chunked_absorption_deadline():
+    chunked = ChunkedAbsorption(deadline=monotonic() - 1)
+    with pytest.raises(NullRoundsInterrupted) as excinfo:
+        Generator('keccak').absorb_null_rounds(5, chunked=chunked)
+    assert excinfo.value.reason == 'deadline exceeded'
+    assert excinfo.value.absorbed == 0
+    # nothing to absorb means there's no deadline to miss
+    Generator('keccak').absorb_null_rounds(0, chunked=chunked)
+
+
+def test_chunked_absorption_invalid_chunk_rounds():
+    with pytest.raises(ValueError):
+        ChunkedAbsorption(chunk_rounds=0)
+
+
+@pytest.mark.parametrize('method', ['keccak', 'skein'] + shake_methods)
+def test_generate_chunked(method):
+    options = {'method': method, 'iterations': 10, 'multibase': MultiBase(['abc'] * 5)}
+    chunked = ChunkedAbsorption(chunk_rounds=4)
+    assert (generator.generate(None, 'passacre', 'example.com', options, chunked=chunked)
+            == generator.generate(None, 'passacre', 'example.com', options))
+
+
+def test_generate_batch_chunked():
+    jobs = [
+        (None, 'passacre', site, {'method': method, 'iterations': iterations,
+                                  'multibase': MultiBase(['abc'] * 5)})
+        for site, method, iterations in [
+            ('example.com', 'keccak', 3), ('example.org', 'skein', 4),
+            ('example.net', 'keccak-v2', 0)]]
+    progress = []
+    chunked = ChunkedAbsorption(chunk_rounds=2, progress=lambda *a: progress.append(a))
+    assert generator.generate_batch(jobs, chunked=chunked) == generator.generate_batch(jobs)
+    assert progress == [(2, 7), (3, 7), (5, 7), (7, 7)]
+
+
+@pytest.fixture
+def state_cache(request):
+    request.addfinalizer(generator.disable_state_cache)
+    return generator.enable_state_cache()
+
+
+def test_generate_batch_chunked_uses_state_cache(state_cache, monkeypatch):
+    jobs = [
+        (None, 'passacre', site, {'method': method, 'iterations': iterations,
+                                  'multibase': MultiBase(['abc'] * 5)})
+        for site, method, iterations in [
+            ('example.com', 'keccak', 3), ('example.org', 'skein', 4)]]
+    expected = generator.generate_batch(jobs, chunked=ChunkedAbsorption(chunk_rounds=2))
+    # only the fully absorbed states are cached
+    assert len(state_cache) == 2
+    for username, password, site, options in jobs:
+        args = generator._generator_args(username, password, site, options)
+        assert state_cache.restore(args) is not None
+    absorbed = []
+    monkeypatch.setattr(Generator, 'absorb_null_rounds', lambda self, *a, **kw: absorbed.append(a))
+    assert generator.generate_batch(jobs, chunked=ChunkedAbsorption(chunk_rounds=2)) == expected
+    assert absorbed == []
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def _cache_args(site, method='keccak', username=None):
+    return method, username, b'passacre', site, 10
+
+
+def _cached_generator(cache, args):
+    method, username, password, site, iterations = args
+    g = Generator(method)
+    g.absorb_username_password_site(username, password, site)
+    g.absorb_null_rounds(iterations)
+    cache.put(args, g)
+    return g
+
+
+@pytest.mark.parametrize('method', ['keccak', 'skein', 'keccak-wide'])
+def test_state_cache_generates_the_same(method):
+    options = {'method': method, 'iterations': 10, 'multibase': MultiBase(['abc'] * 5)}
+    expected = generator.generate(None, 'passacre', 'example.com', options)
+    expected_site = generator.hash_site('passacre', 'example.com', options)
+    cache = generator.enable_state_cache()
+    try:
+        for _ in range(2):
+            assert generator.generate(None, 'passacre', 'example.com', options) == expected
+            assert generator.hash_site('passacre', 'example.com', options) == expected_site
+            assert generator.generate_batch(
+                [(None, 'passacre', 'example.com', options)]) == [expected]
+            # without a username, hashing the site absorbs the same as
+            # generating a password does
+            assert len(cache) == 1
+    finally:
+        generator.disable_state_cache()
+
+
+def test_state_cache_restores_instead_of_absorbing(state_cache, monkeypatch):
+    options = {'method': 'keccak', 'iterations': 10, 'multibase': MultiBase(['abc'] * 5)}
+    generator.generate(None, 'passacre', 'example.com', options)
+    absorbed = []
+    monkeypatch.setattr(Generator, 'absorb_null_rounds', lambda self, *a, **kw: absorbed.append(a))
+    generator.generate(None, 'passacre', 'example.com', options)
+    assert absorbed == []
+    generator.generate('user', 'passacre', 'example.com', options)
+    assert absorbed == [(10,)]
+
+
+def test_state_cache_ttl():
+    clock = FakeClock()
+    cache = generator.StateCache(ttl=10, clock=clock)
+    args = _cache_args(b'example.com')
+    _cached_generator(cache, args)
+    cached = next(iter(cache._entries.values()))[1]
+    clock.now = 9
+    assert cache.restore(args) is not None
+    clock.now = 10
+    assert cache.restore(args) is None
+    assert len(cache) == 0
+    # evicted states are zeroed and reinitialized
+    assert cached.snapshot() == Generator('keccak').snapshot()
+
+
+def test_state_cache_lru():
+    cache = generator.StateCache(size=2)
+    first, second, third = [_cache_args(site) for site in [b'a', b'b', b'c']]
+    _cached_generator(cache, first)
+    _cached_generator(cache, second)
+    assert cache.restore(first) is not None
+    _cached_generator(cache, third)
+    assert cache.restore(second) is None
+    assert cache.restore(first) is not None
+    assert cache.restore(third) is not None
+
+
+def test_state_cache_restore_into_generator():
+    cache = generator.StateCache()
+    args = _cache_args(b'example.com', method='skein')
+    expected = _cached_generator(cache, args).squeeze(32)
+    g = Generator('keccak')
+    assert cache.restore(args, g) is g
+    assert g.squeeze(32) == expected
+    # the cached state is a copy, unaffected by squeezing what was restored
+    assert cache.restore(args).squeeze(32) == expected
+
+
+def test_state_cache_keys():
+    cache = generator.StateCache()
+    _cached_generator(cache, _cache_args(b'example.com', username=None))
+    assert cache.restore(_cache_args(b'example.com', username=b'')) is None
+    assert cache.restore(_cache_args(b'example.com', method='keccak-v2')) is None
+    assert cache.restore(_cache_args(b'example.com', username=None)) is not None
+
+
+def test_state_cache_clear():
+    cache = generator.StateCache()
+    _cached_generator(cache, _cache_args(b'example.com'))
+    cached = next(iter(cache._entries.values()))[1]
+    cache.clear()
+    assert len(cache) == 0
+    assert cached.snapshot() == Generator('keccak').snapshot()
+
+
+@skip_without_shake
+def test_state_cache_skips_shake(state_cache):
+    options = {'method': 'shake256', 'iterations': 1, 'multibase': MultiBase(['abc'] * 5)}
+    generator.generate(None, 'passacre', 'example.com', options)
+    assert len(state_cache) == 0
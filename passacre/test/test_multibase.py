@@ -1,10 +1,16 @@
 # Copyright (c) Aaron Gallagher <_@habnab.it>
 # See COPYING for details.
 
+import random
+
 import pytest
 
+from passacre import features, multibase
 from passacre.multibase import MultiBase
 
+
+_shush_pyflakes = [features]
+
 digits = '0123456789'
 hexdigits = '0123456789abcdef'
 
@@ -90,3 +96,148 @@ def test_encoding_failures(mb, encoding_failure):
 def test_decoding_failures(mb, decoding_failure):
     with pytest.raises(ValueError):
         mb.decode(decoding_failure)
+
+
+def test_compile_is_cached():
+    mb = MultiBase([digits, hexdigits])
+    compiled = mb.compile()
+    assert mb.compile() is compiled
+    assert compiled.compile() is compiled
+    assert compiled.n_digits == 2
+    assert (compiled.required_bytes, compiled.required_bits) == (1, 8)
+
+
+def test_compile_after_replacing_bases():
+    mb = MultiBase([digits, digits])
+    compiled = mb.compile()
+    mb.bases = [hexdigits, hexdigits]
+    assert mb.compile() is not compiled
+    assert mb.max_encodable_value == 0xff
+
+
+def test_compiled_has_slots():
+    with pytest.raises(AttributeError):
+        MultiBase([digits]).compile().spam = 'eggs'
+
+
+def test_word_digits():
+    words = ['spam', 'eggs', 'spam', 'ham']
+    mb = MultiBase([words, ' ', words])
+    assert mb.encode(7) == 'eggs ham'
+    assert mb.decode(['eggs', ' ', 'ham']) == 7
+    # the first of any repeated symbols is used, as with list.index
+    assert mb.decode(['spam', ' ', 'spam']) == 0
+    with pytest.raises(ValueError):
+        mb.decode(['eggs', ' ', 'bacon'])
+
+
+def test_symbol_values_are_shared(monkeypatch):
+    built = []
+
+    def symbol_values_of(base):
+        built.append(base)
+        return real_symbol_values_of(base)
+
+    real_symbol_values_of = multibase._symbol_values_of
+    monkeypatch.setattr(multibase, '_symbol_values_of', symbol_values_of)
+    multibase._symbol_values.clear()
+    words = ['word%d' % (e,) for e in range(1000)]
+    first = MultiBase.of_runs([(words, 4)])
+    second = MultiBase.of_runs([(words, 2), (digits, 2)])
+    # nothing is gone through until something's decoded
+    first.compile()
+    second.compile()
+    assert built == []
+    assert first.decode(['word1', 'word2', 'word3', 'word4']) == 1002003004
+    assert second.decode(['word1', 'word2', '3', '4']) == 100234
+    assert built == [words, digits]
+
+
+def test_runs():
+    mb = MultiBase.of_runs([(digits, 3), (MultiBase([' ', hexdigits]), 2)])
+    assert mb.bases == [digits] * 3 + [' ', hexdigits] * 2
+    assert mb.max_encodable_value == 10 ** 3 * 16 ** 2 - 1
+    assert mb.encode(12345) == '048 3 9'
+    assert mb.decode('048 3 9') == 12345
+    with pytest.raises(ValueError):
+        mb.decode('048 3 g')
+    with pytest.raises(ValueError):
+        mb.decode('048 3 99')
+
+
+def test_bases_become_runs():
+    mb = MultiBase([digits, digits, hexdigits, digits])
+    assert mb.runs == [(digits, 2), (hexdigits, 1), (digits, 1)]
+
+
+def test_flat_runs():
+    mb = MultiBase.of_runs([(digits, 2), (MultiBase([' ', hexdigits]), 2), (digits, 0)])
+    assert list(mb.compile().flat_runs()) == [
+        (digits, 2), (' ', 1), (hexdigits, 1), (' ', 1), (hexdigits, 1)]
+
+
+def test_one_symbol_bases():
+    mb = MultiBase(['ab', '-', 'ab'])
+    assert mb.encode(3) == 'b-b'
+    assert MultiBase(['-'] * 100 + [digits]).encode(7) == '-' * 100 + '7'
+
+
+def test_power_of_two_bits():
+    assert MultiBase([hexdigits, '-', 'ab']).compile().bits == 5
+    assert MultiBase([hexdigits, digits]).compile().bits is None
+    mb = MultiBase.of_runs([(hexdigits, 100), (MultiBase(['ab', 'abcd']), 3)])
+    assert mb.compile().bits == 409
+    assert mb.max_encodable_value == 2 ** 409 - 1
+
+
+skip_without_numpy = pytest.mark.skipif(
+    'not features.numpy.usable', reason='numpy not usable')
+
+many_bases = [
+    MultiBase([digits] * 4),
+    MultiBase([hexdigits, '-', 'abc'] * 3),
+    MultiBase([['spam', 'eggs', 'ham'], ' '] * 5 + [digits]),
+    MultiBase.of_runs([(digits, 3), (MultiBase([' ', hexdigits]), 2)]),
+    MultiBase([]),
+]
+
+
+@skip_without_numpy
+@pytest.mark.parametrize('mb', many_bases)
+def test_encode_many(mb):
+    import numpy
+    rng = random.Random(0)
+    values = [0, mb.max_encodable_value] + [
+        rng.randrange(mb.max_encodable_value + 1) for _ in range(50)]
+    assert mb.encode_many(numpy.array(values, dtype=numpy.uint64)) == [
+        mb.encode(value) for value in values]
+
+
+@skip_without_numpy
+def test_encode_many_limbs():
+    import numpy
+    mb = MultiBase([digits] * 30 + [['spam', 'eggs']])
+    rng = random.Random(0)
+    values = [0, mb.max_encodable_value] + [
+        rng.randrange(mb.max_encodable_value + 1) for _ in range(50)]
+    limbs = numpy.array(
+        [[(value >> (32 * e)) & 0xffffffff for e in reversed(range(4))] for value in values],
+        dtype=numpy.uint32)
+    assert mb.encode_many(limbs) == [mb.encode(value) for value in values]
+
+
+@skip_without_numpy
+@pytest.mark.parametrize('values', [
+    [0, 100],
+    [[0, 0], [0, 100]],
+    [-1],
+])
+def test_encode_many_failures(values):
+    with pytest.raises(ValueError):
+        MultiBase([digits, digits]).encode_many(values)
+
+
+@skip_without_numpy
+def test_encode_many_wrong_type():
+    with pytest.raises(TypeError):
+        MultiBase([digits, digits]).encode_many([0.5])
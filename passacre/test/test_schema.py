@@ -3,11 +3,13 @@
 
 from __future__ import unicode_literals
 
+import random
 import sys
 
 import pytest
 
-from passacre import schema
+from passacre import config, schema
+from passacre.multibase import MultiBase
 
 
 if sys.version_info < (3,):
@@ -63,3 +65,101 @@ whilst parsing character sets:   [{0}' ', None]
 whilst parsing a character set:   {1}     None
 whilst parsing the value:         {1}     None
 expected a string; got None""".format(string_prefix, string_padding)
+
+
+def test_counted_items_are_runs():
+    mb = schema.multibase_of_schema([[4096, 'printable']], None)
+    assert mb.runs == [(schema.character_classes['printable'], 4096)]
+    assert mb.compile().n_digits == 4096
+
+
+@pytest.mark.parametrize('items', [
+    [[4, 'digit'], 'letter', [2, 'digit', 'symbols'], [4, 'digit']],
+    [['-', 3, [2, 'word'], 'digit'], [0, 'letter']],
+    [[' ', 4, 'word']],
+    [['', 3, 'digit']],
+    [[3, [':', 2, 'digit']]],
+])
+def test_runs_match_expanded_bases(items):
+    mb = schema.multibase_of_schema(items, ['spam', 'eggs', 'ham'])
+    expanded = MultiBase(mb.bases)
+    assert mb.max_encodable_value == expanded.max_encodable_value
+    for n in [0, 1, mb.max_encodable_value // 3, mb.max_encodable_value]:
+        encoded = mb.encode(n)
+        assert encoded == expanded.encode(n)
+        assert mb.decode(list(_split(expanded, encoded))) == n
+
+
+def _split(mb, encoded):
+    # split an encoding back into one symbol per digit
+    position = 0
+    for base in mb.bases:
+        symbol = next(s for s in sorted(base, key=len, reverse=True)
+                      if encoded.startswith(s, position))
+        position += len(symbol)
+        yield symbol
+
+
+def per_digit_encode(mb, n):
+    # how MultiBase.encode worked before runs were converted in chunks
+    ret = []
+    for base in reversed(mb.bases):
+        n, d = divmod(n, len(base))
+        ret.append(base[d])
+    ret.reverse()
+    return ''.join(ret)
+
+
+@pytest.mark.parametrize('items', [
+    [[4096, 'printable']],
+    [[' ', 40, 'word']],
+    [[100, 'word']],
+    [['-', 3, [50, 'digit'], 'letter']],
+    [[3, ['-', 2, [40, 'lowercase']]], [70, 'alphanumeric']],
+    ['printable', [', ', 4, 'word'], 'printable'],
+    [[300, ['alphanumeric', '-_']]],
+    [['-', 5, [8, ['digit', 'abcdef']]], 'ab'],
+])
+def test_encoding_matches_per_digit(items):
+    mb = schema.multibase_of_schema(items, ['spam', 'eggs', 'ham', 'sp\xe4m'])
+    rng = random.Random(0)
+    values = [0, 1, mb.max_encodable_value] + [
+        rng.randrange(mb.max_encodable_value + 1) for _ in range(10)]
+    for n in values:
+        assert mb.encode(n) == per_digit_encode(mb, n)
+
+
+def test_multibase_of_schema_is_shared():
+    words = ['spam', 'eggs']
+    mb = schema.multibase_of_schema([[' ', 4, 'word'], [8, 'digit']], words)
+    assert schema.multibase_of_schema([[' ', 4, 'word'], [8, 'digit']], words) is mb
+    assert schema.multibase_of_schema([[' ', 4, 'word'], [8, 'digit']], list(words)) is not mb
+    assert schema.multibase_of_schema([[' ', 4, 'word'], [9, 'digit']], words) is not mb
+
+
+def test_multibase_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(schema, 'MULTIBASE_CACHE_SIZE', 2)
+    schema.clear_multibase_cache()
+    mb = schema.multibase_of_schema([[1, 'digit']], None)
+    schema.multibase_of_schema([[2, 'digit']], None)
+    assert schema.multibase_of_schema([[1, 'digit']], None) is mb
+    schema.multibase_of_schema([[3, 'digit']], None)
+    schema.multibase_of_schema([[4, 'digit']], None)
+    assert schema.multibase_of_schema([[1, 'digit']], None) is not mb
+    assert len(schema._multibase_cache) == 2
+
+
+def test_verifying_schemata_shares_cached_multibases():
+    schema.clear_multibase_cache()
+    for _ in range(3):
+        config.verify_multibase_schema([[' ', 4, 'word'], [8, 'digit']])
+    assert len(schema._multibase_cache) == 1
+
+
+def test_multibase_cache_holds_words():
+    schema.clear_multibase_cache()
+    mb = schema.multibase_of_schema([[2, 'word']], ['spam', 'eggs'])
+    # the list isn't referenced anywhere else, so only the cache keeps its id
+    # from being reused by the next list
+    assert schema.multibase_of_schema([[2, 'word']], ['ham', 'bacon']) is not mb
+    assert mb.encode(0) == 'spamspam'
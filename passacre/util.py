@@ -3,7 +3,7 @@
 
 import json
 
-from passacre.compat import crochet_setup, wait_for_reactor
+from passacre.compat import crochet_setup, monotonic, wait_for_reactor
 from passacre import jsonmini
 
 
@@ -95,3 +95,60 @@ def lazily_wait_for_reactor(f):
         crochet_setup()
         return f(*a, **kw)
     return wrap
+
+
+class NullRoundsInterrupted(Exception):
+    """Absorbing null rounds was cancelled or ran past its deadline.
+
+    ``absorbed`` is how many rounds were absorbed before stopping; the
+    generator is left as if it had been asked to absorb only that many, so the
+    rest can still be absorbed later.
+    """
+
+    def __init__(self, reason, absorbed):
+        Exception.__init__(self, reason, absorbed)
+        self.reason = reason
+        self.absorbed = absorbed
+
+
+class ChunkedAbsorption(object):
+    """Absorb null rounds a chunk of ``chunk_rounds`` at a time instead of all
+    at once, which makes a long absorption interruptible.
+
+    After each chunk, ``progress`` is called (if given) with the number of
+    rounds absorbed so far and the total. Before each chunk, absorption stops
+    with ``NullRoundsInterrupted`` if ``cancel`` (e.g. a ``threading.Event``)
+    is set, or if ``passacre.compat.monotonic()`` has reached ``deadline``.
+    KeyboardInterrupt also gets a chance to be raised between chunks.
+    Absorbing in chunks produces the same state as absorbing all at once.
+    """
+
+    def __init__(self, chunk_rounds=100, progress=None, deadline=None, cancel=None):
+        if chunk_rounds < 1:
+            raise ValueError('chunk_rounds must be positive', chunk_rounds)
+        self.chunk_rounds = chunk_rounds
+        self.progress = progress
+        self.deadline = deadline
+        self.cancel = cancel
+
+    def absorb(self, absorb_chunk, rounds, offset=0, total=None):
+        """Absorb ``rounds`` null rounds by calling ``absorb_chunk`` with the
+        size of each chunk.
+
+        ``offset`` and ``total`` are passed to ``progress`` for when this is
+        one part of a larger absorption; ``total`` defaults to ``rounds``.
+        """
+
+        if total is None:
+            total = rounds
+        absorbed = 0
+        while absorbed < rounds:
+            if self.cancel is not None and self.cancel.is_set():
+                raise NullRoundsInterrupted('cancelled', absorbed)
+            if self.deadline is not None and monotonic() >= self.deadline:
+                raise NullRoundsInterrupted('deadline exceeded', absorbed)
+            chunk = min(self.chunk_rounds, rounds - absorbed)
+            absorb_chunk(chunk)
+            absorbed += chunk
+            if self.progress is not None:
+                self.progress(offset + absorbed, total)